@@ -0,0 +1,132 @@
+from typing import Any, Dict, List, Tuple
+import json
+import os
+import threading
+from eth_utils.abi import collapse_if_tuple, function_abi_to_4byte_selector
+from web3 import Web3
+import eth_codec
+
+ABI_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ABI')
+
+_lock = threading.RLock()
+_abis: Dict[str, List[Dict[str, Any]]] = dict()
+_contracts: Dict[Tuple[str, str, str], 'ContractRef'] = dict()
+_functions: Dict[Tuple[int, str], Tuple[List[Dict[str, Any]], 'FunctionSpec']] = dict()
+
+
+class FunctionSpec:
+    def __init__(self, fn_abi: Dict[str, Any]):
+        """
+        Pre-computed selector and argument/return types of one contract function.
+
+        Args:
+        fn_abi (Dict[str, Any]): The ABI entry of the function.
+        """
+        self.name = fn_abi.get('name')
+        self.selector = function_abi_to_4byte_selector(fn_abi)
+        self.input_types = [collapse_if_tuple(x) for x in fn_abi.get('inputs', [])]
+        self.output_types = [collapse_if_tuple(x) for x in fn_abi.get('outputs', [])]
+        # the functions read by this project only take and return static types; eth_codec handles
+        # those without eth_abi's per-call type dispatch
+        self.static_inputs = eth_codec.is_static(self.input_types)
+        self.static_outputs = eth_codec.is_static(self.output_types)
+
+    def encode(self, args: tuple) -> bytes:
+        """
+        Returns the call data of the function called with args.
+        """
+        if self.static_inputs:
+            return self.selector + eth_codec.encode_values(self.input_types, args)
+        from eth_abi import encode
+        return self.selector + encode(self.input_types, args)
+
+    def decode(self, data: bytes) -> Any:
+        """
+        Decodes return data the way web3 `.call()` does: checksummed addresses, a single value unwrapped.
+        """
+        if self.static_outputs:
+            decoded = eth_codec.decode_values(self.output_types, data)
+        else:
+            from eth_abi import decode
+            decoded = decode(self.output_types, data)
+        decoded = [Web3.to_checksum_address(v) if t == 'address' else v for t, v in zip(self.output_types, decoded)]
+        return decoded[0] if len(decoded) == 1 else decoded
+
+
+def get_abi(name: str) -> List[Dict[str, Any]]:
+    """
+    Returns the parsed ABI/<name>.json. Each file is read once per process.
+
+    Args:
+    name (str): File name without extension, e.g. 'pair' or 'ERC20'.
+    """
+    abi = _abis.get(name)
+    if abi is not None:
+        return abi
+
+    with _lock:
+        if name not in _abis:
+            try:
+                with open(os.path.join(ABI_DIRECTORY, f'{name}.json'), 'r') as file:
+                    _abis[name] = json.load(file)
+            except Exception as e:
+                raise Exception(f'Error in get_abi for {name}: {e}')
+        return _abis[name]
+
+
+class ContractRef:
+    def __init__(self, web3: Web3, address: str, abi: List[Dict[str, Any]]):
+        """
+        Address and ABI of a contract, all CallBatch.add needs. Building a web3 contract object creates a class per
+        ABI function, which costs more than the reads themselves; it is only built if `functions` is used.
+        """
+        self.web3 = web3
+        self.address = address
+        self.abi = abi
+        self._contract = None
+
+    @property
+    def functions(self) -> Any:
+        if self._contract is None:
+            self._contract = self.web3.eth.contract(address=self.address, abi=self.abi)
+        return self._contract.functions
+
+
+def get_contract(web3: Web3, blockchain: str, address: str, abi_name: str) -> ContractRef:
+    """
+    Returns the contract of (blockchain, address, abi), building it only once.
+
+    Args:
+    web3 (Web3): Connection of the blockchain, used when the contract is built.
+    blockchain (str): Name of the blockchain, part of the cache key.
+    address (str): Checksummed contract address.
+    abi_name (str): Name of the ABI file, see get_abi.
+    """
+    key = (blockchain, address, abi_name)
+    contract = _contracts.get(key)
+    if contract is not None:
+        return contract
+
+    with _lock:
+        if key not in _contracts:
+            _contracts[key] = ContractRef(web3, address, get_abi(abi_name))
+        return _contracts[key]
+
+
+def get_function_spec(abi: List[Dict[str, Any]], fn_name: str) -> FunctionSpec:
+    """
+    Returns the cached FunctionSpec of fn_name in the given ABI.
+    """
+    key = (id(abi), fn_name)
+    cached = _functions.get(key)
+    if cached is not None:
+        return cached[1]
+
+    with _lock:
+        if key not in _functions:
+            matches = [x for x in abi if x.get('type') == 'function' and x.get('name') == fn_name]
+            if len(matches) != 1:
+                raise Exception(f'Expected exactly one function named {fn_name} in ABI, found {len(matches)}')
+            # keep a reference to the abi so its id can't be reused by another list
+            _functions[key] = (abi, FunctionSpec(matches[0]))
+        return _functions[key][1]
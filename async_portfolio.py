@@ -0,0 +1,289 @@
+from typing import Any, Dict, List, Optional
+import asyncio
+import os
+import time
+from web3 import AsyncWeb3, AsyncHTTPProvider
+from batching import CallBatch, PendingCall, MULTICALL3_ADDRESS, encode_aggregate3, decode_aggregate3
+from chain_clients import RPC_ENV_VARS, BATCH_MODE_ENV_VARS, get_chain_client
+from routing import EndpointRouter
+from metadata_cache import get_metadata_cache
+from metrics import get_metrics
+from pricing import PriceGraph
+from snapshot import Snapshot, get_block_cache
+from query_plan import compile_config
+from mainV4 import TokenPortfolio, TokenYield, MULTICALL_CHUNK_SIZE, WALLET_ADDRESSES, TOKEN_PARTS, check_parts
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv('ASYNC_MAX_CONCURRENCY', 8))
+
+
+class RoutedAsyncHTTPProvider(AsyncHTTPProvider):
+    def __init__(self, router: EndpointRouter, **kwargs):
+        """
+        AsyncHTTPProvider that sends each request through a router (see routing.EndpointRouter.send_async), so async
+        reads fail over across every url of the chain and share the health of its endpoints with the blocking client.
+
+        Args:
+        router (routing.EndpointRouter): Router of the chain, see chain_clients.ChainClient.
+        """
+        super().__init__(router.urls[0], **kwargs)
+        self.router = router
+        self.providers = {url: AsyncHTTPProvider(url, **kwargs) for url in router.urls}
+
+    async def make_request(self, method: str, params: Any) -> Dict[str, Any]:
+        return await self.router.send_async(lambda url: self.providers[url].make_request(method, params))
+
+
+class AsyncCallBatch(CallBatch):
+    def __init__(self, web3: AsyncWeb3, semaphore: asyncio.Semaphore, chunk_size: int, use_multicall: bool, **kwargs):
+        """
+        Batch of reads sent with AsyncWeb3. Multicall chunks, or single eth_calls on chains without
+        Multicall3, are all in flight at once, bounded by the chain's semaphore.
+
+        Args:
+        web3 (AsyncWeb3): Async connection to the chain.
+        semaphore (asyncio.Semaphore): Limits the requests in flight to the chain.
+        chunk_size (int): Maximum number of calls per aggregate3 request.
+        use_multicall (bool): Send the calls through Multicall3 aggregate3.
+        """
+        super().__init__(web3, chunk_size, **kwargs)
+        self.semaphore = semaphore
+        self.use_multicall = use_multicall
+
+    def execute(self, block_identifier: Optional[Any] = None) -> List[PendingCall]:
+        raise Exception('AsyncCallBatch must be executed with `await batch.execute_async()`')
+
+    def _execute_chunk(self, chunk: List[PendingCall], block_identifier: Optional[Any]) -> None:
+        raise Exception('AsyncCallBatch must be executed with `await batch.execute_async()`')
+
+    async def execute_async(self, block_identifier: Optional[Any] = None) -> List[PendingCall]:
+        """
+        Sends every queued call that has not been executed yet.
+
+        Returns:
+        List[PendingCall]: The calls executed by this invocation.
+        """
+        pending = [call for call in self.calls if not call.done]
+        to_send = self.take_from_cache(pending, block_identifier)
+        if self.use_multicall:
+            await asyncio.gather(*[self._timed(self._execute_chunk_async(chunk, block_identifier), chunk) for chunk in self.chunks(to_send)])
+        else:
+            await asyncio.gather(*[self._timed(self._call_async(call, block_identifier), [call]) for call in to_send])
+        self.store_in_cache(to_send, block_identifier)
+        return pending
+
+    async def _timed(self, request, calls: List[PendingCall]) -> None:
+        started = time.perf_counter()
+        await request
+        get_metrics().record_calls(self.blockchain, calls, time.perf_counter() - started)
+
+    async def _execute_chunk_async(self, chunk: List[PendingCall], block_identifier: Optional[Any]) -> None:
+        try:
+            async with self.semaphore:
+                raw = await self.web3.eth.call(encode_aggregate3(chunk), block_identifier or 'latest')
+            results = decode_aggregate3(chunk, raw)
+        except Exception:
+            # the endpoint rejected the aggregate call; send the reads one by one
+            await asyncio.gather(*[self._call_async(call, block_identifier) for call in chunk])
+            return
+
+        for call, (success, return_data) in zip(chunk, results):
+            call.set_result(success, return_data)
+
+    async def _call_async(self, call: PendingCall, block_identifier: Optional[Any]) -> None:
+        tx = {'to': call.target, 'data': '0x' + call.call_data.hex()}
+        try:
+            async with self.semaphore:
+                raw = await self.web3.eth.call(tx, block_identifier or 'latest')
+            call.set_result(True, raw)
+        except Exception as e:
+            call.set_error(e)
+
+
+class AsyncTokenPortfolio(TokenPortfolio):
+    def __init__(self, token_data_list: list, pin_blocks: bool = True, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 chunk_size: int = MULTICALL_CHUNK_SIZE, wallets: List[str] = None, parts: List[str] = TOKEN_PARTS):
+        """
+        asyncio counterpart of TokenPortfolio. Construction does no network I/O; call `await portfolio.refresh()`.
+
+        Args:
+        token_data_list (list): Token entries of tokenInfo.json.
+        pin_blocks (bool): Read positions and prices at one block per chain, resolved at the start of each refresh.
+        max_concurrency (int): Maximum number of requests in flight per chain.
+        chunk_size (int): Maximum number of calls per aggregate3 request.
+        wallets (List[str]): Wallets to evaluate. Defaults to WALLET_ADDRESS.
+        parts (List[str]): Parts of every token to read, see TOKEN_PARTS.
+        """
+        self.parts = check_parts(parts)
+        self.wallets = [TokenYield.checksum_address(x) for x in (wallets or WALLET_ADDRESSES)]
+        self.token_data_list = token_data_list
+        self.pin_blocks = pin_blocks
+        self.max_concurrency = max_concurrency
+        self.chunk_size = chunk_size
+        self.tokens = []
+        self.errors: List[str] = []
+        self.all_tokens = dict()
+        self.wallet_holdings = dict()
+        self.holdings_by_chain = dict()
+        self.wallet_holdings_by_chain = dict()
+        self.wallet_values = dict()
+        self.prices = dict()
+        self.net_value = None
+        self.snapshot = None
+        self.dust_threshold = 0.0001
+
+        self._web3: Dict[str, AsyncWeb3] = dict()
+        self._semaphores: Dict[str, asyncio.Semaphore] = dict()
+        self._multicall: Dict[str, bool] = dict()
+        self._refreshing: Optional[asyncio.Future] = None
+        get_metadata_cache().check_config(token_data_list)
+        # compiled by the first refresh, queued on every refresh
+        self.plan = None
+
+    def get_async_web3(self, blockchain: str) -> AsyncWeb3:
+        if blockchain not in self._web3:
+            if blockchain not in RPC_ENV_VARS:
+                raise Exception("Unable to load web3")
+            # the router of the blocking client: failover and endpoint health, not its hedging nor its schedulers
+            self._web3[blockchain] = AsyncWeb3(RoutedAsyncHTTPProvider(get_chain_client(blockchain).router))
+            self._semaphores[blockchain] = asyncio.Semaphore(self.max_concurrency)
+        return self._web3[blockchain]
+
+    async def probe_multicall(self, blockchain: str) -> None:
+        """
+        Resolves once per chain if reads go through Multicall3 (see batching.make_batch for the modes).
+        """
+        if blockchain in self._multicall:
+            return
+        mode = os.getenv(BATCH_MODE_ENV_VARS.get(blockchain, ''), 'auto')
+        if mode != 'auto':
+            self._multicall[blockchain] = mode == 'multicall'
+            return
+        try:
+            code = await self.get_async_web3(blockchain).eth.get_code(AsyncWeb3.to_checksum_address(MULTICALL3_ADDRESS))
+            self._multicall[blockchain] = len(code) > 0
+        except Exception:
+            self._multicall[blockchain] = False
+
+    def make_batch(self, blockchain: str) -> AsyncCallBatch:
+        return AsyncCallBatch(self.get_async_web3(blockchain), self._semaphores[blockchain], self.chunk_size,
+                              self._multicall.get(blockchain, False), cache=get_block_cache(), blockchain=blockchain)
+
+    async def take_snapshot(self, blockchains: List[str]) -> Snapshot:
+        async def resolve(blockchain: str):
+            async with self._semaphores[blockchain]:
+                block = await self.get_async_web3(blockchain).eth.get_block('latest')
+            block_hash, parent_hash = block['hash'].hex(), block['parentHash'].hex()
+            get_block_cache().pin(blockchain, block['number'], block_hash, parent_hash)
+            return block['number'], block_hash
+
+        results = await asyncio.gather(*[resolve(blockchain) for blockchain in blockchains], return_exceptions=True)
+        blocks = dict()
+        for blockchain, result in zip(blockchains, results):
+            if isinstance(result, Exception):
+                print(f'Error resolving block for {blockchain}, reading at latest. error: {result}')
+            else:
+                blocks[blockchain] = result
+        return Snapshot(blocks)
+
+    async def refresh(self) -> float:
+        """
+        Re-reads every position and price and returns the net value. Concurrent callers share one refresh.
+        """
+        if self._refreshing is not None:
+            return await asyncio.shield(self._refreshing)
+
+        self._refreshing = asyncio.ensure_future(self._refresh())
+        try:
+            return await asyncio.shield(self._refreshing)
+        finally:
+            self._refreshing = None
+
+    async def _refresh(self) -> float:
+        blockchains = sorted({x.get('blockchain') for x in self.token_data_list if x.get('blockchain') in RPC_ENV_VARS})
+        for blockchain in blockchains:
+            self.get_async_web3(blockchain)
+        await asyncio.gather(*[self.probe_multicall(blockchain) for blockchain in blockchains])
+        if self.plan is None:
+            # the vault scan of compile_config uses the blocking clients, keep it off the event loop
+            self.plan = await asyncio.get_running_loop().run_in_executor(None, compile_config, self.token_data_list, self.wallets, self.parts)
+        self.snapshot = await self.take_snapshot(blockchains) if self.pin_blocks else None
+        self.errors = []
+
+        # positions: every chain's batch in flight at once
+        batches, queued_tokens = self.queue_tokens(self.make_batch)
+        await self.execute_batches(batches)
+        # then the state of the pools the wallets have a position in
+        if 'lp' in self.parts:
+            await self.execute_batches(self.queue_pool_states(queued_tokens, self.make_batch))
+
+        self.tokens = []
+        self.collect_tokens(queued_tokens, await self.read_blocks(blockchains))
+        self.sum_all_tokens()
+
+        # prices
+        price_graph = PriceGraph(self.tokens, self.chunk_size, self.snapshot)
+        reserves = dict()
+        pools_by_chain = price_graph.get_pools_by_chain()
+        results = await asyncio.gather(*[self._fetch_prices(price_graph, b, pools) for b, pools in pools_by_chain.items()], return_exceptions=True)
+        for blockchain, result in zip(pools_by_chain, results):
+            if isinstance(result, Exception):
+                self.report(f'Error fetching prices for {blockchain} error: {result}')
+            else:
+                reserves.update(result)
+        self.errors.extend(price_graph.errors)
+
+        self.price_graph = price_graph
+        self.prices = price_graph.get_prices(reserves)
+        self.symbol_prices = price_graph.get_symbol_prices(self.prices)
+        self.wallet_values = {wallet: self.value_holdings(self.prices, holdings, verbose=False) for wallet, holdings in self.wallet_holdings_by_chain.items()}
+        self.net_value = self.value_holdings(self.prices, verbose=False)
+        return self.net_value
+
+    async def read_blocks(self, blockchains: List[str]) -> Dict[str, int]:
+        """
+        Block the reads of every chain were made at, for the pending rewards: the snapshot's, else the head read now.
+        """
+        blocks = {blockchain: self.get_block(blockchain) for blockchain in blockchains if self.get_block(blockchain) is not None}
+
+        async def head(blockchain: str) -> int:
+            async with self._semaphores[blockchain]:
+                return await self.get_async_web3(blockchain).eth.block_number
+
+        missing = [blockchain for blockchain in blockchains if blockchain not in blocks]
+        results = await asyncio.gather(*[head(blockchain) for blockchain in missing], return_exceptions=True)
+        for blockchain, result in zip(missing, results):
+            if isinstance(result, Exception):
+                self.report(f'Error reading the block of {blockchain} error: {result}')
+            else:
+                blocks[blockchain] = result
+        return blocks
+
+    async def execute_batches(self, batches: Dict[str, AsyncCallBatch]) -> None:
+        chains = list(batches)
+        results = await asyncio.gather(*[batches[b].execute_async(self.get_block(b)) for b in chains], return_exceptions=True)
+        for blockchain, result in zip(chains, results):
+            if isinstance(result, Exception):
+                self.report(f'Error executing batch for {blockchain} error: {result}')
+
+    async def _fetch_prices(self, price_graph: PriceGraph, blockchain: str, pools: List[str]) -> Dict:
+        block = self.get_block(blockchain)
+
+        batch = self.make_batch(blockchain)
+        reserve_calls, token_calls = price_graph.queue_reserves(blockchain, pools, batch)
+        await batch.execute_async(block)
+        price_graph.apply_pool_tokens(blockchain, token_calls)
+
+        batch = self.make_batch(blockchain)
+        decimal_calls = price_graph.queue_decimals(blockchain, pools, batch)
+        await batch.execute_async(block)
+        price_graph.apply_decimals(blockchain, decimal_calls)
+
+        return price_graph.collect_reserves(blockchain, reserve_calls)
+
+    def get_net_value(self) -> float:
+        """
+        Returns the net value computed by the last refresh.
+        """
+        if self.net_value is None:
+            raise Exception('Error in get_net_value: call `await portfolio.refresh()` first')
+        return self.net_value
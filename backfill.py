@@ -0,0 +1,259 @@
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import bisect
+import concurrent.futures
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from chain_clients import RPC_ENV_VARS, get_chain_client
+from mainV4 import TokenPortfolio, TokenYield, TOKEN_PARTS, WALLET_ADDRESSES, load_token_data
+from metrics import write_metrics
+from query_plan import compile_config
+from snapshot import Snapshot
+
+DEFAULT_INTERVAL = 3600
+DEFAULT_WORKERS = 4
+DEFAULT_OUTPUT = 'backfill.jsonl'
+# env variables of archive endpoints, used instead of the RPC_ENV_VARS ones when set
+ARCHIVE_RPC_ENV_VARS = {
+    "Ethereum": "ETH_ARCHIVE_RPC",
+    "Binance": "BNB_ARCHIVE_RPC",
+}
+
+
+class BlockLocator:
+    def __init__(self, blockchain: str):
+        """
+        Finds the last block of a chain mined at or before a timestamp. Every block header fetched is
+        remembered, so consecutive samples narrow each other's search to a few requests.
+
+        Args:
+        blockchain (str): Name of the blockchain.
+        """
+        self.blockchain = blockchain
+        self.numbers: List[int] = []
+        self.headers: Dict[int, Tuple[int, str]] = dict()
+        self._lock = threading.Lock()
+
+    def header(self, number: Any) -> Tuple[int, int, str]:
+        """
+        Returns (number, timestamp, hash) of a block.
+        """
+        if number in self.headers:
+            return (number,) + self.headers[number]
+        block = get_chain_client(self.blockchain).web3.eth.get_block(number)
+        with self._lock:
+            if block['number'] not in self.headers:
+                bisect.insort(self.numbers, block['number'])
+            self.headers[block['number']] = (block['timestamp'], block['hash'].hex())
+        return block['number'], block['timestamp'], block['hash'].hex()
+
+    def bounds(self, timestamp: int) -> Tuple[Optional[int], Optional[int]]:
+        """
+        The closest known blocks before and after timestamp.
+        """
+        with self._lock:
+            low = high = None
+            for number in self.numbers:
+                if self.headers[number][0] <= timestamp:
+                    low = number
+                else:
+                    high = number
+                    break
+            return low, high
+
+    def block_at(self, timestamp: int) -> Tuple[int, str]:
+        """
+        Returns (number, hash) of the last block at or before timestamp, by interpolation search.
+        """
+        low, high = self.bounds(timestamp)
+        if high is None:
+            number, block_time, _ = self.header('latest')
+            if block_time <= timestamp:
+                return number, self.headers[number][1]
+            high = number
+        if low is None:
+            number, block_time, block_hash = self.header(1)
+            if block_time > timestamp:
+                raise Exception(f'Error in block_at: {timestamp} is before the first block of {self.blockchain}')
+            low = number
+
+        step = 0
+        while high - low > 1:
+            low_time, high_time = self.headers[low][0], self.headers[high][0]
+            if step % 2 == 0 and high_time > low_time:
+                guess = low + (timestamp - low_time) * (high - low) // (high_time - low_time)
+            else:
+                # alternate with bisection so uneven block times can't stall the search
+                guess = (low + high) // 2
+            guess = min(max(guess, low + 1), high - 1)
+            number, block_time, _ = self.header(guess)
+            if block_time <= timestamp:
+                low = number
+            else:
+                high = number
+            step += 1
+        return low, self.headers[low][1]
+
+
+class Backfill:
+    def __init__(self, token_data_list: list, output: str = DEFAULT_OUTPUT, workers: int = DEFAULT_WORKERS, store: Any = None):
+        """
+        Values the portfolio at a series of past timestamps, each on the blocks of every chain mined
+        at that time. Samples are spread over a bounded worker pool; each finished sample is appended
+        to the output file, which doubles as the checkpoint of an interrupted run.
+
+        Args:
+        token_data_list (list): Token entries of tokenInfo.json.
+        output (str): JSON lines file, one sample per line.
+        workers (int): Samples evaluated at the same time.
+        store (HistoryStore): Optional history store every sample is also exported to.
+        """
+        self.token_data_list = token_data_list
+        self.output = output
+        self.workers = max(1, workers)
+        self.store = store
+        self.blockchains = sorted({x.get('blockchain') for x in token_data_list if x.get('blockchain') in RPC_ENV_VARS})
+        self.locators = {blockchain: BlockLocator(blockchain) for blockchain in self.blockchains}
+        # every sample reads the same contracts, only at other blocks
+        self.plan = compile_config(token_data_list, [TokenYield.checksum_address(x) for x in WALLET_ADDRESSES], TOKEN_PARTS)
+        self._lock = threading.Lock()
+
+    def completed(self) -> set:
+        """
+        Timestamps already in the output file.
+        """
+        done = set()
+        if not os.path.exists(self.output):
+            return done
+        with open(self.output, 'r') as file:
+            lines = file.readlines()
+        if lines and not lines[-1].endswith('\n'):
+            # start the next sample on its own line
+            with open(self.output, 'a') as file:
+                file.write('\n')
+        for line in lines:
+            try:
+                done.add(json.loads(line)['timestamp'])
+            except Exception:
+                # a line cut short by an interruption; its sample is evaluated again
+                continue
+        return done
+
+    def evaluate(self, timestamp: int) -> Dict[str, Any]:
+        """
+        Values the portfolio at the blocks mined at timestamp. Raises if any read failed, so a partial sample
+        is neither written nor exported and the timestamp stays pending for the next run.
+        """
+        blocks = {blockchain: self.locators[blockchain].block_at(timestamp) for blockchain in self.blockchains}
+        portfolio = TokenPortfolio(self.token_data_list, snapshot=Snapshot(blocks), plan=self.plan)
+        net_value = portfolio.get_net_value(verbose=False)
+        if portfolio.errors:
+            raise Exception(f'Error in evaluate: {len(portfolio.errors)} failed reads, first: {portfolio.errors[0]}')
+        if self.store is not None:
+            portfolio.export(self.store, timestamp)
+        return {
+            'timestamp': timestamp,
+            'datetime': datetime.fromtimestamp(timestamp, timezone.utc).isoformat(),
+            'blocks': {blockchain: block[0] for blockchain, block in blocks.items()},
+            'netValue': net_value,
+            'holdings': portfolio.all_tokens,
+            'prices': portfolio.price_graph.get_symbol_prices(portfolio.prices),
+            'wallets': {wallet: {'holdings': portfolio.wallet_holdings.get(wallet, {}), 'netValue': value}
+                        for wallet, value in portfolio.wallet_values.items()},
+        }
+
+    def write(self, sample: Dict[str, Any]) -> None:
+        with self._lock:
+            with open(self.output, 'a') as file:
+                file.write(json.dumps(sample) + '\n')
+                file.flush()
+
+    def run(self, timestamps: List[int]) -> int:
+        """
+        Evaluates every timestamp missing from the output file.
+
+        Returns:
+        int: Number of samples that failed; running again retries them.
+        """
+        done = self.completed()
+        todo = [x for x in timestamps if x not in done]
+        print(f'{len(timestamps) - len(todo)} of {len(timestamps)} samples already done, {len(todo)} to go')
+
+        failed = 0
+        started = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.evaluate, timestamp): timestamp for timestamp in todo}
+            for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                try:
+                    sample = future.result()
+                    self.write(sample)
+                    print(f"[{i}/{len(todo)}] {sample['datetime']} {sample['blocks']} net value: {sample['netValue']}")
+                except Exception as exc:
+                    failed += 1
+                    print(f'Error evaluating sample {futures[future]} error: {exc}')
+        print(f'{len(todo) - failed} samples in {time.time() - started:.1f}s, {failed} failed')
+        return failed
+
+
+def sample_timestamps(start: int, end: int, interval: int) -> List[int]:
+    """
+    Every interval seconds from start to end, both included, aligned to the interval.
+    """
+    first = start + (-start % interval)
+    return list(range(first, end + 1, interval))
+
+
+def parse_time(value: str) -> int:
+    """
+    Unix seconds or an ISO date, e.g. 2024-01-01 or 2024-01-01T12:00 (UTC).
+    """
+    if value.isdigit():
+        return int(value)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def use_archive_endpoints() -> None:
+    """
+    Points the chain clients at the archive endpoints, if configured. Must run before the first client is created.
+    """
+    for blockchain, env_var in ARCHIVE_RPC_ENV_VARS.items():
+        if os.getenv(env_var):
+            os.environ[RPC_ENV_VARS[blockchain]] = os.getenv(env_var)
+
+
+def main():
+    """
+    Backfill command: `python backfill.py --start 2024-01-01 --interval 3600`. Re-running it resumes.
+    """
+    parser = argparse.ArgumentParser(description='Value the portfolio at past timestamps (needs archive nodes).')
+    parser.add_argument('--config', default='tokenInfo.json', help='token config (default: tokenInfo.json)')
+    parser.add_argument('--start', required=True, help='first timestamp, unix seconds or ISO date (UTC)')
+    parser.add_argument('--end', default=None, help='last timestamp (default: now)')
+    parser.add_argument('--interval', type=int, default=DEFAULT_INTERVAL, help='seconds between samples (default: 3600)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='samples evaluated at the same time')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='JSON lines output and checkpoint')
+    parser.add_argument('--store', default=None, help='also export every sample to this history store (see history_store.py)')
+    args = parser.parse_args()
+
+    use_archive_endpoints()
+    end = parse_time(args.end) if args.end else int(time.time())
+    timestamps = sample_timestamps(parse_time(args.start), end, args.interval)
+    store = None
+    if args.store:
+        from history_store import open_store
+        store = open_store(args.store)
+    backfill = Backfill(load_token_data(args.config), args.output, args.workers, store)
+    failed = backfill.run(timestamps)
+    write_metrics()
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
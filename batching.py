@@ -0,0 +1,354 @@
+from typing import Any, List, Optional
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from eth_abi import decode, encode
+from web3 import Web3
+from abi_registry import get_function_spec
+from metrics import get_metrics
+from scheduler import PRIORITY_POSITIONS
+
+# Multicall3 is deployed at the same address on Ethereum, Binance and most other EVM chains
+MULTICALL3_ADDRESS = '0xcA11bde05977b3631167028862bE2a173976CA11'
+AGGREGATE3_SELECTOR = '82ad56cb'  # aggregate3((address,bool,bytes)[])
+DEFAULT_CHUNK_SIZE = 100
+
+
+class PendingCall:
+    def __init__(self, contract, fn_name: str, args: tuple, allow_failure: bool = True, tag: str = None,
+                 priority: int = PRIORITY_POSITIONS):
+        """
+        A single contract read waiting to be sent as part of a batch.
+
+        Args:
+        contract: Contract the function belongs to, see abi_registry.get_contract.
+        fn_name (str): Name of the contract function to call.
+        args (tuple): Arguments for the function call.
+        allow_failure (bool): If False, a revert of this call reverts the whole multicall chunk.
+        tag (str): Who queued the call (e.g. the token symbol), for the RPC metrics.
+        priority (int): Calls with a lower priority are sent first, see scheduler.PRIORITY_PRICING.
+        """
+        self.function = get_function_spec(contract.abi, fn_name)
+        self.target = contract.address
+        self.fn_name = fn_name
+        self.args = args
+        self.allow_failure = allow_failure
+        self.tag = tag
+        self.priority = priority
+        self.call_data = self.function.encode(args)
+
+        self.done = False
+        self.success = False
+        self.error = None
+        self.raw_result = None
+        self._value = None
+
+    def set_result(self, success: bool, return_data: bytes) -> None:
+        """
+        Decodes the raw return data of the call, mirroring what web3 `.call()` would return.
+        """
+        self.done = True
+        self.raw_result = (success, return_data)
+        if not success:
+            self.error = 'call reverted'
+            return
+        try:
+            self._value = self.function.decode(return_data)
+        except Exception as e:
+            self.error = f'unable to decode return data: {e}'
+            return
+        self.success = True
+
+    def set_error(self, error: Any) -> None:
+        self.done = True
+        self.success = False
+        self.error = error
+
+    @property
+    def value(self) -> Any:
+        """
+        The decoded result. Raises if the batch has not been executed or the call failed.
+        """
+        if not self.done:
+            raise Exception(f'{self.fn_name} on {self.target} has not been executed yet')
+        if not self.success:
+            raise Exception(f'{self.fn_name}{self.args} on {self.target} failed: {self.error}')
+        return self._value
+
+    def __repr__(self) -> str:
+        return f'PendingCall({self.target}.{self.fn_name}{self.args})'
+
+
+class CachedCall:
+    def __init__(self, value: Any):
+        """
+        Stands in for a PendingCall whose result is already known, e.g. from the metadata cache.
+        """
+        self.done = True
+        self.success = True
+        self.error = None
+        self.value = value
+
+
+class CallBatch(ABC):
+    def __init__(self, web3: Web3, chunk_size: int = DEFAULT_CHUNK_SIZE, cache: Any = None, blockchain: str = None,
+                 scheduler: Any = None, response_cache: Any = None):
+        """
+        Collects contract reads for one chain so they can be sent in as few requests as possible.
+
+        Args:
+        web3 (Web3): Connection to the chain all queued calls belong to.
+        chunk_size (int): Maximum number of calls packed into one request.
+        cache (snapshot.BlockCache): Optional cache of results at pinned blocks. Only used when executed at a block number.
+        blockchain (str): Name of the chain, part of the cache key.
+        scheduler (scheduler.EndpointScheduler): Scheduler of the chain (see chain_clients). Chunks are sent concurrently
+            on its threads, highest priority first. Without it, chunks are sent one after the other.
+        response_cache (response_cache.ResponseCache): Optional cache of recent results shared with other batches.
+            Reads in flight in another batch are waited for instead of sent again.
+        """
+        self.web3 = web3
+        self.chunk_size = max(1, int(chunk_size))
+        self.cache = cache
+        self.blockchain = blockchain
+        self.scheduler = scheduler
+        self.response_cache = response_cache
+        self.calls: List[PendingCall] = []
+        self.tag = None
+        self.priority = PRIORITY_POSITIONS
+        self._index = dict()
+
+    @contextmanager
+    def tagged(self, tag: str, priority: int = None):
+        """
+        Tags the calls added inside the block, e.g. `with batch.tagged(symbol): ...`, and optionally sets their priority.
+        """
+        previous = (self.tag, self.priority)
+        self.tag = tag
+        if priority is not None:
+            self.priority = priority
+        try:
+            yield self
+        finally:
+            self.tag, self.priority = previous
+
+    def add(self, contract, fn_name: str, *args, allow_failure: bool = True) -> PendingCall:
+        """
+        Queues `contract.functions.<fn_name>(*args)` and returns a handle to read the result from after `execute`.
+        A read already in the batch returns the existing handle.
+        """
+        call = PendingCall(contract, fn_name, args, allow_failure, self.tag, self.priority)
+        # identical reads queued by several tokens or wallets are only sent once
+        key = (call.target, call.call_data, allow_failure)
+        if key in self._index:
+            get_metrics().record_duplicate(self.blockchain, call)
+            existing = self._index[key]
+            existing.priority = min(existing.priority, call.priority)
+            return existing
+        self._index[key] = call
+        self.calls.append(call)
+        return call
+
+    def execute(self, block_identifier: Optional[Any] = None) -> List[PendingCall]:
+        """
+        Sends every queued call that has not been executed yet, `chunk_size` calls per request,
+        the highest priority calls first.
+
+        Returns:
+        List[PendingCall]: The calls executed by this invocation.
+        """
+        pending = [call for call in self.calls if not call.done]
+        to_send = self.take_from_cache(pending, block_identifier)
+        if self.response_cache is None:
+            self.send(to_send, block_identifier)
+        else:
+            claimed = to_send
+            to_send, waiting = self.response_cache.claim(self.blockchain, block_identifier, claimed)
+            get_metrics().record_cached(self.blockchain, [call for call in claimed if call.done])
+            try:
+                self.send(to_send, block_identifier)
+            finally:
+                self.response_cache.complete(self.blockchain, block_identifier, to_send)
+            # reads another batch had in flight
+            unresolved = self.response_cache.wait(self.blockchain, block_identifier, waiting)
+            for call, _ in waiting:
+                if call.done:
+                    get_metrics().record_duplicate(self.blockchain, call)
+            self.send(unresolved, block_identifier)
+            to_send += unresolved
+        self.store_in_cache(to_send, block_identifier)
+        return pending
+
+    def send(self, calls: List[PendingCall], block_identifier: Optional[Any]) -> None:
+        """
+        Sends the calls in chunks, the highest priority calls first.
+        """
+        chunks = self.chunks(sorted(calls, key=lambda x: x.priority))
+        if self.scheduler is None:
+            for chunk in chunks:
+                self._execute_timed(chunk, block_identifier)
+        else:
+            self.scheduler.map(lambda chunk: self._execute_timed(chunk, block_identifier), chunks, [chunk[0].priority for chunk in chunks])
+
+    def _execute_timed(self, chunk: List[PendingCall], block_identifier: Optional[Any]) -> None:
+        started = time.perf_counter()
+        self._execute_chunk(chunk, block_identifier)
+        get_metrics().record_calls(self.blockchain, chunk, time.perf_counter() - started)
+
+    def take_from_cache(self, pending: List[PendingCall], block_identifier: Optional[Any]) -> List[PendingCall]:
+        """
+        Resolves the calls cached at the pinned block and returns the ones that still have to be sent.
+        """
+        if self.cache is None or not isinstance(block_identifier, int):
+            return pending
+        for call in pending:
+            cached = self.cache.get(self.blockchain, block_identifier, call.target, call.call_data)
+            if cached is not None:
+                call.set_result(*cached)
+        get_metrics().record_cached(self.blockchain, [call for call in pending if call.done])
+        return [call for call in pending if not call.done]
+
+    def store_in_cache(self, sent: List[PendingCall], block_identifier: Optional[Any]) -> None:
+        if self.cache is None or not isinstance(block_identifier, int):
+            return
+        # transport errors are not cached, only what the chain answered
+        for call in sent:
+            if call.raw_result is not None:
+                self.cache.set(self.blockchain, block_identifier, call.target, call.call_data, call.raw_result)
+
+    def chunks(self, calls: List[PendingCall]) -> List[List[PendingCall]]:
+        return [calls[i:i + self.chunk_size] for i in range(0, len(calls), self.chunk_size)]
+
+    @abstractmethod
+    def _execute_chunk(self, chunk: List[PendingCall], block_identifier: Optional[Any]) -> None:
+        """
+        Sends one chunk of calls and sets their results.
+        """
+
+    def __len__(self) -> int:
+        return len(self.calls)
+
+
+class MulticallBatch(CallBatch):
+    def __init__(self, web3: Web3, chunk_size: int = DEFAULT_CHUNK_SIZE, multicall_address: str = MULTICALL3_ADDRESS,
+                 fallback: CallBatch = None, **kwargs):
+        """
+        Sends the queued reads through Multicall3 `aggregate3`.
+
+        Args:
+        web3 (Web3): Connection to the chain all queued calls belong to.
+        chunk_size (int): Maximum number of calls packed into one aggregate3 request.
+        multicall_address (str): Address of the Multicall3 deployment.
+        fallback (CallBatch): Optional batch used to retry the calls of a chunk whose aggregate3 call failed as a whole.
+        """
+        super().__init__(web3, chunk_size, **kwargs)
+        self.multicall_address = Web3.to_checksum_address(multicall_address)
+        self.fallback = fallback
+
+    def _execute_chunk(self, chunk: List[PendingCall], block_identifier: Optional[Any]) -> None:
+        try:
+            raw = self.web3.eth.call(encode_aggregate3(chunk, self.multicall_address), block_identifier or 'latest')
+            results = decode_aggregate3(chunk, raw)
+        except Exception as e:
+            if self.fallback is not None:
+                # the endpoint rejected the aggregate call (missing deployment, size limits...); retry the reads one by one
+                self.fallback._execute_chunk(chunk, block_identifier)
+                return
+            # a failed aggregate call takes every call of the chunk with it
+            for call in chunk:
+                call.set_error(f'aggregate3 failed: {e}')
+            return
+
+        for call, (success, return_data) in zip(chunk, results):
+            call.set_result(success, return_data)
+
+
+def encode_aggregate3(chunk: List[PendingCall], multicall_address: str = MULTICALL3_ADDRESS) -> dict:
+    """
+    Returns the eth_call transaction running every call of the chunk through aggregate3.
+    """
+    encoded = encode(['(address,bool,bytes)[]'], [[(c.target, c.allow_failure, c.call_data) for c in chunk]])
+    return {'to': multicall_address, 'data': '0x' + AGGREGATE3_SELECTOR + encoded.hex()}
+
+
+def decode_aggregate3(chunk: List[PendingCall], raw: bytes) -> List[tuple]:
+    """
+    Decodes the (success, returnData) results of an aggregate3 call for the given chunk.
+    """
+    (results,) = decode(['(bool,bytes)[]'], raw)
+    if len(results) != len(chunk):
+        raise Exception(f'expected {len(chunk)} results, got {len(results)}')
+    return results
+
+
+class JsonRpcBatch(CallBatch):
+    """
+    Sends the queued reads as individual `eth_call`s packed into JSON-RPC batch arrays.
+    For endpoints without a usable Multicall3 deployment. Needs a provider with `make_batch_request`
+    (see rpc_provider.BatchHTTPProvider); otherwise the calls are sent one at a time.
+    """
+
+    def _execute_chunk(self, chunk: List[PendingCall], block_identifier: Optional[Any]) -> None:
+        block = block_identifier or 'latest'
+        if isinstance(block, int):
+            block = hex(block)
+
+        requests_list = [('eth_call', [{'to': c.target, 'data': '0x' + c.call_data.hex()}, block]) for c in chunk]
+        if not hasattr(self.web3.provider, 'make_batch_request'):
+            for call, (method, params) in zip(chunk, requests_list):
+                try:
+                    call.set_result(True, self.web3.eth.call(*params))
+                except Exception as e:
+                    call.set_error(e)
+            return
+
+        try:
+            responses = self.web3.provider.make_batch_request(requests_list)
+        except Exception as e:
+            for call in chunk:
+                call.set_error(f'json-rpc batch failed: {e}')
+            return
+
+        for call, response in zip(chunk, responses):
+            if 'error' in response:
+                call.set_error(response['error'])
+            else:
+                call.set_result(True, Web3.to_bytes(hexstr=response.get('result')))
+
+
+def has_multicall(web3: Web3, multicall_address: str = MULTICALL3_ADDRESS) -> bool:
+    """
+    Checks if Multicall3 is deployed at the expected address.
+    """
+    try:
+        return len(web3.eth.get_code(Web3.to_checksum_address(multicall_address))) > 0
+    except Exception:
+        return False
+
+
+def make_batch(web3: Web3, mode: str = 'auto', chunk_size: int = DEFAULT_CHUNK_SIZE, multicall_available: bool = None,
+               **kwargs) -> CallBatch:
+    """
+    Picks the batching transport for a chain.
+
+    Args:
+    web3 (Web3): Connection to the chain.
+    mode (str): 'multicall', 'jsonrpc' or 'auto'. 'auto' uses Multicall3 if it is deployed, JSON-RPC batching otherwise.
+    chunk_size (int): Maximum number of calls per request.
+    multicall_available (bool): Result of a previous has_multicall check, to skip probing the chain again.
+    kwargs: Passed on to the batch, e.g. cache and blockchain.
+
+    Returns:
+    CallBatch: An empty batch for the chain.
+    """
+    mode = (mode or 'auto').lower()
+    if mode == 'jsonrpc':
+        return JsonRpcBatch(web3, chunk_size, **kwargs)
+    elif mode == 'multicall':
+        return MulticallBatch(web3, chunk_size, **kwargs)
+    elif mode == 'auto':
+        if multicall_available is None:
+            multicall_available = has_multicall(web3)
+        if multicall_available:
+            return MulticallBatch(web3, chunk_size, fallback=JsonRpcBatch(web3, chunk_size), **kwargs)
+        return JsonRpcBatch(web3, chunk_size, **kwargs)
+    raise Exception(f'Unknown batch mode {mode}')
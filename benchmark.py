@@ -0,0 +1,199 @@
+from typing import Any, Dict, List
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# env overrides of each scenario, run against the same fake chains
+SCENARIOS = {
+    'auto': {},
+    'multicall': {'ETH_BATCH_MODE': 'multicall', 'BNB_BATCH_MODE': 'multicall'},
+    'jsonrpc': {'ETH_BATCH_MODE': 'jsonrpc', 'BNB_BATCH_MODE': 'jsonrpc'},
+}
+# metrics compared against a saved baseline; larger is worse for all of them
+COMPARED_METRICS = ('wall_time', 'valuation_time', 'http_requests', 'rpc_requests', 'eth_calls', 'bytes_in', 'bytes_out')
+
+
+def run_child(config_file: str) -> None:
+    """
+    One end-to-end valuation; prints a JSON line with the net value and the time spent in the app.
+    """
+    started = time.perf_counter()
+    from mainV4 import TokenPortfolio, load_token_data
+
+    imported = time.perf_counter()
+    portfolio = TokenPortfolio(load_token_data(config_file))
+    net_value = portfolio.get_net_value(verbose=False)
+    finished = time.perf_counter()
+    print(json.dumps({'net_value': net_value, 'tokens': len(portfolio.tokens),
+                      'import_time': imported - started, 'valuation_time': finished - imported}))
+
+
+def run_scenario(name: str, env: Dict[str, str], servers: Dict[str, Any], config_file: str) -> Dict[str, Any]:
+    for rpc, _ in servers.values():
+        rpc.reset()
+
+    child_env = {**os.environ, **env, **SCENARIOS[name]}
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', config_file],
+                             env=child_env, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    wall_time = time.perf_counter() - started
+    if process.returncode != 0:
+        raise Exception(f'Error in run_scenario {name}: {process.stderr.strip()[-2000:]}')
+
+    result = {'scenario': name, 'wall_time': wall_time, **json.loads(process.stdout.strip().splitlines()[-1])}
+    for key in ('http_requests', 'rpc_requests', 'eth_calls', 'bytes_in', 'bytes_out', 'throttled'):
+        result[key] = sum(rpc.stats[key] for rpc, _ in servers.values())
+    result['errors'] = sum(1 for line in process.stdout.splitlines() if line.startswith('Error'))
+    return result
+
+
+def measure_startup(env: Dict[str, str], config_file: str, runs: int) -> Dict[str, float]:
+    """
+    Wall time, in ms, of short cli.py invocations, interpreter start included; the median of runs.
+    The valuation cache is filled by one full run first.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    child_env = {**os.environ, **env, 'VALUATION_CACHE': os.path.join(os.path.dirname(config_file), 'valuation.json')}
+    cli = [sys.executable, os.path.join(directory, 'cli.py'), '--config', config_file]
+    commands = {
+        'help': cli + ['--help'],
+        'cached': cli + ['value', '--max-age', '3600'],
+        'balances': cli + ['balances'],
+    }
+    subprocess.run(commands['cached'], env=child_env, check=True, capture_output=True, cwd=directory)
+
+    startup = dict()
+    for name, command in commands.items():
+        times = []
+        for _ in range(max(1, runs)):
+            started = time.perf_counter()
+            subprocess.run(command, env=child_env, check=True, capture_output=True, cwd=directory)
+            times.append((time.perf_counter() - started) * 1000)
+        startup[name] = sorted(times)[len(times) // 2]
+    return startup
+
+
+def compare(results: List[Dict[str, Any]], baseline_file: str, tolerance: float) -> List[str]:
+    """
+    Returns the metrics that got worse than the baseline by more than tolerance (a fraction).
+    """
+    with open(baseline_file, 'r') as file:
+        baseline = {x['scenario']: x for x in json.load(file)['results']}
+    regressions = []
+    for result in results:
+        before = baseline.get(result['scenario'])
+        if not before:
+            continue
+        for metric in COMPARED_METRICS:
+            if before.get(metric) and result[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{result['scenario']} {metric}: {before[metric]:.4g} -> {result[metric]:.4g}")
+    return regressions
+
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    print(f"{'scenario':<12}{'wall s':>9}{'value s':>9}{'http':>8}{'rpc':>8}{'eth_call':>10}{'KB out':>9}{'KB in':>9}{'429':>6}{'errors':>8}")
+    for x in results:
+        print(f"{x['scenario']:<12}{x['wall_time']:>9.3f}{x['valuation_time']:>9.3f}{x['http_requests']:>8}{x['rpc_requests']:>8}"
+              f"{x['eth_calls']:>10}{x['bytes_in'] / 1024:>9.1f}{x['bytes_out'] / 1024:>9.1f}{x['throttled']:>6}{x['errors']:>8}")
+
+
+def main():
+    """
+    End-to-end benchmark against local fake chains: `python benchmark.py --tokens 200 --wallets 50 --latency 0.02`.
+    """
+    if len(sys.argv) == 3 and sys.argv[1] == '--child':
+        return run_child(sys.argv[2])
+
+    from fake_rpc import ChainState, FakeRpc, synthetic_token_info, synthetic_wallets
+
+    parser = argparse.ArgumentParser(description='Benchmark TokenPortfolio end to end against offline fake chains.')
+    parser.add_argument('--config', default=None, help='token config to serve (default: a synthetic one)')
+    parser.add_argument('--tokens', type=int, default=50, help='tokens of the synthetic config')
+    parser.add_argument('--wallets', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--lp-holders', type=float, default=1.0, help='fraction of the pools each wallet has LP tokens of')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds added to every HTTP request')
+    parser.add_argument('--rate-limit', type=float, default=0, help='HTTP requests per second before 429')
+    parser.add_argument('--max-batch', type=int, default=0, help='largest JSON-RPC batch before 413')
+    parser.add_argument('--no-multicall', action='store_true', help='chains without Multicall3')
+    parser.add_argument('--scenarios', nargs='+', default=['auto'], choices=sorted(SCENARIOS))
+    parser.add_argument('--runs', type=int, default=1, help='runs per scenario, the fastest is kept')
+    parser.add_argument('--warm-metadata', action='store_true', help='generate the metadata lock file first')
+    parser.add_argument('--save', default=None, help='write the results to a JSON file')
+    parser.add_argument('--compare', default=None, help='fail if worse than a saved JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression for --compare (default: 0.2)')
+    parser.add_argument('--write-config', default=None, help='only write the synthetic config to this file')
+    parser.add_argument('--startup', action='store_true', help='also time cli.py --help, cached value and balances')
+    parser.add_argument('--startup-budget', type=float, default=None,
+                        help='fail if the cached `cli.py value` takes longer, in ms (default: cli.DEFAULT_STARTUP_BUDGET_MS)')
+    args = parser.parse_args()
+
+    if args.config:
+        with open(args.config, 'r') as file:
+            token_data = json.load(file)
+    else:
+        token_data = synthetic_token_info(args.tokens, args.seed)
+    if args.write_config:
+        with open(args.write_config, 'w') as file:
+            json.dump(token_data, file, indent=4)
+        print(f'wrote {len(token_data)} tokens to {args.write_config}')
+        return
+
+    directory = tempfile.mkdtemp(prefix='benchmark-')
+    config_file = os.path.join(directory, 'tokenInfo.json')
+    with open(config_file, 'w') as file:
+        json.dump(token_data, file)
+
+    servers = dict()
+    env = {'WALLET_ADDRESS': ','.join(synthetic_wallets(args.wallets, args.seed)),
+           'METADATA_CACHE': os.path.join(directory, 'tokenInfo.lock.json'), 'HISTORY_STORE': ''}
+    for blockchain, env_var in (('Ethereum', 'ETH_RPC'), ('Binance', 'BNB_RPC')):
+        rpc = FakeRpc(ChainState(token_data, blockchain, args.seed, args.lp_holders), not args.no_multicall, args.latency, args.rate_limit, args.max_batch)
+        server = rpc.serve()
+        servers[blockchain] = (rpc, server)
+        env[env_var] = f'http://127.0.0.1:{server.server_address[1]}'
+
+    if args.warm_metadata:
+        subprocess.run([sys.executable, 'metadata_cache.py', '--config', config_file, '--output', env['METADATA_CACHE']],
+                       env={**os.environ, **env}, check=True, capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    print(f'{len(token_data)} tokens, {args.wallets} wallets, latency {args.latency}s, rate limit {args.rate_limit or "none"}')
+    results = []
+    for name in args.scenarios:
+        runs = [run_scenario(name, env, servers, config_file) for _ in range(max(1, args.runs))]
+        results.append(min(runs, key=lambda x: x['wall_time']))
+    print_results(results)
+
+    values = {round(x['net_value'], 6) for x in results}
+    if len(values) > 1:
+        print(f'Error: scenarios disagree on the net value: {sorted(values)}')
+
+    startup = None
+    if args.startup:
+        from cli import DEFAULT_STARTUP_BUDGET_MS
+
+        startup = measure_startup(env, config_file, max(5, args.runs))
+        budget = args.startup_budget or DEFAULT_STARTUP_BUDGET_MS
+        print('startup ms: ' + ', '.join(f'{name} {ms:.0f}' for name, ms in startup.items()) + f' (budget {budget:.0f})')
+        if startup['cached'] > budget:
+            print(f"Error: cached startup {startup['cached']:.0f} ms is over the {budget:.0f} ms budget")
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'args': vars(args), 'results': results, 'startup': startup}, file, indent=4)
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for regression in regressions:
+            print(f'regression: {regression}')
+        if regressions:
+            raise SystemExit(1)
+    if startup and startup['cached'] > (args.startup_budget or DEFAULT_STARTUP_BUDGET_MS):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
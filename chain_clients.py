@@ -0,0 +1,156 @@
+from typing import Any, Dict
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from web3 import Web3
+from batching import CallBatch, make_batch, has_multicall, DEFAULT_CHUNK_SIZE
+from chain_config import RPC_ENV_VARS, BATCH_MODE_ENV_VARS, RATE_LIMIT_ENV_VARS
+from routing import EndpointRouter, split_urls, DEFAULT_HEDGE_PERCENTILE
+from response_cache import get_response_cache
+from rpc_provider import BatchHTTPProvider
+from scheduler import EndpointScheduler, DEFAULT_MAX_CONCURRENCY
+from snapshot import get_block_cache
+
+DEFAULT_POOL_SIZE = 10
+
+
+class HTTP2Session:
+    def __init__(self, pool_size: int, gzip: bool = True):
+        """
+        Minimal requests.Session look-alike on top of an httpx HTTP/2 client, so many concurrent
+        requests are multiplexed over one connection. Needs `pip install httpx[http2]`.
+        """
+        import httpx
+
+        self.httpx = httpx
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        headers = {'Accept-Encoding': 'gzip'} if gzip else {'Accept-Encoding': 'identity'}
+        self.client = httpx.Client(http2=True, limits=limits, headers=headers)
+
+    def post(self, url: str, data: bytes = None, headers: Dict[str, str] = None, timeout: Any = None, **kwargs) -> Any:
+        try:
+            response = self.client.post(url, content=data, headers=headers, timeout=timeout)
+        except self.httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e))
+        return HTTP2Response(response)
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class HTTP2Response:
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        self.content = response.content
+        self.headers = response.headers
+
+    def raise_for_status(self) -> None:
+        # raise requests' exception type so callers handle both transports the same way
+        if self.status_code >= 400:
+            error = requests.exceptions.HTTPError(f'{self.status_code} error for url: {self.response.url}')
+            error.response = self
+            raise error
+
+
+class ChainClient:
+    def __init__(self, blockchain: str, rpc_url: str, pool_size: int = DEFAULT_POOL_SIZE, http2: bool = False,
+                 gzip: bool = True, batch_mode: str = 'auto', rate_limit: float = 0,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, hedge_percentile: float = DEFAULT_HEDGE_PERCENTILE):
+        """
+        Connection to one blockchain, shared by every TokenYield and by the pricing code.
+
+        Args:
+        blockchain (str): Name of the blockchain, as used in tokenInfo.json.
+        rpc_url (str): The RPC url, or several comma-separated urls routed by health and latency (see routing.EndpointRouter).
+        pool_size (int): Maximum number of keep-alive connections kept open to each endpoint.
+        http2 (bool): Multiplex requests over HTTP/2 (requires httpx[http2]). Falls back to HTTP/1.1 if unavailable.
+        gzip (bool): Ask the endpoint for gzip compressed responses.
+        batch_mode (str): 'multicall', 'jsonrpc' or 'auto', see batching.make_batch.
+        rate_limit (float): Requests per second each endpoint allows, 0 if unknown (see scheduler.EndpointScheduler).
+        max_concurrency (int): Most requests in flight to each endpoint.
+        hedge_percentile (float): Latency percentile after which an eth_call is also sent to a second url. 0 disables hedging.
+        """
+        if not split_urls(rpc_url):
+            raise Exception(f'Missing rpc url for {blockchain}')
+
+        self.blockchain = blockchain
+        self.rpc_url = rpc_url
+        self.batch_mode = batch_mode
+        self.multicall_available = None
+        self.router = EndpointRouter(split_urls(rpc_url), hedge_percentile, max_workers=2 * max_concurrency,
+                                     rate_limit=rate_limit, max_concurrency=min(max_concurrency, pool_size))
+        self.session = self.make_session(pool_size, http2, gzip, len(self.router.endpoints))
+        # only runs the chunks of a batch concurrently in priority order; every url paces its own requests (see routing.Endpoint)
+        self.scheduler = EndpointScheduler(blockchain, max_concurrency=min(max_concurrency, pool_size) * len(self.router.endpoints))
+        self.provider = BatchHTTPProvider(session=self.session, blockchain=blockchain, scheduler=self.scheduler, router=self.router)
+        self.web3 = Web3(self.provider)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_session(pool_size: int, http2: bool, gzip: bool, hosts: int = 1) -> Any:
+        if http2:
+            try:
+                return HTTP2Session(pool_size, gzip)
+            except ImportError:
+                print(f'httpx[http2] is not installed, using HTTP/1.1 keep-alive connections')
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=pool_size, pool_block=True)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['Accept-Encoding'] = 'gzip, deflate' if gzip else 'identity'
+        return session
+
+    def make_batch(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> CallBatch:
+        """
+        Returns an empty batch for this chain. The 'auto' mode is resolved once per client.
+        Batches share the process-wide block cache, used when executed at a pinned block, and the response cache.
+        """
+        with self._lock:
+            if self.batch_mode == 'auto' and self.multicall_available is None:
+                self.multicall_available = has_multicall(self.web3)
+        return make_batch(self.web3, self.batch_mode, chunk_size, self.multicall_available,
+                          cache=get_block_cache(), blockchain=self.blockchain, scheduler=self.scheduler,
+                          response_cache=get_response_cache())
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_clients: Dict[str, ChainClient] = dict()
+_clients_lock = threading.Lock()
+
+
+def get_chain_client(blockchain: str) -> ChainClient:
+    """
+    Returns the process-wide client of the given blockchain, creating it on first use.
+    """
+    client = _clients.get(blockchain)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        if blockchain not in _clients:
+            if blockchain not in RPC_ENV_VARS:
+                raise Exception("Unable to load web3")
+            _clients[blockchain] = ChainClient(
+                blockchain,
+                os.getenv(RPC_ENV_VARS[blockchain]),
+                pool_size=int(os.getenv('RPC_POOL_SIZE', DEFAULT_POOL_SIZE)),
+                http2=os.getenv('RPC_HTTP2', '0') == '1',
+                gzip=os.getenv('RPC_GZIP', '1') == '1',
+                batch_mode=os.getenv(BATCH_MODE_ENV_VARS[blockchain], 'auto'),
+                rate_limit=float(os.getenv(RATE_LIMIT_ENV_VARS[blockchain]) or 0),
+                max_concurrency=int(os.getenv('RPC_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY)),
+                hedge_percentile=float(os.getenv('RPC_HEDGE_PERCENTILE', DEFAULT_HEDGE_PERCENTILE)),
+            )
+        return _clients[blockchain]
+
+
+def close_chain_clients() -> None:
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
@@ -0,0 +1,15 @@
+# env variables holding the rpc urls (comma-separated) and the batch mode of each supported blockchain.
+# Kept apart from chain_clients so the light paths of cli.py can read them without importing web3.
+RPC_ENV_VARS = {
+    "Ethereum": "ETH_RPC",
+    "Binance": "BNB_RPC",
+}
+BATCH_MODE_ENV_VARS = {
+    "Ethereum": "ETH_BATCH_MODE",
+    "Binance": "BNB_BATCH_MODE",
+}
+# known request rate limit of each endpoint, requests per second; unset to learn it from 429 answers
+RATE_LIMIT_ENV_VARS = {
+    "Ethereum": "ETH_RATE_LIMIT",
+    "Binance": "BNB_RATE_LIMIT",
+}
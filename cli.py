@@ -0,0 +1,243 @@
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+import os
+import sys
+import time
+
+# Entry point for cron and other short-lived jobs. Only the standard library is imported up front:
+# `--help`, answers from the valuation cache and `balances` never import web3 (see benchmark.py --startup).
+STARTED = time.perf_counter()
+
+DEFAULT_CONFIG_FILE = 'tokenInfo.json'
+# wall time of `python cli.py value` answered from the valuation cache, interpreter start included
+DEFAULT_STARTUP_BUDGET_MS = 250
+DEFAULT_BALANCE_BATCH_SIZE = 100
+RPC_TIMEOUT = 30
+DUST_THRESHOLD = 0.0001
+# mainV4.TOKEN_PARTS, not imported from there to keep web3 out of the startup path
+DEFAULT_PARTS = 'wallet,lp,bonded,unbonded'
+
+
+def load_env() -> None:
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+def get_wallets(wallets: Optional[str] = None) -> List[str]:
+    """
+    Wallets of --wallets, or of WALLET_ADDRESS; comma separated.
+    """
+    return [x.strip() for x in (wallets or os.getenv('WALLET_ADDRESS', '')).split(',') if x.strip()]
+
+
+def default_valuation_cache(config_file: str) -> str:
+    """
+    The valuation cache lives beside the config: tokenInfo.json -> tokenInfo.valuation.json
+    """
+    root, ext = os.path.splitext(config_file)
+    return os.getenv('VALUATION_CACHE') or f'{root}.valuation{ext or ".json"}'
+
+
+def cache_key(token_data_list: List[Dict[str, Any]], wallets: List[str], parts: List[str]) -> Dict[str, Any]:
+    """
+    What a cached valuation answers for: the whole config (pids, decimals and symbols included, not only the
+    contracts), the wallets and the parts read.
+    """
+    import hashlib
+    config = json.dumps(token_data_list, sort_keys=True, separators=(',', ':'))
+    return {'config': hashlib.sha256(config.encode()).hexdigest(), 'wallets': sorted(x.lower() for x in wallets), 'parts': sorted(parts)}
+
+
+def read_valuation(path: str, key: Dict[str, Any], max_age: float) -> Optional[Dict[str, Any]]:
+    """
+    Returns the cached valuation if it is for the same key and at most max_age seconds old, else None.
+    """
+    if max_age <= 0 or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as file:
+            valuation = json.load(file)
+    except Exception as e:
+        print(f'Error reading valuation cache {path}: {e}')
+        return None
+    if valuation.get('key') != key or time.time() - valuation.get('timestamp', 0) > max_age:
+        return None
+    return valuation
+
+
+def write_valuation(path: str, valuation: Dict[str, Any]) -> None:
+    # write aside and rename, so a concurrent run never reads a partial file
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(valuation, file)
+    os.replace(f'{path}.tmp', path)
+
+
+def value_portfolio(token_data_list: List[Dict[str, Any]], wallets: List[str], parts: List[str]) -> Dict[str, Any]:
+    """
+    Values the portfolio on chain (see mainV4.TokenPortfolio) and returns what print_valuation shows.
+    """
+    from mainV4 import TokenPortfolio
+
+    portfolio = TokenPortfolio(token_data_list, wallets=wallets or None, parts=parts)
+    net_value = portfolio.get_net_value(verbose=False)
+    if os.getenv('HISTORY_STORE'):
+        from history_store import open_store
+        portfolio.export(open_store())
+    return {
+        'timestamp': int(time.time()),
+        'net_value': net_value,
+        'holdings': portfolio.all_tokens,
+        'wallet_holdings': portfolio.wallet_holdings,
+        'wallet_values': portfolio.wallet_values,
+        'prices': portfolio.symbol_prices,
+    }
+
+
+def print_valuation(valuation: Dict[str, Any], cached: bool = False) -> None:
+    """
+    Prints a valuation the way `python mainV4.py` does.
+    """
+    wallet_holdings = valuation.get('wallet_holdings', {})
+    if len(wallet_holdings) > 1:
+        for wallet, holdings in wallet_holdings.items():
+            print(f'\nTokens in wallet {wallet}:')
+            for k, v in holdings.items():
+                if v > DUST_THRESHOLD:
+                    print(f'{k}: {v:.2f}')
+    print(f'\nAll tokens in portfolio:')
+    for k, v in valuation.get('holdings', {}).items():
+        if v > DUST_THRESHOLD:
+            print(f'{k}: {v:.2f}')
+    prices = valuation.get('prices', {})
+    print(f"eth: {prices.get('ETH')}; bnb: {prices.get('BNB')}")
+    if len(wallet_holdings) > 1:
+        for wallet, value in valuation.get('wallet_values', {}).items():
+            print(f'{wallet}: ${value}')
+    print(f"net value: {valuation.get('net_value')}")
+    if cached:
+        print(f"(cached, {int(time.time() - valuation['timestamp'])}s old)")
+
+
+def read_balances(token_data_list: List[Dict[str, Any]], wallets: List[str], block_identifier: Any = 'latest',
+                  batch_size: int = DEFAULT_BALANCE_BATCH_SIZE) -> Dict[str, Dict[str, float]]:
+    """
+    Wallet balances of every configured token, read with raw eth_calls (see eth_codec) in JSON-RPC batches over
+    urllib: no web3, eth_abi or requests import. Only the first url of each chain is used.
+
+    Returns:
+    Dict[str, Dict[str, float]]: Amount per symbol, per wallet.
+    """
+    from urllib.request import Request, urlopen
+    from chain_config import RPC_ENV_VARS
+    from eth_codec import encode_call, eth_call_request, decode_hex, decode_values
+
+    balances = {wallet: dict() for wallet in wallets}
+    calls_by_chain: Dict[str, List[tuple]] = dict()
+    for token_data in token_data_list:
+        blockchain = token_data.get('blockchain')
+        if blockchain not in RPC_ENV_VARS or not token_data.get('tokenAddress'):
+            continue
+        for wallet in wallets:
+            calls_by_chain.setdefault(blockchain, []).append((wallet, token_data))
+
+    for blockchain, calls in calls_by_chain.items():
+        url = (os.getenv(RPC_ENV_VARS[blockchain]) or '').split(',')[0].strip()
+        if not url:
+            print(f'Error reading balances on {blockchain}: {RPC_ENV_VARS[blockchain]} is not set')
+            continue
+        for start in range(0, len(calls), batch_size):
+            chunk = calls[start:start + batch_size]
+            payload = [eth_call_request(i, token_data['tokenAddress'], encode_call('balanceOf(address)', [wallet]), block_identifier)
+                       for i, (wallet, token_data) in enumerate(chunk)]
+            try:
+                request = Request(url, data=json.dumps(payload).encode(), headers={'Content-Type': 'application/json'})
+                with urlopen(request, timeout=RPC_TIMEOUT) as response:
+                    answers = {x.get('id'): x for x in json.loads(response.read())}
+            except Exception as e:
+                print(f'Error reading balances on {blockchain}: {e}')
+                continue
+            for i, (wallet, token_data) in enumerate(chunk):
+                answer = answers.get(i, {})
+                try:
+                    if 'result' not in answer:
+                        raise Exception(answer.get('error', 'no answer'))
+                    (amount,) = decode_values(['uint256'], decode_hex(answer['result']))
+                except Exception as e:
+                    print(f"Error reading {token_data.get('symbol')} balance of {wallet} on {blockchain}: {e}")
+                    continue
+                symbol = token_data.get('symbol')
+                balances[wallet][symbol] = balances[wallet].get(symbol, 0) + amount / 10 ** int(token_data.get('decimals', 18))
+    return balances
+
+
+def main():
+    """
+    `python cli.py value --max-age 300` answers from the last valuation if it is recent enough, else values the
+    portfolio on chain. `python cli.py balances` reads wallet balances only, without web3. `python cli.py explain`
+    prints the reads a valuation makes.
+    """
+    parser = argparse.ArgumentParser(description='Value the token portfolio.')
+    parser.add_argument('--config', default=DEFAULT_CONFIG_FILE, help='token config (default: tokenInfo.json)')
+    parser.add_argument('--wallets', default=None, help='comma separated wallets (default: WALLET_ADDRESS)')
+    parser.add_argument('--json', action='store_true', help='print the result as JSON')
+    parser.add_argument('--timings', action='store_true', help='print the time spent to stderr')
+    commands = parser.add_subparsers(dest='command')
+    value = commands.add_parser('value', help='net value of the portfolio (default command)')
+    value.add_argument('--max-age', type=float, default=None,
+                       help='answer from the valuation cache if it is at most this many seconds old (default: VALUATION_MAX_AGE or 0, never)')
+    value.add_argument('--parts', default=DEFAULT_PARTS, help='parts of every token to read (see mainV4.TOKEN_PARTS)')
+    explain = commands.add_parser('explain', help='print the distinct reads the config compiles to (see query_plan.py)')
+    explain.add_argument('--parts', default=DEFAULT_PARTS, help='parts of every token to read (see mainV4.TOKEN_PARTS)')
+    balances = commands.add_parser('balances', help='wallet balances only, read without web3')
+    balances.add_argument('--block', default='latest', help="block number or tag (default: latest)")
+    args = parser.parse_args()
+
+    load_env()
+    with open(args.config, 'r') as file:
+        token_data = json.load(file)
+    wallets = get_wallets(args.wallets)
+
+    if args.command == 'explain':
+        from mainV4 import TokenYield, check_parts
+        from query_plan import compile_config
+
+        parts = check_parts([x.strip() for x in args.parts.split(',') if x.strip()])
+        print(compile_config(token_data, [TokenYield.checksum_address(x) for x in wallets], parts).explain())
+    elif args.command == 'balances':
+        block = int(args.block) if args.block.isdigit() else args.block
+        result = read_balances(token_data, wallets, block)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            for wallet, holdings in result.items():
+                print(f'\nTokens in wallet {wallet}:')
+                for k, v in holdings.items():
+                    if v > DUST_THRESHOLD:
+                        print(f'{k}: {v:.2f}')
+    else:
+        # `python cli.py` without a command is `value` with its defaults
+        max_age = getattr(args, 'max_age', None)
+        max_age = float(os.getenv('VALUATION_MAX_AGE', 0)) if max_age is None else max_age
+        parts = [x.strip() for x in getattr(args, 'parts', DEFAULT_PARTS).split(',') if x.strip()]
+        path = default_valuation_cache(args.config)
+        key = cache_key(token_data, wallets, parts)
+        valuation = read_valuation(path, key, max_age)
+        cached = valuation is not None
+        if not cached:
+            valuation = {**value_portfolio(token_data, wallets, parts), 'key': key}
+            write_valuation(path, valuation)
+            from metrics import write_metrics
+            write_metrics()
+        if args.json:
+            print(json.dumps({**valuation, 'cached': cached}))
+        else:
+            print_valuation(valuation, cached)
+
+    if args.timings:
+        print(f'{args.command or "value"}: {(time.perf_counter() - STARTED) * 1000:.1f} ms after import; '
+              f"web3 imported: {'web3' in sys.modules}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
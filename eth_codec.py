@@ -0,0 +1,126 @@
+from typing import Any, Dict, List, Optional, Sequence
+import re
+
+# Minimal ABI codec for the static types of the contract functions this project reads (uint/int, address, bool).
+# It needs no third-party package, so the light paths of cli.py work without importing web3 or eth_abi.
+
+# selectors of the functions read, by signature
+SELECTORS = {
+    'balanceOf(address)': '70a08231',
+    'balances(address)': '27e235e3',
+    'decimals()': '313ce567',
+    'getReserves()': '0902f1ac',
+    'lpToken(uint256)': '78ed5d1f',
+    'pendingRewards(uint256,address)': 'd18df53c',
+    'poolInfo(uint256)': '1526fe27',
+    'poolLength()': '081e3eda',
+    'token0()': '0dfe1681',
+    'token1()': 'd21220a7',
+    'totalSupply()': '18160ddd',
+    'userInfo(uint256,address)': '93f1a40b',
+}
+WORD = 32
+_INTEGER = re.compile(r'^(u?)int(\d*)$')
+
+
+def is_static(types: Sequence[str]) -> bool:
+    """
+    True if every type can be encoded and decoded by this codec.
+    """
+    return all(type_name in ('address', 'bool') or _integer_bits(type_name) is not None for type_name in types)
+
+
+def _integer_bits(type_name: str) -> Optional[int]:
+    match = _INTEGER.match(type_name)
+    if not match:
+        return None
+    bits = int(match.group(2) or 256)
+    return bits if 0 < bits <= 256 and bits % 8 == 0 else None
+
+
+def encode_values(types: Sequence[str], values: Sequence[Any]) -> bytes:
+    """
+    ABI-encodes values of static types, one 32-byte word each.
+    """
+    if len(types) != len(values):
+        raise Exception(f'Error in encode_values: {len(types)} types for {len(values)} values')
+    return b''.join(_encode_word(type_name, value) for type_name, value in zip(types, values))
+
+
+def _encode_word(type_name: str, value: Any) -> bytes:
+    if type_name == 'address':
+        address = value.hex() if isinstance(value, bytes) else str(value)
+        address = address[2:] if address.lower().startswith('0x') else address
+        if len(address) != 40:
+            raise Exception(f'Error in encode_values: invalid address {value}')
+        return bytes(12) + bytes.fromhex(address)
+    if type_name == 'bool':
+        return int(bool(value)).to_bytes(WORD, 'big')
+
+    bits = _integer_bits(type_name)
+    if bits is None:
+        raise Exception(f'Error in encode_values: unsupported type {type_name}')
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise Exception(f'Error in encode_values: {type_name} needs an int, got {value!r}')
+    signed = not type_name.startswith('u')
+    low, high = (-2 ** (bits - 1), 2 ** (bits - 1) - 1) if signed else (0, 2 ** bits - 1)
+    if not low <= value <= high:
+        raise Exception(f'Error in encode_values: {value} out of range for {type_name}')
+    return value.to_bytes(WORD, 'big', signed=signed)
+
+
+def decode_values(types: Sequence[str], data: bytes) -> List[Any]:
+    """
+    Decodes static return data. Addresses are returned lowercase, as '0x' strings.
+    """
+    # HexBytes (AsyncWeb3 results) prefixes its hex() with 0x
+    data = bytes(data)
+    if len(data) < WORD * len(types):
+        raise Exception(f'Error in decode_values: {len(data)} bytes for {len(types)} values')
+    return [_decode_word(type_name, data[i * WORD:(i + 1) * WORD]) for i, type_name in enumerate(types)]
+
+
+def _decode_word(type_name: str, word: bytes) -> Any:
+    if type_name == 'address':
+        if any(word[:12]):
+            raise Exception(f'Error in decode_values: invalid address padding {word.hex()}')
+        return '0x' + word[12:].hex()
+    if type_name == 'bool':
+        value = int.from_bytes(word, 'big')
+        if value > 1:
+            raise Exception(f'Error in decode_values: invalid bool {word.hex()}')
+        return value == 1
+
+    bits = _integer_bits(type_name)
+    if bits is None:
+        raise Exception(f'Error in decode_values: unsupported type {type_name}')
+    signed = not type_name.startswith('u')
+    value = int.from_bytes(word, 'big', signed=signed)
+    # the padding of smaller integers must be a sign extension
+    low, high = (-2 ** (bits - 1), 2 ** (bits - 1) - 1) if signed else (0, 2 ** bits - 1)
+    if not low <= value <= high:
+        raise Exception(f'Error in decode_values: {value} out of range for {type_name}')
+    return value
+
+
+def encode_call(signature: str, args: Sequence[Any] = ()) -> bytes:
+    """
+    Call data of one of the SELECTORS functions, e.g. encode_call('balanceOf(address)', [wallet]).
+    """
+    selector = SELECTORS.get(signature)
+    if selector is None:
+        raise Exception(f'Error in encode_call: unknown function {signature}')
+    types = signature[signature.index('(') + 1:-1]
+    return bytes.fromhex(selector) + encode_values(types.split(',') if types else [], args)
+
+
+def eth_call_request(request_id: int, to: str, data: bytes, block_identifier: Any = 'latest') -> Dict[str, Any]:
+    """
+    JSON-RPC eth_call request of raw call data.
+    """
+    block = hex(block_identifier) if isinstance(block_identifier, int) else (block_identifier or 'latest')
+    return {'jsonrpc': '2.0', 'id': request_id, 'method': 'eth_call', 'params': [{'to': to, 'data': '0x' + data.hex()}, block]}
+
+
+def decode_hex(value: str) -> bytes:
+    return bytes.fromhex(value[2:] if value.startswith('0x') else value)
@@ -0,0 +1,480 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from eth_abi import decode, encode
+from web3 import Web3
+from abi_registry import get_abi, get_function_spec
+from batching import MULTICALL3_ADDRESS
+
+GENESIS_TIMESTAMP = 1600000000
+BLOCK_INTERVAL = 12
+FIRST_BLOCK = 1000000
+# blocks before FIRST_BLOCK with LP and vault logs, one block in LOG_EVERY per contract, among LOG_HOLDERS wallets
+LOG_HISTORY = 2000
+LOG_EVERY = 10
+LOG_HOLDERS = 8
+ZERO_ADDRESS = '0x' + '0' * 40
+# ACC_PRECISION of the MasterChef style vaults (MiniChefV2)
+ACC_PRECISION = 10 ** 12
+TOPICS = {name: Web3.to_hex(Web3.keccak(text=signature)) for name, signature in (
+    ('Transfer', 'Transfer(address,address,uint256)'), ('Deposit', 'Deposit(address,uint256,uint256,address)'))}
+# symbols priced against USDT by the synthetic config, per chain
+BASE_ASSETS = {
+    "Ethereum": ("ETH", 18),
+    "Binance": ("BNB", 18),
+}
+
+
+class ChainState:
+    def __init__(self, token_data_list: List[Dict[str, Any]], blockchain: str, seed: int = 0, lp_holders: float = 1.0):
+        """
+        Deterministic contract state of one chain, derived from a token config: every ERC20, Uniswap V2 pair,
+        yield vault / unbonded staking (MasterChef style) and bonded staking contract it references answers
+        the calls of the ABIs in ABI/. Values are pseudo random but stable for a given seed.
+
+        Pools are registered in their vault under liquidityTokenStakingNumber (unbonded staking under
+        userInfoNumber); positions configured with a placeholder pid (1000 and up, e.g. 9999) revert, like on chain,
+        and their token is staked under the next free pid of the vault, where vault_index.py finds it.
+        A vault pays rewards in the token of the first entry that references it.
+        A wallet holds LP tokens (in the pair and its vault) of a fraction lp_holders of the pools, the others are empty.
+        """
+        self.blockchain = blockchain
+        self.seed = seed
+        self.lp_holders = lp_holders
+        self.decimals: Dict[str, int] = dict()
+        self.pools: Dict[str, Tuple[str, str]] = dict()
+        self.vaults: Dict[str, Dict[int, str]] = dict()
+        self.rewards: Dict[str, str] = dict()
+        self.bonded: set = set()
+        placeholders: List[Tuple[str, str]] = []
+
+        entries = [x for x in token_data_list if x.get('blockchain') == blockchain]
+        by_symbol = {x.get('symbol'): Web3.to_checksum_address(x.get('tokenAddress')) for x in entries}
+        for entry in entries:
+            token = Web3.to_checksum_address(entry.get('tokenAddress'))
+            self.decimals[token] = int(entry.get('decimals') or 18)
+            if entry.get('bondedStaking', {}).get('contractAddress'):
+                self.bonded.add(Web3.to_checksum_address(entry['bondedStaking']['contractAddress']))
+            unbonded = entry.get('unbondedStaking', {})
+            if unbonded.get('contractAddress'):
+                self.register(unbonded['contractAddress'], unbonded.get('userInfoNumber'), token, placeholders)
+                self.rewards.setdefault(Web3.to_checksum_address(unbonded['contractAddress']), token)
+
+            for lp_dict in entry.get('liquidityPool', []):
+                if not lp_dict.get('liquidityPoolAddress'):
+                    continue
+                pool = Web3.to_checksum_address(lp_dict['liquidityPoolAddress'])
+                paired = by_symbol.get(lp_dict.get('pairedTokenSymbol')) or self.address('token', lp_dict.get('pairedTokenSymbol'))
+                self.decimals.setdefault(paired, 18)
+                # uniswap orders the pair's tokens by address
+                self.pools[pool] = tuple(sorted([token, paired], key=lambda x: x.lower()))
+                if lp_dict.get('liquidityTokenStakingAddress'):
+                    self.register(lp_dict['liquidityTokenStakingAddress'], lp_dict.get('liquidityTokenStakingNumber'), pool, placeholders)
+                    self.rewards.setdefault(Web3.to_checksum_address(lp_dict['liquidityTokenStakingAddress']), token)
+
+        # after the configured pids, so these don't take one
+        for vault, staked_token in placeholders:
+            pids = self.vaults[vault]
+            if staked_token not in pids.values():
+                pids[max(pids, default=-1) + 1] = staked_token
+
+    def register(self, vault: str, pid: Any, staked_token: str, placeholders: List[Tuple[str, str]]) -> None:
+        vault = Web3.to_checksum_address(vault)
+        pids = self.vaults.setdefault(vault, dict())
+        pid = int(pid) if pid not in (None, '') else len(pids)
+        # pids past the end of a real vault revert; keep them out so configs with a wrong pid behave the same
+        if pid < 1000:
+            pids.setdefault(pid, staked_token)
+        else:
+            placeholders.append((vault, staked_token))
+
+    def logs(self, from_block: int, to_block: int, addresses: List[str], topics: List[str]) -> List[Tuple[int, str, List[str], bytes]]:
+        """
+        (block, address, topics, data) of the logs of a block range: LP tokens minted to a holder (Transfer from
+        the zero address) and LP tokens deposited in a vault (Deposit), see LOG_HISTORY.
+        """
+        pids = {(vault, pool): pid for vault, vault_pids in self.vaults.items() for pid, pool in vault_pids.items()}
+        logs = []
+        for block in range(max(from_block, FIRST_BLOCK - LOG_HISTORY), to_block + 1):
+            for address in sorted(addresses):
+                if self.number('log', address, block) % LOG_EVERY:
+                    continue
+                holder = self.address('holder', self.number('holder', address, block) % LOG_HOLDERS)
+                amount = self.number('amount', address, block) % 10 ** 20
+                if address in self.pools and (not topics or TOPICS['Transfer'] in topics):
+                    logs.append((block, address, [TOPICS['Transfer'], address_word(ZERO_ADDRESS), address_word(holder)], encode(['uint256'], [amount])))
+                elif address in self.vaults and self.vaults[address] and (not topics or TOPICS['Deposit'] in topics):
+                    pool_pids = sorted(self.vaults[address])
+                    pid = pool_pids[self.number('pid', address, block) % len(pool_pids)]
+                    logs.append((block, address, [TOPICS['Deposit'], address_word(holder), '0x' + encode(['uint256'], [pid]).hex(),
+                                                  address_word(holder)], encode(['uint256'], [amount])))
+        return logs
+
+    def number(self, *args: Any) -> int:
+        return int.from_bytes(hashlib.sha256(repr((self.seed, self.blockchain) + args).encode()).digest()[:16], 'big')
+
+    def address(self, *args: Any) -> str:
+        return Web3.to_checksum_address('0x' + hashlib.sha256(repr((self.seed, self.blockchain) + args).encode()).hexdigest()[:40])
+
+    def holds_lp(self, pool: str, wallet: str) -> bool:
+        return self.number('holds', pool, wallet) % 1000 < self.lp_holders * 1000
+
+    def lp_supply(self, pool: str) -> int:
+        return 10 ** 21 + self.number('supply', pool) % 10 ** 24
+
+    def call(self, to: str, name: str, args: list, block: int) -> Any:
+        """
+        Returns the value of a view function, or raises to revert.
+        """
+        if name == 'balanceOf':
+            if to in self.pools:
+                if not self.holds_lp(to, args[0]):
+                    return 0
+                return self.number('lp', to, args[0]) % (self.lp_supply(to) // 100)
+            return self.number('balance', to, args[0]) % 10 ** (self.decimals.get(to, 18) + 6)
+        if name == 'totalSupply':
+            return self.lp_supply(to) if to in self.pools else 10 ** 30
+        if name == 'decimals':
+            return 18 if to in self.pools else self.decimals.get(to, 18)
+        if name == 'getReserves':
+            token_zero, token_one = self.pools[to]
+            return [10 ** (self.decimals[token_zero] + 3) + self.number('r0', to) % 10 ** (self.decimals[token_zero] + 7),
+                    10 ** (self.decimals[token_one] + 3) + self.number('r1', to) % 10 ** (self.decimals[token_one] + 7),
+                    (GENESIS_TIMESTAMP + block * BLOCK_INTERVAL) % 2 ** 32]
+        if name in ('token0', 'token1'):
+            return self.pools[to][0 if name == 'token0' else 1]
+        if name == 'balances':
+            return self.number('bonded', to, args[0]) % 10 ** 14
+        if name == 'rewardsToken':
+            return self.rewards[to]
+        if name == 'poolLength':
+            return max(self.vaults[to], default=-1) + 1
+        if name in ('lpToken', 'poolInfo', 'userInfo', 'pendingRewards'):
+            pid = args[0]
+            if pid not in self.vaults.get(to, {}):
+                raise ValueError('execution reverted')
+            if name == 'lpToken':
+                return self.vaults[to][pid]
+            if name == 'poolInfo':
+                return [10 ** 17 + self.number('rate', to, pid) % 10 ** 18, self.lp_supply(self.vaults[to][pid]) // 3,
+                        self.number('acc', to, pid) % 10 ** 12, block - 10, block + 100000]
+            amount = self.number('staked', to, pid, args[1]) % (self.lp_supply(self.vaults[to][pid]) // 300)
+            if self.vaults[to][pid] in self.pools and not self.holds_lp(self.vaults[to][pid], args[1]):
+                amount = 0
+            reward_debt = -(self.number('debt', to, pid, args[1]) % 10 ** 20)
+            if name == 'pendingRewards':
+                # what the contract answers, as if updatePool had run on every block since lastRewardBlock
+                token_per_block, lp_supply, acc, last_reward_block, end_of_epoch_block = self.call(to, 'poolInfo', [pid], block)
+                for _ in range(last_reward_block + 1, min(block, end_of_epoch_block) + 1):
+                    acc += token_per_block * ACC_PRECISION // lp_supply
+                pending = amount * acc // ACC_PRECISION - reward_debt
+                if pending < 0:
+                    # int256 to uint256 cast
+                    raise ValueError('execution reverted')
+                return pending
+            return [amount, reward_debt]
+        raise ValueError(f'unsupported function {name}')
+
+
+class FakeRpc:
+    def __init__(self, state: ChainState, multicall: bool = True, latency: float = 0, rate_limit: float = 0,
+                 max_batch: int = 0, block_time: float = 0, max_logs: int = 0):
+        """
+        JSON-RPC stand-in of a node: eth_call (including Multicall3 aggregate3), JSON-RPC batches and the block
+        and log methods the app uses, with counters for benchmarking.
+
+        Args:
+        state (ChainState): Contract state to serve.
+        multicall (bool): Deploy Multicall3 at its canonical address.
+        latency (float): Seconds added to every HTTP request.
+        rate_limit (float): HTTP requests per second answered before replying 429; 0 for no limit.
+        max_batch (int): Largest JSON-RPC batch accepted before replying 413; 0 for no limit.
+        block_time (float): Seconds per new block; 0 keeps the head fixed.
+        max_logs (int): Most logs returned by one eth_getLogs before failing like capped providers do; 0 for no limit.
+        """
+        self.state = state
+        self.multicall = multicall
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.max_batch = max_batch
+        self.block_time = block_time
+        self.max_logs = max_logs
+        self.started = time.time()
+        self.functions = self.load_functions()
+        self._lock = threading.Lock()
+        self._allowance = rate_limit
+        self._last_refill = time.time()
+        self.reset()
+
+    @staticmethod
+    def load_functions() -> Dict[bytes, Any]:
+        functions = dict()
+        for abi_name in ('ERC20', 'pair', 'yieldVault', 'unbondedStaking', 'singularityTokenStake'):
+            abi = get_abi(abi_name)
+            for fn_abi in abi:
+                if fn_abi.get('type') == 'function':
+                    spec = get_function_spec(abi, fn_abi['name'])
+                    functions.setdefault(spec.selector, spec)
+        return functions
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stats = {'http_requests': 0, 'rpc_requests': 0, 'eth_calls': 0, 'bytes_in': 0, 'bytes_out': 0,
+                          'throttled': 0, 'methods': dict()}
+
+    def head(self) -> int:
+        if not self.block_time:
+            return FIRST_BLOCK
+        return FIRST_BLOCK + int((time.time() - self.started) / self.block_time)
+
+    def count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += amount
+
+    def allow(self) -> bool:
+        """
+        Token bucket of rate_limit requests per second.
+        """
+        if not self.rate_limit:
+            return True
+        with self._lock:
+            now = time.time()
+            self._allowance = min(self.rate_limit, self._allowance + (now - self._last_refill) * self.rate_limit)
+            self._last_refill = now
+            if self._allowance < 1:
+                self.stats['throttled'] += 1
+                return False
+            self._allowance -= 1
+            return True
+
+    def eth_call(self, to: str, data: bytes, block: int) -> bytes:
+        self.count('eth_calls')
+        to = Web3.to_checksum_address(to)
+        if to.lower() == MULTICALL3_ADDRESS.lower():
+            if not self.multicall:
+                return b''
+            (calls,) = decode(['(address,bool,bytes)[]'], data[4:])
+            results = []
+            for target, allow_failure, call_data in calls:
+                try:
+                    results.append((True, self.eth_call(target, call_data, block)))
+                except Exception:
+                    if not allow_failure:
+                        raise
+                    results.append((False, b''))
+            return encode(['(bool,bytes)[]'], [results])
+
+        spec = self.functions.get(data[:4])
+        if spec is None:
+            raise ValueError('execution reverted')
+        args = decode(spec.input_types, data[4:]) if spec.input_types else []
+        args = [Web3.to_checksum_address(x) if t == 'address' else x for t, x in zip(spec.input_types, args)]
+        value = self.state.call(to, spec.name, args, block)
+        return encode(spec.output_types, value if len(spec.output_types) > 1 else [value])
+
+    def block(self, identifier: str) -> Dict[str, Any]:
+        number = self.head() if identifier in ('latest', 'pending', 'safe', 'finalized') else int(identifier, 16)
+        return {'number': hex(number), 'hash': self.block_hash(number), 'parentHash': self.block_hash(number - 1),
+                'timestamp': hex(GENESIS_TIMESTAMP + number * BLOCK_INTERVAL)}
+
+    def block_hash(self, number: int) -> str:
+        return '0x' + hashlib.sha256(f'{self.state.blockchain}:{number}'.encode()).hexdigest()
+
+    def block_number(self, identifier: Any) -> int:
+        if identifier in (None, 'latest', 'pending', 'safe', 'finalized'):
+            return self.head()
+        return int(identifier, 16)
+
+    def get_logs(self, log_filter: Dict[str, Any]) -> List[Dict[str, Any]]:
+        addresses = log_filter.get('address') or []
+        addresses = [Web3.to_checksum_address(x) for x in ([addresses] if isinstance(addresses, str) else addresses)]
+        topics = (log_filter.get('topics') or [None])[0]
+        topics = [topics] if isinstance(topics, str) else topics
+        logs = self.state.logs(self.block_number(log_filter.get('fromBlock')), min(self.block_number(log_filter.get('toBlock')), self.head()),
+                               addresses, topics)
+        if self.max_logs and len(logs) > self.max_logs:
+            raise ValueError(f'query returned more than {self.max_logs} results')
+        return [{'address': address, 'topics': log_topics, 'data': '0x' + data.hex(), 'blockNumber': hex(block),
+                 'blockHash': self.block_hash(block), 'transactionHash': '0x' + hashlib.sha256(f'{address}:{block}'.encode()).hexdigest(),
+                 'transactionIndex': '0x0', 'logIndex': hex(self.state.number('index', address, block) % 256), 'removed': False}
+                for block, address, log_topics, data in logs]
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        self.count('rpc_requests')
+        method, params = request.get('method'), request.get('params') or []
+        with self._lock:
+            self.stats['methods'][method] = self.stats['methods'].get(method, 0) + 1
+        try:
+            if method == 'eth_call':
+                tx = params[0]
+                data = Web3.to_bytes(hexstr=tx.get('data') or tx.get('input'))
+                result = '0x' + self.eth_call(tx['to'], data, self.block_number(params[1] if len(params) > 1 else None)).hex()
+            elif method == 'eth_chainId':
+                result = hex(1 if self.state.blockchain == 'Ethereum' else 56)
+            elif method == 'eth_blockNumber':
+                result = hex(self.head())
+            elif method == 'eth_getCode':
+                result = '0x60' if self.multicall and params[0].lower() == MULTICALL3_ADDRESS.lower() else '0x'
+            elif method == 'eth_getBlockByNumber':
+                result = self.block(params[0])
+            elif method == 'eth_getLogs':
+                result = self.get_logs(params[0])
+            else:
+                return {'jsonrpc': '2.0', 'id': request.get('id'), 'error': {'code': -32601, 'message': f'method {method} not found'}}
+        except Exception as e:
+            return {'jsonrpc': '2.0', 'id': request.get('id'), 'error': {'code': 3, 'message': f'execution reverted: {e}'}}
+        return {'jsonrpc': '2.0', 'id': request.get('id'), 'result': result}
+
+    def handler(self) -> Callable:
+        rpc = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status: int, data: bytes) -> None:
+                rpc.count('bytes_out', len(data))
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                rpc.count('http_requests')
+                rpc.count('bytes_in', len(body))
+                if rpc.latency:
+                    time.sleep(rpc.latency)
+                if not rpc.allow():
+                    return self.reply(429, b'{"jsonrpc":"2.0","id":null,"error":{"code":-32005,"message":"rate limit exceeded"}}')
+                payload = json.loads(body)
+                if isinstance(payload, list):
+                    if rpc.max_batch and len(payload) > rpc.max_batch:
+                        return self.reply(413, b'{"jsonrpc":"2.0","id":null,"error":{"code":-32600,"message":"batch too large"}}')
+                    response = [rpc.handle(x) for x in payload]
+                else:
+                    response = rpc.handle(payload)
+                self.reply(200, json.dumps(response).encode())
+
+            def do_GET(self):
+                # counters, for a quick look with curl
+                with rpc._lock:
+                    self.reply(200, json.dumps(rpc.stats).encode())
+
+        return Handler
+
+    def serve(self, port: int = 0, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+        """
+        Starts serving in a background thread; port 0 picks a free port (see server.server_address).
+        """
+        server = ThreadingHTTPServer((host, port), self.handler())
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def address_word(address: str) -> str:
+    return '0x' + address[2:].lower().rjust(64, '0')
+
+
+def synthetic_token_info(tokens: int, seed: int = 0, blockchains: Tuple[str, ...] = ('Ethereum', 'Binance'),
+                         tokens_per_vault: int = 5) -> List[Dict[str, Any]]:
+    """
+    Generates a tokenInfo.json-shaped config: USDT and the base asset of every chain, plus `tokens` tokens
+    spread over the chains, each with an unbonded staking pid and one or two pools (paired with the base
+    asset or USDT) staked in a yield vault.
+    """
+    rng = random.Random(seed)
+
+    def address(*args: Any) -> str:
+        return Web3.to_checksum_address('0x' + hashlib.sha256(repr((seed,) + args).encode()).hexdigest()[:40])
+
+    def entry(symbol: str, blockchain: str, decimals: int, pools: list, unbonded: Tuple[str, int] = ('', 0)) -> Dict[str, Any]:
+        return {
+            "name": symbol,
+            "decimals": decimals,
+            "symbol": symbol,
+            "blockchain": blockchain,
+            "tokenAddress": address('token', blockchain, symbol),
+            "bondedStaking": {"contractAddress": "", "userInfoNumber": 0, "staked": 0, "pendingRewards": 0},
+            "unbondedStaking": {"contractAddress": unbonded[0], "userInfoNumber": unbonded[1], "staked": 0, "pendingRewards": 0},
+            "liquidityPool": pools,
+            "inWallet": 0,
+            "totalAssetsOwned": [],
+        }
+
+    def pool(blockchain: str, symbol: str, paired: str, vault: Tuple[str, int] = ('', 0)) -> Dict[str, Any]:
+        return {
+            "liquidityPoolAddress": address('pool', blockchain, symbol, paired),
+            "liquidityTokenStakingAddress": vault[0],
+            "liquidityTokenStakingNumber": vault[1],
+            "pairedTokenSymbol": paired,
+            "liquidity": 0,
+            "mainAssetAmountNow": 0,
+            "pairedAssetAmountNow": 0,
+            "pendingRewardsFromYieldVault": 0,
+        }
+
+    config = [entry('USDT', blockchains[0], 6, [])]
+    for blockchain in blockchains:
+        base, decimals = BASE_ASSETS[blockchain]
+        config.append(entry(base, blockchain, decimals, [pool(blockchain, base, 'USDT')]))
+
+    next_pid: Dict[str, int] = dict()
+
+    def vault_slot(kind: str, blockchain: str, index: int) -> Tuple[str, int]:
+        vault = address(kind, blockchain, index // tokens_per_vault)
+        next_pid[vault] = next_pid.get(vault, -1) + 1
+        return vault, next_pid[vault]
+
+    for i in range(tokens):
+        blockchain = blockchains[i % len(blockchains)]
+        symbol = f'TKN{i}'
+        paired_symbols = [BASE_ASSETS[blockchain][0]] + (['USDT'] if rng.random() < 0.5 else [])
+        pools = [pool(blockchain, symbol, paired, vault_slot('vault', blockchain, i)) for paired in paired_symbols]
+        config.append(entry(symbol, blockchain, rng.choice([6, 8, 18]), pools, vault_slot('staking', blockchain, i)))
+    return config
+
+
+def synthetic_wallets(count: int, seed: int = 0) -> List[str]:
+    return [Web3.to_checksum_address('0x' + hashlib.sha256(f'wallet:{seed}:{i}'.encode()).hexdigest()[:40]) for i in range(count)]
+
+
+def main():
+    """
+    Serves one chain of a token config: `python fake_rpc.py --config tokenInfo.json --blockchain Ethereum --port 8545`
+    """
+    parser = argparse.ArgumentParser(description='Offline JSON-RPC stand-in serving deterministic state for a token config.')
+    parser.add_argument('--config', default='tokenInfo.json', help='token config (default: tokenInfo.json)')
+    parser.add_argument('--blockchain', default='Ethereum')
+    parser.add_argument('--port', type=int, default=8545)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-multicall', action='store_true', help='serve without Multicall3')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every HTTP request')
+    parser.add_argument('--rate-limit', type=float, default=0, help='HTTP requests per second before 429')
+    parser.add_argument('--max-batch', type=int, default=0, help='largest JSON-RPC batch before 413')
+    parser.add_argument('--block-time', type=float, default=0, help='seconds per block (default: fixed head)')
+    parser.add_argument('--max-logs', type=int, default=0, help='most logs per eth_getLogs before failing')
+    parser.add_argument('--lp-holders', type=float, default=1.0, help='fraction of the pools a wallet has LP tokens of')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as file:
+        token_data = json.load(file)
+    rpc = FakeRpc(ChainState(token_data, args.blockchain, args.seed, args.lp_holders), not args.no_multicall, args.latency,
+                  args.rate_limit, args.max_batch, args.block_time, args.max_logs)
+    server = rpc.serve(args.port)
+    print(f'serving {args.blockchain} on http://{server.server_address[0]}:{server.server_address[1]}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
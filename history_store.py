@@ -0,0 +1,207 @@
+from typing import Any, Dict, List, Optional
+import os
+import sqlite3
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+
+# files of a day partition of a Parquet table merged into one once there are more
+DEFAULT_COMPACT_FILES = 16
+# column name and type of every table; rows are dicts with these keys
+TABLES = {
+    'positions': [
+        ('timestamp', 'int'), ('block', 'int'), ('blockchain', 'str'), ('wallet', 'str'), ('symbol', 'str'),
+        ('in_wallet', 'float'), ('bonded', 'float'), ('unbonded', 'float'),
+    ],
+    'pools': [
+        ('timestamp', 'int'), ('block', 'int'), ('blockchain', 'str'), ('wallet', 'str'), ('symbol', 'str'),
+        ('pool', 'str'), ('paired_symbol', 'str'), ('main_amount', 'float'), ('paired_amount', 'float'),
+    ],
+    'holdings': [
+        ('timestamp', 'int'), ('wallet', 'str'), ('symbol', 'str'), ('amount', 'float'), ('price', 'float'), ('usd_value', 'float'),
+    ],
+}
+
+
+class HistoryStore(ABC):
+    """
+    Append-only history of portfolio runs, keyed by timestamp/block/wallet, with range scans by wallet and time.
+    """
+
+    @abstractmethod
+    def append(self, tables: Dict[str, List[Dict[str, Any]]]) -> None:
+        """
+        Stores the rows of one run, by table name.
+        """
+
+    @abstractmethod
+    def scan(self, table: str, wallet: str = None, start: int = None, end: int = None) -> List[Dict[str, Any]]:
+        """
+        Returns the rows of a table, optionally of one wallet and between two unix timestamps (both included).
+        """
+
+
+class ParquetStore(HistoryStore):
+    def __init__(self, directory: str, compact_files: int = DEFAULT_COMPACT_FILES):
+        """
+        One Parquet file per table and run, partitioned by day: <directory>/<table>/date=YYYY-MM-DD/<run>.parquet.
+        Once a day has more than compact_files files they are merged into one, so frequent runs don't leave
+        thousands of tiny files. Scans skip the days outside the time range and the row groups of other wallets.
+        Needs `pip install pyarrow`.
+
+        Args:
+        directory (str): Root directory of the store.
+        compact_files (int): Files a day partition may have before they are merged.
+        """
+        import pyarrow
+
+        self.pa = pyarrow
+        self.directory = directory
+        self.compact_files = max(1, compact_files)
+        self._lock = threading.Lock()
+        types = {'int': pyarrow.int64(), 'float': pyarrow.float64(), 'str': pyarrow.string()}
+        self.schemas = {table: pyarrow.schema([(name, types[kind]) for name, kind in columns]) for table, columns in TABLES.items()}
+
+    def append(self, tables: Dict[str, List[Dict[str, Any]]]) -> None:
+        import pyarrow.parquet as pq
+
+        for table, rows in tables.items():
+            if not rows:
+                continue
+            # rows sorted by wallet keep each wallet in few pages, which the wallet filter can skip
+            rows = sorted(rows, key=lambda x: (x['wallet'], x['timestamp']))
+            for day, day_rows in group_by_day(rows).items():
+                directory = os.path.join(self.directory, table, f'date={day}')
+                os.makedirs(directory, exist_ok=True)
+                name = f"{day_rows[0]['timestamp']}-{uuid.uuid4().hex[:8]}.parquet"
+                arrow_table = self.pa.Table.from_pylist(day_rows, schema=self.schemas[table])
+                with self._lock:
+                    pq.write_table(arrow_table, os.path.join(directory, name), compression='zstd')
+                    self.compact(directory)
+
+    def compact(self, directory: str) -> None:
+        """
+        Merges the files of a day partition into one, rows sorted by wallet, once there are more than compact_files.
+        """
+        import pyarrow.parquet as pq
+
+        # files starting with '_' are skipped by scans until renamed
+        files = sorted(x for x in os.listdir(directory) if x.endswith('.parquet') and not x.startswith(('_', '.')))
+        if len(files) <= self.compact_files:
+            return
+        merged = self.pa.concat_tables([pq.read_table(os.path.join(directory, x)) for x in files])
+        merged = merged.sort_by([('wallet', 'ascending'), ('timestamp', 'ascending')])
+        name = f"{files[0].split('-')[0]}-{uuid.uuid4().hex[:8]}.parquet"
+        pq.write_table(merged, os.path.join(directory, f'_{name}'), compression='zstd')
+        os.replace(os.path.join(directory, f'_{name}'), os.path.join(directory, name))
+        for file in files:
+            os.remove(os.path.join(directory, file))
+
+    def scan(self, table: str, wallet: str = None, start: int = None, end: int = None) -> List[Dict[str, Any]]:
+        import pyarrow.dataset as ds
+
+        path = os.path.join(self.directory, table)
+        if not os.path.exists(path):
+            return []
+        dataset = ds.dataset(path, format='parquet', partitioning='hive', schema=self.schemas[table].append(self.pa.field('date', self.pa.string())))
+
+        conditions = []
+        if wallet:
+            conditions.append(ds.field('wallet') == wallet)
+        if start is not None:
+            conditions.append(ds.field('date') >= day_of(start))
+            conditions.append(ds.field('timestamp') >= start)
+        if end is not None:
+            conditions.append(ds.field('date') <= day_of(end))
+            conditions.append(ds.field('timestamp') <= end)
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+
+        columns = [name for name, _ in TABLES[table]]
+        result = dataset.to_table(columns=columns, filter=expression).sort_by([('timestamp', 'ascending')])
+        return result.to_pylist()
+
+
+class SQLiteStore(HistoryStore):
+    def __init__(self, path: str):
+        """
+        Fallback store in a single SQLite file, indexed on (wallet, timestamp).
+
+        Args:
+        path (str): Location of the database file.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        types = {'int': 'INTEGER', 'float': 'REAL', 'str': 'TEXT'}
+        with self._lock, self.connection:
+            for table, columns in TABLES.items():
+                self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(f'{name} {types[kind]}' for name, kind in columns)})")
+                self.connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_wallet_time ON {table} (wallet, timestamp)')
+                self.connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_time ON {table} (timestamp)')
+
+    def append(self, tables: Dict[str, List[Dict[str, Any]]]) -> None:
+        with self._lock, self.connection:
+            for table, rows in tables.items():
+                columns = [name for name, _ in TABLES[table]]
+                self.connection.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                    [tuple(row.get(x) for x in columns) for row in rows])
+
+    def scan(self, table: str, wallet: str = None, start: int = None, end: int = None) -> List[Dict[str, Any]]:
+        conditions, params = [], []
+        if wallet:
+            conditions.append('wallet = ?')
+            params.append(wallet)
+        if start is not None:
+            conditions.append('timestamp >= ?')
+            params.append(start)
+        if end is not None:
+            conditions.append('timestamp <= ?')
+            params.append(end)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        columns = [name for name, _ in TABLES[table]]
+        with self._lock:
+            cursor = self.connection.execute(f"SELECT {', '.join(columns)} FROM {table}{where} ORDER BY timestamp", params)
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def day_of(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d')
+
+
+def group_by_day(rows: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    days: Dict[str, List[Dict[str, Any]]] = dict()
+    for row in rows:
+        days.setdefault(day_of(row['timestamp']), []).append(row)
+    return days
+
+
+def open_store(path: str = None, store_format: str = None) -> HistoryStore:
+    """
+    Opens the history store at path (HISTORY_STORE, default 'history').
+
+    Args:
+    path (str): Directory of a Parquet store, or a .db/.sqlite file.
+    store_format (str): 'parquet', 'sqlite' or 'auto' (HISTORY_STORE_FORMAT). 'auto' uses Parquet when
+        pyarrow is installed and the path isn't a SQLite file.
+    """
+    path = path or os.getenv('HISTORY_STORE', 'history')
+    store_format = store_format or os.getenv('HISTORY_STORE_FORMAT', 'auto')
+    is_sqlite_file = path.endswith(('.db', '.sqlite', '.sqlite3'))
+
+    if store_format == 'auto':
+        try:
+            import pyarrow
+            store_format = 'sqlite' if is_sqlite_file else 'parquet'
+        except ImportError:
+            store_format = 'sqlite'
+
+    if store_format == 'parquet':
+        return ParquetStore(path)
+    if store_format == 'sqlite':
+        return SQLiteStore(path if is_sqlite_file else f'{path}.db')
+    raise Exception(f'Error in open_store: unknown format {store_format}')
@@ -0,0 +1,369 @@
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from web3 import Web3
+from chain_clients import RPC_ENV_VARS, get_chain_client
+from eth_codec import decode_values
+from metadata_cache import get_metadata_cache
+from rpc_provider import LOG_RANGE_MESSAGES, is_limit_error
+from watch import event_topic
+
+DEFAULT_CONFIG_FILE = 'tokenInfo.json'
+# first eth_getLogs range; halved while the provider refuses it, doubled while it answers
+DEFAULT_LOG_RANGE = 2000
+DEFAULT_MAX_LOG_RANGE = 100000
+# block hashes kept to detect reorgs; ranges older than this below the head are not checked
+REORG_DEPTH = 64
+# decimals of the LP tokens of Uniswap V2 style pairs, used for tokens without configured or cached decimals
+LP_DECIMALS = 18
+# pid of plain token balances (LP tokens held in the wallet), vault balances have the vault's pid
+NO_PID = -1
+ZERO_ADDRESS = '0x' + '0' * 40
+
+SCHEMA = [
+    # every balance change, kept to roll back reorged blocks
+    'CREATE TABLE IF NOT EXISTS events (blockchain TEXT, block INTEGER, block_hash TEXT, tx_hash TEXT, log_index INTEGER, '
+    'contract TEXT, pid INTEGER, wallet TEXT, delta TEXT)',
+    'CREATE INDEX IF NOT EXISTS events_block ON events (blockchain, block)',
+    # amounts are decimal strings, LP balances don't fit SQLite integers
+    'CREATE TABLE IF NOT EXISTS balances (blockchain TEXT, contract TEXT, pid INTEGER, wallet TEXT, amount TEXT, '
+    'PRIMARY KEY (blockchain, contract, pid, wallet))',
+    'CREATE INDEX IF NOT EXISTS balances_wallet ON balances (wallet)',
+    'CREATE TABLE IF NOT EXISTS checkpoints (blockchain TEXT, contract TEXT, block INTEGER, PRIMARY KEY (blockchain, contract))',
+    'CREATE TABLE IF NOT EXISTS blocks (blockchain TEXT, number INTEGER, hash TEXT, PRIMARY KEY (blockchain, number))',
+]
+
+
+def default_index_file(config_file: str = DEFAULT_CONFIG_FILE) -> str:
+    """
+    The index lives beside the config: tokenInfo.json -> tokenInfo.index.db
+    """
+    root, _ = os.path.splitext(config_file)
+    return f'{root}.index.db'
+
+
+class LpIndexer:
+    def __init__(self, token_data_list: List[Dict[str, Any]], path: str, from_blocks: Dict[str, int] = None,
+                 confirmations: int = 0, max_range: int = DEFAULT_MAX_LOG_RANGE):
+        """
+        Local SQLite index of the LP positions of every wallet, built from event logs: Transfer of the configured
+        LP tokens, and Deposit/Withdraw/EmergencyWithdraw of the yield vaults and unbonded staking. `sync` follows
+        the chains; `positions` and `holders` answer from the index without any RPC call.
+
+        Every contract has a checkpoint, the last block indexed, so contracts added to the config are indexed
+        from from_blocks on their own and then followed with the others. The hashes of the last REORG_DEPTH
+        blocks indexed are kept; a block whose hash changed is rolled back with everything after it.
+
+        Args:
+        token_data_list (List[Dict[str, Any]]): Token entries of tokenInfo.json.
+        path (str): Location of the SQLite file.
+        from_blocks (Dict[str, int]): First block indexed per chain, e.g. the deployment of the oldest contract. Defaults to 0.
+        confirmations (int): Blocks below the head left unindexed.
+        max_range (int): Widest eth_getLogs block range.
+        """
+        self.path = path
+        self.from_blocks = from_blocks or dict()
+        self.confirmations = confirmations
+        self.max_range = max_range
+        self.log_ranges: Dict[str, int] = dict()
+        self.topics = {
+            'transfer': event_topic('ERC20', 'Transfer'),
+            'deposit': event_topic('yieldVault', 'Deposit'),
+            'withdraw': [event_topic('yieldVault', x) for x in ('Withdraw', 'EmergencyWithdraw')],
+        }
+        self.build_contracts(token_data_list)
+
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def build_contracts(self, token_data_list: List[Dict[str, Any]]) -> None:
+        """
+        The LP tokens and vaults to index per chain, and what each (vault, pid) stakes. Pids come from the vault
+        index (see vault_index.py), else from the config.
+        """
+        metadata = get_metadata_cache()
+        self.contracts: Dict[str, set] = dict()
+        self.names: Dict[Tuple[str, str], str] = dict()
+        self.staked: Dict[str, Dict[Tuple[str, int], Tuple[str, str, str]]] = dict()
+        self.token_decimals: Dict[Tuple[str, str], int] = dict()
+        for token_data in token_data_list:
+            blockchain = token_data.get('blockchain')
+            symbol = token_data.get('symbol')
+            if token_data.get('tokenAddress') and token_data.get('decimals') is not None:
+                self.token_decimals[(blockchain, Web3.to_checksum_address(token_data['tokenAddress']))] = int(token_data['decimals'])
+            contracts = self.contracts.setdefault(blockchain, set())
+            stakes = [(token_data.get('unbondedStaking', {}).get('contractAddress'), token_data.get('tokenAddress'),
+                       token_data.get('unbondedStaking', {}).get('userInfoNumber'), symbol, 'unbonded')]
+            for lp_dict in token_data.get('liquidityPool', []):
+                if not lp_dict.get('liquidityPoolAddress'):
+                    continue
+                pool = Web3.to_checksum_address(lp_dict['liquidityPoolAddress'])
+                contracts.add(pool)
+                self.names[(blockchain, pool)] = f"{symbol}-{lp_dict.get('pairedTokenSymbol')}"
+                stakes.append((lp_dict.get('liquidityTokenStakingAddress'), lp_dict['liquidityPoolAddress'],
+                               lp_dict.get('liquidityTokenStakingNumber'), f"{symbol}-{lp_dict.get('pairedTokenSymbol')}", 'lp'))
+
+            for vault, staked_token, configured, name, kind in stakes:
+                if not vault or not staked_token:
+                    continue
+                vault, staked_token = Web3.to_checksum_address(vault), Web3.to_checksum_address(staked_token)
+                contracts.add(vault)
+                pid = metadata.get_vault_pid(blockchain, vault, staked_token)
+                pid = pid if pid is not None else (int(configured) if configured not in (None, '') else None)
+                if pid is not None:
+                    self.staked.setdefault(blockchain, dict())[(vault, pid)] = (staked_token, name, kind)
+
+    def decimals(self, blockchain: str, contract: str, pid: int = NO_PID) -> int:
+        """
+        Decimals of the balances of an LP token (pid NO_PID) or of a vault pid, i.e. of the token it stakes: from the
+        config, else the metadata cache, else LP_DECIMALS.
+        """
+        token = Web3.to_checksum_address(contract)
+        if pid != NO_PID:
+            token = self.staked.get(blockchain, {}).get((token, pid), (token,))[0]
+        decimals = self.token_decimals.get((blockchain, token))
+        if decimals is None:
+            decimals = get_metadata_cache().get_decimals(blockchain, token)
+        return int(decimals) if decimals is not None else LP_DECIMALS
+
+    def checkpoint(self, blockchain: str, contract: str) -> int:
+        row = self.connection.execute('SELECT block FROM checkpoints WHERE blockchain = ? AND contract = ?', (blockchain, contract)).fetchone()
+        return row[0] if row else self.from_blocks.get(blockchain, 0) - 1
+
+    def sync(self, blockchain: str) -> int:
+        """
+        Indexes the logs of one chain up to the head (less the confirmations), after rolling back reorged blocks.
+        Contracts are synced by checkpoint, the furthest behind first, until they all share one.
+
+        Returns:
+        int: The number of balance changes indexed.
+        """
+        web3 = get_chain_client(blockchain).web3
+        self.check_reorg(blockchain, web3)
+        head = web3.eth.block_number - self.confirmations
+        contracts = sorted(self.contracts.get(blockchain, []))
+        indexed = 0
+        while contracts:
+            with self._lock:
+                checkpoints = {contract: self.checkpoint(blockchain, contract) for contract in contracts}
+            lowest = min(checkpoints.values())
+            if lowest >= head:
+                break
+            group = [contract for contract, block in checkpoints.items() if block == lowest]
+            until = min([block for block in checkpoints.values() if block > lowest] + [head])
+            indexed += self.sync_range(blockchain, web3, group, lowest + 1, until, head)
+        return indexed
+
+    def sync_range(self, blockchain: str, web3: Web3, contracts: List[str], from_block: int, to_block: int, head: int) -> int:
+        """
+        Indexes the logs of some contracts over a block range, in eth_getLogs ranges adapted to the provider: a range
+        refused for its size is halved, and the next one is doubled, up to max_range. Each range is committed
+        with its checkpoint, so an interrupted sync resumes where it stopped.
+        """
+        topics = [[self.topics['transfer'], self.topics['deposit'], *self.topics['withdraw']]]
+        size = self.log_ranges.get(blockchain, DEFAULT_LOG_RANGE)
+        indexed = 0
+        start = from_block
+        while start <= to_block:
+            end = min(start + size - 1, to_block)
+            try:
+                logs = web3.eth.get_logs({'fromBlock': start, 'toBlock': end, 'address': contracts, 'topics': topics})
+            except Exception as e:
+                # only a range refused for its size is split, quotas and timeouts are not about it
+                if size == 1 or not is_limit_error(str(e), LOG_RANGE_MESSAGES):
+                    raise Exception(f'Error in sync_range: eth_getLogs of blocks {start}-{end} on {blockchain}: {e}')
+                size = max(1, size // 2)
+                continue
+            # older blocks are final, their hash is not needed
+            block_hash = Web3.to_hex(web3.eth.get_block(end)['hash']) if head - end < REORG_DEPTH else None
+            indexed += self.apply(blockchain, contracts, logs, end, block_hash)
+            start = end + 1
+            size = min(size * 2, self.max_range)
+        self.log_ranges[blockchain] = size
+        return indexed
+
+    def decode(self, log: Dict[str, Any]) -> List[Tuple[str, int, str, int]]:
+        """
+        (contract, pid, wallet, delta) of the balance changes of one log.
+        """
+        contract = Web3.to_checksum_address(log['address'])
+        topics = [Web3.to_hex(x) for x in log['topics']]
+        wallets = [Web3.to_checksum_address('0x' + x[-40:]) for x in topics[1:]]
+        (amount,) = decode_values(['uint256'], Web3.to_bytes(hexstr=log['data']) if isinstance(log['data'], str) else log['data'])
+        if topics[0] == self.topics['transfer']:
+            # mints and burns only change the other side
+            return [(contract, NO_PID, wallet, delta) for wallet, delta in ((wallets[0], -amount), (wallets[1], amount))
+                    if wallet != Web3.to_checksum_address(ZERO_ADDRESS)]
+        pid = int(topics[2], 16)
+        if topics[0] == self.topics['deposit']:
+            # Deposit(user, pid, amount, to) credits `to`
+            return [(contract, pid, Web3.to_checksum_address('0x' + topics[3][-40:]), amount)]
+        # Withdraw and EmergencyWithdraw(user, pid, amount, to) debit `user`
+        return [(contract, pid, wallets[0], -amount)]
+
+    def apply(self, blockchain: str, contracts: List[str], logs: List[Dict[str, Any]], checkpoint: int, block_hash: Optional[str]) -> int:
+        """
+        Stores the balance changes of the logs and moves the checkpoint of the contracts, in one transaction.
+        """
+        events = []
+        block_hashes = {checkpoint: block_hash} if block_hash else dict()
+        for log in logs:
+            block = int(log['blockNumber'], 16) if isinstance(log['blockNumber'], str) else log['blockNumber']
+            log_index = int(log['logIndex'], 16) if isinstance(log['logIndex'], str) else log['logIndex']
+            try:
+                changes = self.decode(log)
+            except Exception as e:
+                print(f"Error decoding log {log_index} of {Web3.to_hex(log['transactionHash'])} on {blockchain}: {e}")
+                continue
+            for contract, pid, wallet, delta in changes:
+                events.append((blockchain, block, Web3.to_hex(log['blockHash']), Web3.to_hex(log['transactionHash']),
+                               log_index, contract, pid, wallet, str(delta)))
+            if block > checkpoint - REORG_DEPTH:
+                block_hashes[block] = Web3.to_hex(log['blockHash'])
+
+        with self._lock, self.connection:
+            self.connection.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', events)
+            self.add_to_balances(blockchain, [(x[5], x[6], x[7], int(x[8])) for x in events])
+            self.connection.executemany('INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)',
+                                        [(blockchain, contract, checkpoint) for contract in contracts])
+            self.connection.executemany('INSERT OR REPLACE INTO blocks VALUES (?, ?, ?)',
+                                        [(blockchain, number, hash_) for number, hash_ in block_hashes.items()])
+            self.connection.execute('DELETE FROM blocks WHERE blockchain = ? AND number <= ?', (blockchain, checkpoint - REORG_DEPTH))
+        return len(events)
+
+    def add_to_balances(self, blockchain: str, changes: List[Tuple[str, int, str, int]]) -> None:
+        """
+        Adds (contract, pid, wallet, delta) changes to the balances. Called inside a transaction.
+        """
+        totals: Dict[Tuple[str, int, str], int] = dict()
+        for contract, pid, wallet, delta in changes:
+            totals[(contract, pid, wallet)] = totals.get((contract, pid, wallet), 0) + delta
+        rows = []
+        for (contract, pid, wallet), delta in totals.items():
+            row = self.connection.execute('SELECT amount FROM balances WHERE blockchain = ? AND contract = ? AND pid = ? AND wallet = ?',
+                                          (blockchain, contract, pid, wallet)).fetchone()
+            rows.append((blockchain, contract, pid, wallet, str((int(row[0]) if row else 0) + delta)))
+        self.connection.executemany('INSERT OR REPLACE INTO balances VALUES (?, ?, ?, ?, ?)', rows)
+
+    def check_reorg(self, blockchain: str, web3: Web3) -> None:
+        """
+        Compares the hashes of the last blocks indexed with the chain, newest first, and rolls back to the newest
+        that still matches. Costs one eth_getBlockByNumber when nothing was reorged.
+        """
+        with self._lock:
+            blocks = self.connection.execute('SELECT number, hash FROM blocks WHERE blockchain = ? ORDER BY number DESC',
+                                             (blockchain,)).fetchall()
+        for number, block_hash in blocks:
+            if Web3.to_hex(web3.eth.get_block(number)['hash']) == block_hash:
+                if number != blocks[0][0]:
+                    self.rollback(blockchain, number)
+                return
+        if blocks:
+            # reorged deeper than the hashes kept
+            self.rollback(blockchain, blocks[-1][0] - 1)
+
+    def rollback(self, blockchain: str, block: int) -> None:
+        """
+        Undoes the balance changes of the blocks after `block` and moves the checkpoints back to it.
+        """
+        print(f'Reorg detected on {blockchain}, rolling the LP index back to block {block}')
+        with self._lock, self.connection:
+            rows = self.connection.execute('SELECT contract, pid, wallet, delta FROM events WHERE blockchain = ? AND block > ?',
+                                           (blockchain, block)).fetchall()
+            self.add_to_balances(blockchain, [(contract, pid, wallet, -int(delta)) for contract, pid, wallet, delta in rows])
+            self.connection.execute('DELETE FROM events WHERE blockchain = ? AND block > ?', (blockchain, block))
+            self.connection.execute('DELETE FROM blocks WHERE blockchain = ? AND number > ?', (blockchain, block))
+            self.connection.execute('UPDATE checkpoints SET block = ? WHERE blockchain = ? AND block > ?', (block, blockchain, block))
+
+    def holders(self, blockchain: str, contract: str, pid: int = NO_PID) -> Dict[str, int]:
+        """
+        Non-zero balances of an LP token (pid NO_PID) or of a vault pid, by wallet, largest first. No RPC call.
+        """
+        with self._lock:
+            rows = self.connection.execute('SELECT wallet, amount FROM balances WHERE blockchain = ? AND contract = ? AND pid = ?',
+                                           (blockchain, Web3.to_checksum_address(contract), pid)).fetchall()
+        return dict(sorted(((wallet, int(amount)) for wallet, amount in rows if int(amount)), key=lambda x: -x[1]))
+
+    def positions(self, wallet: str) -> List[Dict[str, Any]]:
+        """
+        LP tokens of a wallet, held and staked per configured pool, and tokens in unbonded staking, from the index
+        only. Amounts are in base units of the token, whose decimals are given.
+        """
+        with self._lock:
+            rows = self.connection.execute('SELECT blockchain, contract, pid, amount FROM balances WHERE wallet = ?',
+                                           (Web3.to_checksum_address(wallet),)).fetchall()
+        positions: Dict[Tuple[str, str], Dict[str, Any]] = dict()
+        for blockchain, contract, pid, amount in rows:
+            if pid == NO_PID:
+                token, name, kind = contract, self.names.get((blockchain, contract)), 'lp'
+                field = 'in_wallet'
+            elif (contract, pid) in self.staked.get(blockchain, {}):
+                token, name, kind = self.staked[blockchain][(contract, pid)]
+                field = 'staked'
+            else:
+                # a pid of the vault outside the config
+                continue
+            position = positions.setdefault((blockchain, token), {'blockchain': blockchain, 'token': token, 'name': name, 'kind': kind,
+                                                                  'decimals': self.decimals(blockchain, token), 'in_wallet': 0, 'staked': 0})
+            position[field] += int(amount)
+        return [x for x in positions.values() if x['in_wallet'] or x['staked']]
+
+
+def main():
+    """
+    `python lp_indexer.py sync` indexes the logs of the configured LP tokens and vaults up to the head;
+    `python lp_indexer.py positions <wallet>` and `python lp_indexer.py holders <contract>` answer from the index.
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Index LP positions from event logs into SQLite.')
+    parser.add_argument('--config', default=DEFAULT_CONFIG_FILE, help='token config (default: tokenInfo.json)')
+    parser.add_argument('--index', default=None, help='SQLite file (default: LP_INDEX, or beside the config)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    sync = commands.add_parser('sync', help='index new logs of every chain')
+    sync.add_argument('--from-block', nargs='*', default=[], help='first block per chain, e.g. Ethereum=12000000 (default: 0)')
+    sync.add_argument('--confirmations', type=int, default=0, help='blocks below the head left unindexed')
+    sync.add_argument('--max-range', type=int, default=DEFAULT_MAX_LOG_RANGE, help='widest eth_getLogs block range')
+    positions = commands.add_parser('positions', help='LP positions of a wallet')
+    positions.add_argument('wallet')
+    holders = commands.add_parser('holders', help='holders of an LP token, or of a vault pid')
+    holders.add_argument('contract')
+    holders.add_argument('--blockchain', default='Ethereum')
+    holders.add_argument('--pid', type=int, default=NO_PID, help='pid of a vault')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as file:
+        token_data = json.load(file)
+    path = args.index or os.getenv('LP_INDEX') or default_index_file(args.config)
+
+    if args.command == 'sync':
+        from_blocks = {k: int(v) for k, v in (x.split('=') for x in args.from_block)}
+        indexer = LpIndexer(token_data, path, from_blocks, args.confirmations, args.max_range)
+        for blockchain in sorted(indexer.contracts):
+            if blockchain not in RPC_ENV_VARS:
+                continue
+            try:
+                print(f'{blockchain}: {indexer.sync(blockchain)} balance changes indexed')
+            except Exception as e:
+                print(f'Error indexing {blockchain}: {e}')
+    elif args.command == 'positions':
+        for position in LpIndexer(token_data, path).positions(args.wallet):
+            unit = 10 ** position['decimals']
+            print(f"{position['blockchain']} {position['name'] or position['token']} ({position['kind']}): "
+                  f"{position['in_wallet'] / unit:.6f} in wallet, {position['staked'] / unit:.6f} staked")
+    else:
+        indexer = LpIndexer(token_data, path)
+        unit = 10 ** indexer.decimals(args.blockchain, args.contract, args.pid)
+        for wallet, amount in indexer.holders(args.blockchain, args.contract, args.pid).items():
+            print(f'{wallet}: {amount / unit:.6f}')
+
+
+if __name__ == '__main__':
+    main()
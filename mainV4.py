@@ -1,20 +1,59 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Set
 import os
 from dotenv import load_dotenv
 from web3 import Web3
 import json
-from web3.gas_strategies.rpc import rpc_gas_price_strategy
 import concurrent.futures
-from web3.gas_strategies.rpc import rpc_gas_price_strategy
 from datetime import datetime
+from batching import CallBatch, CachedCall, DEFAULT_CHUNK_SIZE
+from chain_clients import get_chain_client
+from abi_registry import get_abi, get_contract
+from metadata_cache import get_metadata_cache
+from metrics import write_metrics
+from pricing import PriceGraph
+from query_plan import QueryPlan, compile_config
+from scheduler import PRIORITY_PRICING
+from snapshot import Snapshot, take_snapshot
+from valuation import lp_share_amounts, pending_rewards
 
 load_dotenv()
-WALLET_ADDRESS = os.getenv('WALLET_ADDRESS')
+# WALLET_ADDRESS may hold several comma separated wallets
+WALLET_ADDRESSES = [x.strip() for x in os.getenv('WALLET_ADDRESS', '').split(',') if x.strip()]
+WALLET_ADDRESS = WALLET_ADDRESSES[0] if WALLET_ADDRESSES else None
+MULTICALL_CHUNK_SIZE = int(os.getenv('MULTICALL_CHUNK_SIZE', DEFAULT_CHUNK_SIZE))
+# integer LP math, bit for bit like python ints, instead of float64 (see valuation.lp_share_amounts)
+EXACT_LP_MATH = os.getenv('EXACT_LP_MATH', '0') == '1'
+_checksummed: Dict[str, str] = dict()
+# the parts of a TokenYield that can be read on their own (see TokenYield.refresh)
+TOKEN_PARTS = ('wallet', 'lp', 'bonded', 'unbonded')
 
 
 class TokenPortfolio:
-    def __init__(self, token_data_list: list):
+    def __init__(self, token_data_list: list, pin_blocks: bool = True, wallets: List[str] = None, snapshot: Snapshot = None,
+                 parts: List[str] = TOKEN_PARTS, plan: QueryPlan = None):
+        """
+        Args:
+        token_data_list (list): Token entries of tokenInfo.json.
+        pin_blocks (bool): Read positions and prices at one block per chain, resolved up front,
+            instead of at 'latest'. Pinned reads are cached by block (see snapshot.BlockCache).
+        wallets (List[str]): Wallets to evaluate. Defaults to WALLET_ADDRESS. Pool-level reads
+            (reserves, totalSupply, prices) are shared by all wallets.
+        snapshot (Snapshot): Blocks to read at, e.g. historical blocks. Overrides pin_blocks.
+        parts (List[str]): Parts of every token to read, see TOKEN_PARTS. E.g. ['wallet'] for wallet balances only;
+            the totals then only count those parts.
+        plan (QueryPlan): The compiled reads of token_data_list, wallets and parts, e.g. shared by the portfolios
+            of a backfill. Compiled here if None (see query_plan.compile_config).
+        """
+        self.parts = check_parts(parts)
+        self.wallets = [TokenYield.checksum_address(x) for x in (wallets or WALLET_ADDRESSES)]
         self.tokens = []
+        # the reads that failed, printed as they happen; the values leave them out, so check it is empty when complete data matters
+        self.errors: List[str] = []
+        get_metadata_cache().check_config(token_data_list)
+        self.plan = plan or compile_config(token_data_list, self.wallets, self.parts)
+        if snapshot is None and pin_blocks:
+            snapshot = take_snapshot({x.get('blockchain') for x in token_data_list})
+        self.snapshot = snapshot
         # self.tokens = [TokenYield(token_data) for token_data in token_data_list]
         # self.load_ABIs()  # Load ABIs once for all tokens
         self.load_tokens_async(token_data_list)
@@ -22,15 +61,144 @@ class TokenPortfolio:
         self.dust_threshold = 0.0001
 
     def load_tokens_async(self, token_data_list: list):
-        # Asynchronously create TokenYield instances
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [executor.submit(TokenYield, token_data) for token_data in token_data_list]
+        make_batch = lambda blockchain: get_chain_client(blockchain).make_batch(MULTICALL_CHUNK_SIZE)
+        # Two phases, one batch per chain each (multicall or json-rpc, see ChainClient.make_batch):
+        # the per-wallet balances first, then the state of the pools only where a wallet has a position
+        batches, queued_tokens = self.queue_tokens(make_batch)
+        self.execute_batches(batches)
+        if 'lp' in self.parts:
+            self.execute_batches(self.queue_pool_states(queued_tokens, make_batch))
+        self.collect_tokens(queued_tokens)
+
+    def execute_batches(self, batches: Dict[str, CallBatch]) -> None:
+        # one thread per chain; each chain's scheduler sends the chunks concurrently,
+        # paced to each endpoint's rate limit, pricing pools first (see scheduler.EndpointScheduler)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(batches))) as executor:
+            futures = {executor.submit(batch.execute, self.get_block(blockchain)): blockchain for blockchain, batch in batches.items()}
             for future in concurrent.futures.as_completed(futures):
                 try:
-                    token_yield_instance = future.result()
-                    self.tokens.append(token_yield_instance)
+                    future.result()
                 except Exception as exc:
-                    print(f'Error creating TokenYield instance error: {exc}')
+                    self.report(f'Error executing batch for {futures[future]} error: {exc}')
+
+    def queue_tokens(self, make_batch) -> tuple:
+        """
+        Queues the distinct reads of the plan into one batch per chain and creates a TokenYield per token entry
+        and wallet, bound to them. A read repeated across entries or wallets is only queued once.
+
+        Args:
+        make_batch: Callable returning an empty batch for a blockchain.
+
+        Returns:
+        tuple: (batches by blockchain, queued TokenYield instances)
+        """
+        batches = dict()
+        for blockchain in self.plan.recorders:
+            try:
+                batches[blockchain] = make_batch(blockchain)
+            except Exception as exc:
+                self.report(f'Error creating batch for {blockchain} error: {exc}')
+        # every wallet gets its own copy, TokenYield writes its results into token_info
+        queued_tokens = self.plan.queue(batches, lambda token_data, wallet: TokenYield(token_data, wallet=wallet, parts=self.parts))
+        return batches, queued_tokens
+
+    def queue_pool_states(self, queued_tokens: list, make_batch) -> Dict[str, CallBatch]:
+        """
+        Queues the pool reads of the queued tokens, once their balances are executed (see TokenYield.queue_pool_state),
+        and the reserves of the pools the price graph will read.
+
+        Returns:
+        Dict[str, CallBatch]: The non-empty batches by blockchain.
+        """
+        pricing_pools = {blockchain: set(pools) for blockchain, pools in self.plan.pricing_pools.items()}
+        batches = dict()
+        for token_yield_instance in queued_tokens:
+            try:
+                blockchain = token_yield_instance.blockchain
+                if blockchain not in batches:
+                    batches[blockchain] = make_batch(blockchain)
+                token_yield_instance.queue_pool_state(batches[blockchain], pricing_pools.get(blockchain, set()))
+            except Exception as exc:
+                self.report(f'Error queueing pools of {token_yield_instance.symbol} error: {exc}')
+        return {blockchain: batch for blockchain, batch in batches.items() if len(batch)}
+
+    def collect_tokens(self, queued_tokens: list, blocks: Dict[str, int] = None) -> None:
+        """
+        Reads the results of the executed batches into the queued tokens and keeps the ones that succeeded.
+        The LP positions, and the pending vault rewards, of all tokens and wallets are valued together in one
+        vectorized pass each. blocks is passed to collect_rewards.
+        """
+        fetched = []
+        for token_yield_instance in queued_tokens:
+            try:
+                token_yield_instance.fetch_token_data(lp=False)
+                positions = token_yield_instance.lp_positions() if 'lp' in token_yield_instance.queued_parts else None
+                fetched.append((token_yield_instance, positions))
+            except Exception as exc:
+                self.report(f'Error creating TokenYield instance error: {exc}')
+
+        positions = [position for _, token_positions in fetched for position in token_positions or []]
+        token_amounts, paired_amounts = value_lp_positions(positions)
+        start = 0
+        for token_yield_instance, token_positions in fetched:
+            end = start + len(token_positions or [])
+            try:
+                if token_positions is not None:
+                    token_yield_instance.set_lp_amounts(token_positions, token_amounts[start:end], paired_amounts[start:end])
+                self.tokens.append(token_yield_instance)
+            except Exception as exc:
+                self.report(f'Error creating TokenYield instance error: {exc}')
+            start = end
+
+        self.collect_rewards(self.tokens, blocks)
+        for token_yield_instance in self.tokens:
+            token_yield_instance.calculate_totals()
+
+    def collect_rewards(self, tokens: list, blocks: Dict[str, int] = None) -> None:
+        """
+        Computes the pending vault rewards of all tokens and wallets from the userInfo and poolInfo reads,
+        instead of a pendingRewards call per wallet and pid (see valuation.pending_rewards).
+
+        Args:
+        tokens (list): TokenYield instances whose batch was executed.
+        blocks (Dict[str, int]): Block the reads were made at, per chain; the rewards of other chains are left as they are.
+            Defaults to the snapshot's, else the head.
+        """
+        rewards = []
+        for token_yield_instance in tokens:
+            try:
+                token_rewards = token_yield_instance.reward_positions(token_yield_instance.token_symbols)
+                if token_rewards:
+                    rewards.append((token_yield_instance, token_rewards))
+            except Exception as exc:
+                self.report(f'Error reading rewards of {token_yield_instance.symbol} error: {exc}')
+
+        if blocks is None:
+            blocks = dict()
+            for blockchain in {x.blockchain for x, _ in rewards}:
+                try:
+                    # unpinned reads were made at 'latest', the head is at most a few blocks later
+                    blocks[blockchain] = self.get_block(blockchain) or get_web3(blockchain).eth.block_number
+                except Exception as exc:
+                    self.report(f'Error reading the block of {blockchain} error: {exc}')
+        rewards = [(x, token_rewards) for x, token_rewards in rewards if x.blockchain in blocks]
+
+        positions = [position for _, token_rewards in rewards for position in token_rewards]
+        amounts = value_reward_positions(positions, [blocks[x.blockchain] for x, token_rewards in rewards for _ in token_rewards])
+        start = 0
+        for token_yield_instance, token_rewards in rewards:
+            token_yield_instance.set_pending_rewards(token_rewards, amounts[start:start + len(token_rewards)])
+            start += len(token_rewards)
+
+    def report(self, message: str) -> None:
+        print(message)
+        self.errors.append(message)
+
+    def get_block(self, blockchain: str):
+        """
+        Returns the block all reads of a chain are pinned to, or None for 'latest'.
+        """
+        return self.snapshot.block(blockchain) if self.snapshot else None
 
     def print_all_tokens(self):
         for token_yield in self.tokens:
@@ -42,101 +210,115 @@ class TokenPortfolio:
             if v > self.dust_threshold:
                 print(f'{k}: {v:.2f}')
 
+    def print_wallet_holdings(self):
+        for wallet, holdings in self.wallet_holdings.items():
+            print(f'\nTokens in wallet {wallet}:')
+            for k, v in holdings.items():
+                if v > self.dust_threshold:
+                    print(f'{k}: {v:.2f}')
+
     def sum_all_tokens(self):
-        # Logic to sum all tokens
+        # Logic to sum all tokens, per wallet and over all wallets; by symbol for display,
+        # and by (blockchain, symbol) for valuation, so a symbol is priced on the chain it is held on
         all_tokens = dict()
+        wallet_holdings = {wallet: dict() for wallet in self.wallets}
+        holdings_by_chain = dict()
+        wallet_holdings_by_chain = {wallet: dict() for wallet in self.wallets}
         for token in self.tokens:
             my_sum = token.get_all_assets()
+            holdings = wallet_holdings.setdefault(token.wallet, dict())
+            chain_holdings = wallet_holdings_by_chain.setdefault(token.wallet, dict())
             for k,v in my_sum.items():
                 all_tokens[k] = all_tokens.get(k, 0) + v
+                holdings[k] = holdings.get(k, 0) + v
+                holdings_by_chain[(token.blockchain, k)] = holdings_by_chain.get((token.blockchain, k), 0) + v
+                chain_holdings[(token.blockchain, k)] = chain_holdings.get((token.blockchain, k), 0) + v
 
         self.all_tokens = all_tokens
-
-    def get_net_value(self):
-        def get_val_in_terms_of_pair(liquidity_pool_address, token_yield):
-            x_addr = token_yield.token_info.get('tokenAddress')
-
-            liquidity_pool_address = token_yield.checksum_address(liquidity_pool_address)
-            liquidity_pool_contract = token_yield.web3.eth.contract(address=liquidity_pool_address, abi=token_yield.PAIR_ABI)
-
-            reserves = liquidity_pool_contract.functions.getReserves().call()
-            token_zero = liquidity_pool_contract.functions.token0().call()
-            token_one = liquidity_pool_contract.functions.token1().call()
-
-            decimals_zero = token_yield.web3.eth.contract(address=token_zero, abi=token_yield.ERC20_ABI).functions.decimals().call()
-            decimals_one = token_yield.web3.eth.contract(address=token_one, abi=token_yield.ERC20_ABI).functions.decimals().call()
-
-            rate = reserves[0] * (10 ** decimals_one) / (10 ** decimals_zero) / reserves[1]
-
-            if token_zero == x_addr:
-                return 1/rate
-            else:
-                return rate
-
-
-        # todo -- price in BNB is wrong.?????
-        def get_token_price_in_usdt(symbol: str):
-            if symbol == "USDT":
-                return 1
-
-            token_yield = next(x for x in self.tokens if x.symbol == symbol)
-            info = token_yield.token_info
-            lp = info.get('liquidityPool')
-
-            pool_dictionary = dict({x.get('pairedTokenSymbol'): x.get('liquidityPoolAddress') for x in lp if x.get('pairedTokenSymbol') in ["USDT", "ETH", 'BNB']})
-
-            if symbol in ["RJV", "SOPH"]:
-                print(f'{symbol} pool dictionary:')
-
-                # print(f'\nlp:')
-                # for k,v in lp.items():
-                #     print(f'{k} -> {v}')
-
-                # print(f'\n\npool dictionary:')
-                print(pool_dictionary)
-
-                # for k,v in pool_dictionary.items():
-                #     print(f'{k} -> {v}')
-
-            if 'USDT' in pool_dictionary:
-                return get_val_in_terms_of_pair(pool_dictionary['USDT'], token_yield)
-            elif 'ETH' in pool_dictionary:
-                eth_equiv = get_val_in_terms_of_pair(pool_dictionary['ETH'], token_yield)
-                eth_in_usdt = get_token_price_in_usdt('ETH')
-                print(f'\nsymbol: {symbol} ----      eth_equiv: {eth_equiv}, eth_in_usdt: {eth_in_usdt} ==> price: {eth_equiv*eth_in_usdt}')
-
-                return eth_equiv * eth_in_usdt
-            elif 'BNB' in pool_dictionary:
-                bnb_equiv = get_val_in_terms_of_pair(pool_dictionary['BNB'], token_yield)
-                bnb_in_usdt = get_token_price_in_usdt('BNB')
-                print(f'\nsymbol: {symbol} ----     bnb_equiv: {bnb_equiv}, bnb_in_usdt: {bnb_in_usdt} ==> price: {bnb_equiv*bnb_in_usdt}')
-                return bnb_equiv * bnb_in_usdt
-            else:
-                print(f'pool: {pool_dictionary}')
-                raise Exception(f"Error in get_token_price_in_usdt for symbol {symbol}. Lacking token pair contract.")
-
-
-        eth_price = get_token_price_in_usdt('ETH')
-        bnb_price = get_token_price_in_usdt('BNB')
-
-        print(f'eth: {eth_price}; bnb: {bnb_price}')
-
+        self.wallet_holdings = wallet_holdings
+        self.holdings_by_chain = holdings_by_chain
+        self.wallet_holdings_by_chain = wallet_holdings_by_chain
+
+    def get_net_value(self, verbose: bool = True):
+        # Every USD price is resolved from one batched reserves fetch (see pricing.PriceGraph)
+        self.price_graph = PriceGraph(self.tokens, MULTICALL_CHUNK_SIZE, self.snapshot)
+        self.reserves = self.price_graph.fetch_reserves()
+        self.errors.extend(self.price_graph.errors)
+        self.prices = self.price_graph.get_prices(self.reserves)
+        self.symbol_prices = symbol_prices = self.price_graph.get_symbol_prices(self.prices)
+
+        if verbose:
+            print(f"eth: {symbol_prices.get('ETH')}; bnb: {symbol_prices.get('BNB')}")
+        self.wallet_values = {wallet: self.value_holdings(self.prices, holdings, verbose=False) for wallet, holdings in self.wallet_holdings_by_chain.items()}
+        return self.value_holdings(self.prices, verbose=verbose)
+
+    def value_holdings(self, prices: Dict[tuple, float], holdings: Dict[tuple, float] = None, verbose: bool = True) -> float:
+        """
+        Returns the USD value of holdings (holdings_by_chain by default) given the prices by (blockchain, symbol)
+        of PriceGraph.get_prices. A symbol is priced on its own chain, and from another chain only if its chain has no quote.
+        """
         total = 0
-        for symbol, amount in self.all_tokens.items():
-            usdt_equivalent = get_token_price_in_usdt(symbol) * amount
-            print(f'{amount} {symbol} equals ${usdt_equivalent}')
+        for (blockchain, symbol), amount in (self.holdings_by_chain if holdings is None else holdings).items():
+            price = self.price_graph.get_price(prices, blockchain, symbol)
+            if price is None:
+                raise Exception(f"Error in get_net_value for symbol {symbol} on {blockchain}. Lacking token pair contract.")
+            usdt_equivalent = price * amount
+            if verbose:
+                print(f'{amount} {symbol} on {blockchain} equals ${usdt_equivalent}')
             total += usdt_equivalent
         return total
 
+    def export(self, store, timestamp: int = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Appends the positions, pool shares and valued holdings of every wallet to a history store.
+
+        Args:
+        store (HistoryStore): Destination, see history_store.open_store.
+        timestamp (int): Unix time of the run, now by default.
+
+        Returns:
+        Dict[str, List[Dict[str, Any]]]: The rows written, by table.
+        """
+        timestamp = int(timestamp or datetime.now().timestamp())
+        tables = {'positions': [], 'pools': [], 'holdings': []}
+        for token in self.tokens:
+            rows = token.export(timestamp, self.get_block(token.blockchain))
+            tables['positions'].extend(rows['positions'])
+            tables['pools'].extend(rows['pools'])
+
+        prices = getattr(self, 'prices', {})
+        price_graph = getattr(self, 'price_graph', None)
+        for wallet, holdings in self.wallet_holdings.items():
+            # a symbol held on several chains is valued at each chain's price; its price is then the average
+            usd_values = dict()
+            for (blockchain, symbol), amount in self.wallet_holdings_by_chain.get(wallet, {}).items():
+                price = price_graph.get_price(prices, blockchain, symbol) if price_graph is not None else None
+                if symbol in usd_values and usd_values[symbol] is None:
+                    continue
+                usd_values[symbol] = None if price is None else usd_values.get(symbol, 0) + price * amount
+            for symbol, amount in holdings.items():
+                usd_value = usd_values.get(symbol)
+                price = None if usd_value is None else (usd_value / amount if amount else 0.0)
+                tables['holdings'].append({'timestamp': timestamp, 'wallet': wallet, 'symbol': symbol, 'amount': amount,
+                                           'price': price, 'usd_value': usd_value})
+        store.append(tables)
+        return tables
+
 
 
 class TokenYield:
-    def __init__(self, token_info: Dict[str, Any]):
+    def __init__(self, token_info: Dict[str, Any], batch: CallBatch = None, wallet: str = None,
+                 parts: List[str] = TOKEN_PARTS):
         """
-        Initializes the TokenYield class with token information.
+        Initializes the TokenYield class with token information. Construction does no network I/O: the parts are
+        read by `refresh`, or on the first `get_all_assets`.
 
         Args:
         token_info (Dict[str, Any]): A dictionary containing token and blockchain information.
+        batch (CallBatch): Optional batch shared with other tokens of the same chain. When given, the reads of the
+            parts are queued; the caller executes the batch and then calls fetch_token_data.
+        wallet (str): Wallet whose positions are read. Defaults to WALLET_ADDRESS.
+        parts (List[str]): Parts read by default, see TOKEN_PARTS.
         """
         self.pair_decimals = {
             "USDT": 6,
@@ -146,15 +328,172 @@ class TokenYield:
         }
 
         self.token_info = token_info
+        self.wallet = self.checksum_address(wallet or WALLET_ADDRESS)
+        self.metadata = get_metadata_cache()
         self.load_web3()
         self.decompress_token_info()
         self.load_ABIs() # could be done in parent class
+        # (symbol, decimals) by address of the tokens vault rewards can be paid in; the whole config's once bound to a plan
+        self.token_symbols = {self.token_address: (self.symbol, self.decimals)}
+        self.calls = dict()
+        self.parts = check_parts(parts)
+        self.queued_parts = set()  # parts queued into the last batch, read by fetch_token_data
+        self.fetched = set()  # parts read at least once, counted in the totals
+        self.totals_stale = True
+
+        if batch is not None:
+            self.queue_token_data(batch)
+
+    def bind_calls(self, calls: Dict[str, Any], token_symbols: Dict[str, tuple] = None) -> None:
+        """
+        Uses calls queued by someone else, in the structure queue_token_data builds, for the parts of the constructor
+        (see QueryPlan.queue), and the plan's token_symbols to name vault rewards.
+        """
+        self.calls = calls
+        self.queued_parts = set(self.parts)
+        if token_symbols:
+            self.token_symbols = {**self.token_symbols, **token_symbols}
+
+    def refresh(self, parts: List[str] = None, block_identifier: Optional[Any] = None) -> Dict:
+        """
+        Reads the given parts again, in one batch sent in up to two rounds (balances, then the state of the pools
+        with a position). The other parts keep their last values.
+
+        Args:
+        parts (List[str]): Parts to read, see TOKEN_PARTS. Defaults to the parts of the constructor.
+        block_identifier: Block to read at. Defaults to 'latest'.
+
+        Returns:
+        Dict: The totals, see get_all_assets.
+        """
+        batch = get_chain_client(self.blockchain).make_batch(MULTICALL_CHUNK_SIZE)
+        self.queue_token_data(batch, parts)
+        batch.execute(block_identifier)
+        if 'lp' in self.queued_parts:
+            self.queue_pool_state(batch)
+            batch.execute(block_identifier)
         self.fetch_token_data()
-        self.calculate_totals()
+        rewards = self.reward_positions(self.token_symbols)
+        if rewards:
+            block = block_identifier if isinstance(block_identifier, int) else self.web3.eth.block_number
+            self.set_pending_rewards(rewards, value_reward_positions(rewards, [block] * len(rewards)))
+        return self.get_all_assets()
+
+    def queue_token_data(self, batch: CallBatch, parts: List[str] = None) -> None:
+        """
+        Queues the per-wallet reads of the parts into the batch: wallet balance, staking balances, and the LP tokens
+        held in every pair and its yield vault, with the poolInfo of the vaults. Once executed, queue_pool_state queues
+        the state of the pools the wallet has a position in.
+
+        Args:
+        batch (CallBatch): Batch for the chain of this token.
+        parts (List[str]): Parts to read, see TOKEN_PARTS. Defaults to the parts of the constructor.
+        """
+        self.queued_parts = set(self.parts if parts is None else check_parts(parts))
+        # every read is tagged with the symbol in the RPC metrics
+        with batch.tagged(self.symbol):
+            if 'wallet' in self.queued_parts:
+                token_contract = self.get_contract(self.token_address, 'ERC20')
+                self.calls['inWallet'] = batch.add(token_contract, 'balanceOf', self.wallet)
+
+            if 'bonded' in self.queued_parts and self.bonded_staking_address and self.symbol == "AGIX":
+                sing_stake = self.get_contract(self.bonded_staking_address, 'singularityTokenStake')
+                self.calls['bondedStaking'] = batch.add(sing_stake, 'balances', self.wallet)
+
+            if 'unbonded' in self.queued_parts and self.unbonded_staking_address:
+                unbonded_contract = self.get_contract(self.unbonded_staking_address, 'unbondedStaking')
+                user_info_number = self.vault_pid(self.unbonded_staking_address, self.token_address,
+                                                  self.token_info['unbondedStaking'].get('userInfoNumber'))
+                self.calls['unbondedStaking'] = batch.add(unbonded_contract, 'userInfo', user_info_number, self.wallet)
+                # the pool's reward accounting, shared by every wallet (see reward_positions)
+                self.calls['unbondedPool'] = batch.add(unbonded_contract, 'poolInfo', user_info_number)
+
+            if 'lp' not in self.queued_parts or self.symbol in self.pair_decimals.keys():
+                return
+
+            pool_calls = []
+            for lp_dict in self.liquidity_pool_info_list:
+                liquidity_pool_address = self.checksum_address(lp_dict.get("liquidityPoolAddress"))
+                yield_contract_address = self.checksum_address(lp_dict.get("liquidityTokenStakingAddress"))
+                special_number = self.vault_pid(yield_contract_address, liquidity_pool_address, lp_dict.get("liquidityTokenStakingNumber"))
+
+                if not liquidity_pool_address:
+                    pool_calls.append(None)
+                    continue
+
+                liquidity_pool_contract = self.get_contract(liquidity_pool_address, 'pair')
+                calls = {'myLp': batch.add(liquidity_pool_contract, 'balanceOf', self.wallet)}
+                if yield_contract_address:
+                    yield_contract = self.get_contract(yield_contract_address, 'yieldVault')
+                    calls['yieldLp'] = batch.add(yield_contract, 'userInfo', special_number, self.wallet)
+                    calls['yieldPool'] = batch.add(yield_contract, 'poolInfo', special_number)
+                pool_calls.append(calls)
 
-    def fetch_token_data(self) -> Dict[str, Any]:
+            self.calls['liquidityPool'] = pool_calls
+
+    def vault_pid(self, vault_address: str, staked_token: str, configured: Any) -> Optional[int]:
+        """
+        Pid of the staked token in the vault: the one in the vault index (see vault_index.py), else the configured one.
+        """
+        pid = self.metadata.get_vault_pid(self.blockchain, vault_address, staked_token) if vault_address else None
+        if pid is not None:
+            return pid
+        return int(configured) if configured not in (None, '') else None
+
+    def queue_pool_state(self, batch: CallBatch, pricing_pools: Set[str] = frozenset()) -> None:
+        """
+        Queues the pool reads (reserves, token0, totalSupply) of the pools the wallet holds LP tokens of, in the
+        pair or in its vault. Pools with an empty position are skipped. Needs the batch of queue_token_data to be executed,
+        with the 'lp' part queued.
+
+        Args:
+        batch (CallBatch): Batch for the chain of this token.
+        pricing_pools (Set[str]): Pools the price graph reads next; their reserves are queued anyway, so the
+            price graph finds them in the block cache.
+        """
+        if 'lp' not in self.queued_parts:
+            return
+        with batch.tagged(self.symbol):
+            for lp_dict, calls in zip(self.liquidity_pool_info_list, self.calls.get('liquidityPool', [])):
+                if not calls:
+                    continue
+                liquidity_pool_address = self.checksum_address(lp_dict.get("liquidityPoolAddress"))
+                has_position = self.lp_balance(calls) != 0
+                is_pricing_pool = liquidity_pool_address in pricing_pools
+                if not has_position and not is_pricing_pool:
+                    continue
+
+                liquidity_pool_contract = self.get_contract(liquidity_pool_address, 'pair')
+                # reserves of the pools prices come from are sent first
+                with batch.tagged(self.symbol, PRIORITY_PRICING if is_pricing_pool else batch.priority):
+                    calls['reserves'] = batch.add(liquidity_pool_contract, 'getReserves')
+                if not has_position:
+                    continue
+
+                pool_tokens = self.metadata.get_pool_tokens(self.blockchain, liquidity_pool_address)
+                calls['token0'] = CachedCall(pool_tokens[0]) if pool_tokens else batch.add(liquidity_pool_contract, 'token0')
+                calls['totalLp'] = batch.add(liquidity_pool_contract, 'totalSupply')
+
+    @staticmethod
+    def lp_balance(calls: Dict[str, Any]) -> Optional[int]:
+        """
+        LP tokens of a position, in the pair and staked in its vault. None if a read failed.
+        """
+        if not calls['myLp'].success or ('yieldLp' in calls and not calls['yieldLp'].success):
+            return None
+        my_lp = calls['myLp'].value
+        if 'yieldLp' in calls:
+            my_lp += calls['yieldLp'].value[0]
+        return my_lp
+
+    def fetch_token_data(self, lp: bool = True) -> Dict[str, Any]:
         """
         Fetches and calculates token data based on the provided token information.
+        Reads the results of the parts queued by queue_token_data, so the batch must have been executed.
+        The totals are computed again on the next get_all_assets.
+
+        Args:
+        lp (bool): Also value the LP positions. TokenPortfolio values them for all tokens at once instead.
 
         Returns:
         Dict[str, Any]: A dictionary with fetched and calculated token data.
@@ -168,10 +507,17 @@ class TokenYield:
         ):
             raise Exception("Missing web3 or other details")
 
-        self.get_wallet_balance()
-        self.get_yield()
-        self.get_bonded()
-        self.get_unbonded()
+        if 'wallet' in self.queued_parts:
+            self.get_wallet_balance()
+        if lp and 'lp' in self.queued_parts:
+            self.get_yield()
+        if 'bonded' in self.queued_parts:
+            self.get_bonded()
+        if 'unbonded' in self.queued_parts:
+            self.get_unbonded()
+        # 'lp' is marked by set_lp_amounts
+        self.fetched |= self.queued_parts - {'lp'}
+        self.totals_stale = True
 
         # Fetching token data
         # token_contract = self.web3.eth.contract(address=self.token_address, abi=self.PAIR_ABI)
@@ -195,37 +541,32 @@ class TokenYield:
             raise Exception(f'Error. Failed in decomppress_token_info: {e}')
 
     def load_web3(self) -> None:
-        blockchain = self.token_info.get("blockchain")
         self.web3 = None
-        if blockchain == "Ethereum":
-            rpc_url = os.getenv('ETH_RPC')
-        elif blockchain == "Binance":
-            rpc_url = os.getenv('BNB_RPC')
-        else:
-            raise Exception("Unable to load web3")
-
-        # Setup Web3 connection
-        self.web3 = Web3(Web3.HTTPProvider(rpc_url))
+        self.web3 = get_web3(self.token_info.get("blockchain"))
 
     def load_ABIs(self) -> None:
         try:
-            # Load ABI files (assuming these are stored in a directory named 'ABI')
-            with open('ABI/pair.json', 'r') as file:
-                self.PAIR_ABI = json.load(file)
-            with open('ABI/yieldVault.json', 'r') as file:
-                self.YIELD_VAULT_ABI = json.load(file)
-            with open('ABI/ERC20.json', 'r') as file:
-                self.ERC20_ABI = json.load(file)
-            with open('ABI/unbondedStaking.json', 'r') as file:
-                self.UNBONDED_STAKING_ABI = json.load(file)
-            with open('ABI/singularityTokenStake.json', 'r') as file:
-                self.SINGULARITY_TOKEN_STAKE = json.load(file)
-            # with open('ABI/pairBNB.json', 'r') as file:
-            #     self.PAIR_BNB_ABI = json.load(file)
+            # ABI files are parsed once per process and shared by every instance (see abi_registry)
+            self.PAIR_ABI = get_abi('pair')
+            self.YIELD_VAULT_ABI = get_abi('yieldVault')
+            self.ERC20_ABI = get_abi('ERC20')
+            self.UNBONDED_STAKING_ABI = get_abi('unbondedStaking')
+            self.SINGULARITY_TOKEN_STAKE = get_abi('singularityTokenStake')
+            # self.PAIR_BNB_ABI = get_abi('pairBNB')
 
         except Exception as e:
             raise Exception(f'Error in load_ABIs: {e}')
 
+    def get_contract(self, address: str, abi_name: str):
+        """
+        Returns the shared contract object of an address on this token's blockchain.
+
+        Args:
+        address (str): Checksummed contract address.
+        abi_name (str): Name of the ABI file in ABI/, e.g. 'pair'.
+        """
+        return get_contract(self.web3, self.blockchain, address, abi_name)
+
     def print_data(self) -> None:
         """
         Prints the token data in a formatted manner.
@@ -240,8 +581,7 @@ class TokenYield:
         Fetches and returns bonded data.
         """
         try:
-            token_contract = self.web3.eth.contract(address=self.token_address, abi=self.ERC20_ABI)
-            bal = token_contract.functions.balanceOf(WALLET_ADDRESS).call() / 10**self.decimals
+            bal = self.calls['inWallet'].value / 10**self.decimals
             self.token_info['inWallet'] = bal
         except Exception as e:
             raise Exception(f'Error in get_wallet_balance: {e}')
@@ -255,9 +595,9 @@ class TokenYield:
             if not self.bonded_staking_address:
                 return
             elif self.symbol == "AGIX":
-                sing_stake = self.web3.eth.contract(address=self.bonded_staking_address, abi=self.SINGULARITY_TOKEN_STAKE)
-                staked = sing_stake.functions.balances(WALLET_ADDRESS).call() / 10**self.decimals
-                pending_rewards = 0 # todo figure out how to get rewards
+                staked = self.calls['bondedStaking'].value / 10**self.decimals
+                # rewards of a stake window are added to balances when the window closes, nothing is pending
+                pending_rewards = 0
             else:
                 staked = 0
                 pending_rewards = 0
@@ -274,15 +614,10 @@ class TokenYield:
         if not self.unbonded_staking_address:
             return
         try:
-
-            # todo -- we can't hardcode the userinfo as it varies for each one.
-
             # Implement logic to fetch unbonded data
-            unbonded_contract = self.web3.eth.contract(address=self.unbonded_staking_address, abi=self.UNBONDED_STAKING_ABI)
-            user_info_number = self.token_info['unbondedStaking']['userInfoNumber']
-            amount, user_debt = unbonded_contract.functions.userInfo(user_info_number, WALLET_ADDRESS).call()
+            amount, user_debt = self.calls['unbondedStaking'].value
             self.token_info['unbondedStaking']['staked'] = amount / 10 ** self.decimals
-            # todo -- understand the logic for getting the rewards
+            # pendingRewards is set by set_pending_rewards
 
             # print(f"{self.symbol}, in unbonded staking on {self.blockchain}, has tokens: {self.token_info['unbondedStaking']['staked']}")
         except Exception as e:
@@ -292,99 +627,191 @@ class TokenYield:
         pass
 
 
-    def get_yield(self) -> None:
+    def get_yield(self) -> Dict[str, float]:
         """
         Fetches and returns yield data.
         """
         if self.symbol in self.pair_decimals.keys():
-            return
+            self.fetched.add('lp')
+            return dict()
 
-        # Initialize values to zero before iterating over list
-        total_token = 0
-        total_paired_token = 0
-        my_token_data = dict()
+        positions = self.lp_positions()
+        token_amounts, paired_amounts = value_lp_positions(positions)
+        return self.set_lp_amounts(positions, token_amounts, paired_amounts)
+
+    def lp_positions(self) -> List[tuple]:
+        """
+        Reads the LP position of every pool from the executed calls.
 
-        for lp_dict in self.liquidity_pool_info_list:
-            liquidity_pool_address = self.checksum_address(lp_dict.get("liquidityPoolAddress"))
-            yield_contract_address = self.checksum_address(lp_dict.get("liquidityTokenStakingAddress"))
-            special_number = int(lp_dict.get("liquidityTokenStakingNumber")) if lp_dict.get("liquidityTokenStakingNumber") else None
+        Returns:
+        List[tuple]: (lp_dict, reserve0, reserve1, my_lp, total_lp, is_token0, decimals, paired_decimals) per pool.
+        """
+        if self.symbol in self.pair_decimals.keys():
+            return []
+
+        positions = []
+        for lp_dict, calls in zip(self.liquidity_pool_info_list, self.calls['liquidityPool']):
             paired_token_symbol = lp_dict.get("pairedTokenSymbol")
 
-            if not liquidity_pool_address:
+            if not calls:
                 continue
 
-            liquidity_pool_contract = self.web3.eth.contract(address=liquidity_pool_address, abi=self.PAIR_ABI)
-
             # todo this can be more generic
             # paired_decimals = 18 if paired_token_symbol == "ETH" else 6
             paired_decimals = self.pair_decimals[paired_token_symbol] # error if does not exist
 
-            # Uniswap Pair
-            reserves = liquidity_pool_contract.functions.getReserves().call()
-            token_zero = liquidity_pool_contract.functions.token0().call()
-
             # get liquidity
-            my_lp = liquidity_pool_contract.functions.balanceOf(WALLET_ADDRESS).call()
-            total_lp = liquidity_pool_contract.functions.totalSupply().call()
+            my_lp = calls['myLp'].value
 
             # if ther eis a yield vault, get amount of lp tokens staked there
-            if yield_contract_address:
-                yield_contract = self.web3.eth.contract(address=yield_contract_address, abi=self.YIELD_VAULT_ABI)
-                yield_lp, _ = yield_contract.functions.userInfo(special_number, WALLET_ADDRESS).call()
-                # print(yield_lp)
-                # print(total_lp)
+            if 'yieldLp' in calls:
+                yield_lp, _ = calls['yieldLp'].value
                 my_lp += yield_lp
 
-            if token_zero == self.token_address:
-                total_token += reserves[0] * my_lp / total_lp / (10 ** self.decimals)
-                total_paired_token += reserves[1] * my_lp / total_lp / (10 ** paired_decimals)
-                # token_price = (reserves[1] / 10 ** paired_decimals) / (reserves[0] / 10 ** decimals)
-            else:
-                total_token += reserves[1] * my_lp / total_lp / (10 ** self.decimals)
-                total_paired_token += reserves[0] * my_lp / total_lp / (10 ** paired_decimals)
-                # token_price = (reserves[0] / 10 ** paired_decimals) / (reserves[1] / 10 ** decimals)
-            my_token_data[self.symbol] = my_token_data.get(self.symbol, 0) + total_token
-            my_token_data[paired_token_symbol] = my_token_data.get(paired_token_symbol, 0) + total_paired_token
+            if not my_lp:
+                # nothing to own, the pool state was not read (see queue_pool_state)
+                positions.append((lp_dict, 0, 0, 0, 1, True, self.decimals, paired_decimals))
+                continue
+
+            # Uniswap Pair
+            reserves = calls['reserves'].value
+            token_zero = calls['token0'].value
+            total_lp = calls['totalLp'].value
+
+            if not total_lp:
+                # empty pool, nothing to own
+                my_lp, total_lp = 0, 1
+            positions.append((lp_dict, reserves[0], reserves[1], my_lp, total_lp, token_zero == self.token_address,
+                              self.decimals, paired_decimals))
+        return positions
+
+    def set_lp_amounts(self, positions: List[tuple], token_amounts, paired_amounts) -> Dict[str, float]:
+        """
+        Stores the valued LP positions (see lp_positions) in token_info and returns the amounts per symbol.
+        """
+        my_token_data = dict()
+        for position, total_token, total_paired_token in zip(positions, token_amounts, paired_amounts):
+            lp_dict = position[0]
+            paired_token_symbol = lp_dict.get("pairedTokenSymbol")
+            my_token_data[self.symbol] = my_token_data.get(self.symbol, 0) + float(total_token)
+            my_token_data[paired_token_symbol] = my_token_data.get(paired_token_symbol, 0) + float(total_paired_token)
 
-            lp_dict['mainAssetAmountNow'] = total_token
-            lp_dict['pairedAssetAmountNow'] = total_paired_token
-            lp_dict['pendingRewardsFromYieldVault'] = 0 # todo
+            lp_dict['mainAssetAmountNow'] = float(total_token)
+            lp_dict['pairedAssetAmountNow'] = float(total_paired_token)
+            # set by set_pending_rewards, which an LP refresh alone doesn't run: keep the last value
+            lp_dict.setdefault('pendingRewardsFromYieldVault', 0)
 
+        self.fetched.add('lp')
+        self.totals_stale = True
         return my_token_data
 
+    def reward_positions(self, token_symbols: Dict[str, tuple]) -> List[tuple]:
+        """
+        Reads the vault positions (unbonded staking and LP vaults) from the executed calls, for set_pending_rewards.
+        Positions whose rewards token is unknown (see vault_index.py) or not in token_symbols are skipped.
+
+        Args:
+        token_symbols (Dict[str, tuple]): (symbol, decimals) by token address, see QueryPlan.token_symbols.
+
+        Returns:
+        List[tuple]: (target dict, key, rewards symbol, amount, rewardDebt, tokenPerBlock, lpSupply, accRewardsPerShare,
+            lastRewardBlock, endOfEpochBlock, rewards decimals) per position.
+        """
+        vaults = []
+        if 'unbonded' in self.queued_parts and 'unbondedPool' in self.calls:
+            vaults.append((self.token_info['unbondedStaking'], 'pendingRewards', self.unbonded_staking_address,
+                           self.calls['unbondedStaking'], self.calls['unbondedPool']))
+        if 'lp' in self.queued_parts:
+            for lp_dict, calls in zip(self.liquidity_pool_info_list, self.calls.get('liquidityPool', [])):
+                if calls and 'yieldPool' in calls:
+                    vaults.append((lp_dict, 'pendingRewardsFromYieldVault', self.checksum_address(lp_dict.get('liquidityTokenStakingAddress')),
+                                   calls['yieldLp'], calls['yieldPool']))
+
+        positions = []
+        for target, key, vault, user_call, pool_call in vaults:
+            rewards_token = (self.metadata.get_vault(self.blockchain, vault) or {}).get('rewardsToken')
+            if rewards_token not in token_symbols or not user_call.success or not pool_call.success:
+                continue
+            symbol, decimals = token_symbols[rewards_token]
+            amount, reward_debt = user_call.value
+            positions.append((target, key, symbol, amount, reward_debt, *pool_call.value, decimals))
+        return positions
+
+    def set_pending_rewards(self, positions: List[tuple], amounts) -> None:
+        """
+        Stores the pending rewards of the positions of reward_positions, and the symbol they are paid in.
+        """
+        for position, amount in zip(positions, amounts):
+            target, key, symbol = position[:3]
+            target[key] = float(amount)
+            target['rewardsSymbol'] = symbol
+        self.totals_stale = True
+
     def get_all_assets(self) -> Dict:
         """
-        Calls all data-fetching methods and aggregates the results.
+        Returns the amounts owned per symbol, over the parts read so far. The first call reads the parts of the
+        constructor if nothing was read yet; the totals are only computed again after a read.
         """
+        if not self.fetched:
+            self.refresh()
+        if self.totals_stale:
+            self.calculate_totals()
         return self.token_info.get('totalAssetsOwned')
 
-    def export(self) -> None:
+    def export(self, timestamp: int = None, block: int = None) -> Dict[str, List[Dict[str, Any]]]:
         """
-        Exports the current data with a datetime stamp.
+        Exports the current data as history rows (see history_store.TABLES), stamped with timestamp and block.
+
+        Returns:
+        Dict[str, List[Dict[str, Any]]]: One 'positions' row and a 'pools' row per liquidity pool.
         """
-        print(f'exporting...')
-        return {
-            "current_datetime": datetime.now().isoformat(),
-            "data": self.data
+        timestamp = int(timestamp or datetime.now().timestamp())
+        key = {'timestamp': timestamp, 'block': block, 'blockchain': self.blockchain, 'wallet': self.wallet, 'symbol': self.symbol}
+        bonded = self.token_info.get('bondedStaking', {})
+        unbonded = self.token_info.get('unbondedStaking', {})
+        position = {
+            **key,
+            'in_wallet': self.token_info.get('inWallet', 0),
+            'bonded': bonded.get('staked', 0) + bonded.get('pendingRewards', 0),
+            'unbonded': unbonded.get('staked', 0) + (unbonded.get('pendingRewards', 0) if unbonded.get('rewardsSymbol', self.symbol) == self.symbol else 0),
         }
+        pools = [{
+            **key,
+            'pool': self.checksum_address(lp_dict.get('liquidityPoolAddress')),
+            'paired_symbol': lp_dict.get('pairedTokenSymbol'),
+            'main_amount': lp_dict.get('mainAssetAmountNow', 0),
+            'paired_amount': lp_dict.get('pairedAssetAmountNow', 0),
+        } for lp_dict in self.liquidity_pool_info_list if lp_dict.get('liquidityPoolAddress')]
+        return {'positions': [position], 'pools': pools}
 
     def calculate_totals(self) -> None:
         """
-        Fetches and returns bonded data.
+        Sums the parts read so far into token_info['totalAssetsOwned'].
         """
-        # Implement logic to fetch bonded data
-
-        bonded = self.token_info.get('bondedStaking').get('staked', 0) + self.token_info.get('bondedStaking').get('pendingRewards', 0)
-        unbonded = self.token_info.get('unbondedStaking').get('staked') + self.token_info.get('unbondedStaking').get('pendingRewards', 0)
-        totals = dict({self.symbol: self.token_info.get('inWallet', 0) + bonded + unbonded})
-
-        for lp_dict in self.liquidity_pool_info_list:
-            totals[self.symbol] += lp_dict.get("mainAssetAmountNow")
-            paired_token_symbol = lp_dict.get("pairedTokenSymbol")
-            paired_amount = lp_dict.get("pairedAssetAmountNow")
-            totals[paired_token_symbol] = totals.get(paired_token_symbol,0) + paired_amount
+        totals = dict({self.symbol: 0})
+        if 'wallet' in self.fetched:
+            totals[self.symbol] += self.token_info.get('inWallet', 0)
+        if 'bonded' in self.fetched:
+            totals[self.symbol] += self.token_info.get('bondedStaking').get('staked', 0) + self.token_info.get('bondedStaking').get('pendingRewards', 0)
+        if 'unbonded' in self.fetched:
+            unbonded = self.token_info.get('unbondedStaking')
+            totals[self.symbol] += unbonded.get('staked')
+            # vault rewards may be paid in another token (see set_pending_rewards)
+            rewards_symbol = unbonded.get('rewardsSymbol', self.symbol)
+            totals[rewards_symbol] = totals.get(rewards_symbol, 0) + unbonded.get('pendingRewards', 0)
+
+        if 'lp' in self.fetched:
+            for lp_dict in self.liquidity_pool_info_list:
+                totals[self.symbol] += lp_dict.get("mainAssetAmountNow")
+                paired_token_symbol = lp_dict.get("pairedTokenSymbol")
+                paired_amount = lp_dict.get("pairedAssetAmountNow")
+                totals[paired_token_symbol] = totals.get(paired_token_symbol,0) + paired_amount
+                if lp_dict.get('pendingRewardsFromYieldVault'):
+                    rewards_symbol = lp_dict.get('rewardsSymbol', self.symbol)
+                    totals[rewards_symbol] = totals.get(rewards_symbol, 0) + lp_dict['pendingRewardsFromYieldVault']
 
         self.token_info['totalAssetsOwned'] = totals
+        self.totals_stale = False
 
     # @staticmethod
     # def checksum_address(address: str) -> str:
@@ -399,7 +826,13 @@ class TokenYield:
         Returns:
         str: The checksummed Ethereum address.
         """
-        return address if not address else Web3.to_checksum_address(address)
+        if not address:
+            return address
+        # hashing every address on every access adds up, the same addresses come back every cycle
+        checksummed = _checksummed.get(address)
+        if checksummed is None:
+            checksummed = _checksummed[address] = Web3.to_checksum_address(address)
+        return checksummed
         # return Web3.to_checksum_address(address)
         # return self.web3.utils.toChecksumAddress(address)
 
@@ -411,6 +844,43 @@ class TokenYield:
 
 
 
+def check_parts(parts: List[str]) -> tuple:
+    """
+    Validates a list of TOKEN_PARTS and returns it in TOKEN_PARTS order.
+    """
+    unknown = set(parts) - set(TOKEN_PARTS)
+    if unknown or not parts:
+        raise Exception(f'Error in check_parts: unknown parts {sorted(unknown)}, expected some of {TOKEN_PARTS}')
+    return tuple(x for x in TOKEN_PARTS if x in parts)
+
+
+def value_lp_positions(positions: List[tuple]) -> tuple:
+    """
+    Token and paired token amounts of LP positions (see TokenYield.lp_positions), in one vectorized pass.
+    """
+    if not positions:
+        return [], []
+    columns = list(zip(*positions))[1:]
+    return lp_share_amounts(*columns, exact=EXACT_LP_MATH)
+
+
+def value_reward_positions(positions: List[tuple], blocks: List[int]) -> list:
+    """
+    Pending rewards of vault positions (see TokenYield.reward_positions) at the block of each, in one vectorized pass.
+    """
+    if not positions:
+        return []
+    columns = list(zip(*positions))[3:]
+    return pending_rewards(*columns[:7], blocks, columns[7], exact=EXACT_LP_MATH)
+
+
+def get_web3(blockchain: str) -> Web3:
+    """
+    Returns the shared Web3 connection of the given blockchain.
+    """
+    return get_chain_client(blockchain).web3
+
+
 def load_token_data(json_file: str = 'tokenInfo.json') -> Dict:
     """
     Loads token data from a JSON file.
@@ -429,10 +899,20 @@ def main():
 
     portfolio = TokenPortfolio(token_data)
     # portfolio.print_all_tokens()
+    if len(portfolio.wallets) > 1:
+        portfolio.print_wallet_holdings()
     portfolio.print_holdings()
     net_value = portfolio.get_net_value()
+    if len(portfolio.wallets) > 1:
+        for wallet, value in portfolio.wallet_values.items():
+            print(f'{wallet}: ${value}')
     print(f'net value: {net_value}')
 
+    if os.getenv('HISTORY_STORE'):
+        from history_store import open_store
+        portfolio.export(open_store())
+    write_metrics()
+
 
 def print_group_data(results: Dict):
     """
@@ -0,0 +1,216 @@
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import hashlib
+import json
+import os
+import threading
+
+DEFAULT_CONFIG_FILE = 'tokenInfo.json'
+
+
+def default_lock_file(config_file: str = DEFAULT_CONFIG_FILE) -> str:
+    """
+    The lock file lives beside the config: tokenInfo.json -> tokenInfo.lock.json
+    """
+    root, ext = os.path.splitext(config_file)
+    return f'{root}.lock{ext or ".json"}'
+
+
+def config_hash(token_data_list: List[Dict[str, Any]]) -> str:
+    """
+    Hash of the contracts referenced by the config. Balances and other mutable fields are ignored,
+    so only adding, removing or changing a token or pool invalidates the lock file.
+    """
+    contracts = set()
+    for token_data in token_data_list:
+        blockchain = token_data.get('blockchain')
+        contracts.add((blockchain, str(token_data.get('tokenAddress', '')).lower()))
+        for lp_dict in token_data.get('liquidityPool', []):
+            if lp_dict.get('liquidityPoolAddress'):
+                contracts.add((blockchain, lp_dict.get('liquidityPoolAddress').lower()))
+    return hashlib.sha256(json.dumps(sorted(contracts)).encode()).hexdigest()
+
+
+class MetadataCache:
+    def __init__(self, path: str = None):
+        """
+        On-disk cache of contract metadata that never changes: pool token0/token1, ERC20 decimals, and the staked
+        token of every pid and the rewards token of MasterChef style vaults (pids are only ever appended, see vault_index.py).
+
+        Args:
+        path (str): Location of the lock file. Nothing is read or written if None.
+        """
+        self.path = path
+        self.config_hash = None
+        self.chains: Dict[str, Dict[str, Dict[str, Any]]] = dict()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+            self.config_hash = data.get('configHash')
+            self.chains = data.get('chains', {})
+        except Exception as e:
+            print(f'Ignoring unreadable metadata cache {self.path}: {e}')
+
+    def save(self) -> None:
+        with self._lock:
+            data = {'configHash': self.config_hash, 'chains': self.chains}
+            with open(self.path, 'w') as file:
+                json.dump(data, file, indent=4, sort_keys=True)
+
+    def check_config(self, token_data_list: List[Dict[str, Any]]) -> bool:
+        """
+        Returns True if the lock file was generated from the given config. Entries are keyed by address and
+        stay valid either way, but pools added since the warm-up are fetched on every run.
+        """
+        if self.config_hash is None:
+            return False
+        if self.config_hash != config_hash(token_data_list):
+            print(f'Metadata cache {self.path} does not match the config; run `python metadata_cache.py` to refresh it')
+            return False
+        return True
+
+    def _chain(self, blockchain: str) -> Dict[str, Dict[str, Any]]:
+        chain = self.chains.setdefault(blockchain, {'pools': {}, 'decimals': {}})
+        # lock files written before the vault index have no vaults
+        chain.setdefault('vaults', {})
+        return chain
+
+    def get_pool_tokens(self, blockchain: str, pool_address: str) -> Optional[Tuple[str, str]]:
+        pool = self.chains.get(blockchain, {}).get('pools', {}).get(pool_address)
+        return (pool['token0'], pool['token1']) if pool else None
+
+    def set_pool_tokens(self, blockchain: str, pool_address: str, token_zero: str, token_one: str) -> None:
+        with self._lock:
+            self._chain(blockchain)['pools'][pool_address] = {'token0': token_zero, 'token1': token_one}
+
+    def get_decimals(self, blockchain: str, token_address: str) -> Optional[int]:
+        return self.chains.get(blockchain, {}).get('decimals', {}).get(token_address)
+
+    def set_decimals(self, blockchain: str, token_address: str, decimals: int) -> None:
+        with self._lock:
+            self._chain(blockchain)['decimals'][token_address] = decimals
+
+    def get_vault(self, blockchain: str, vault_address: str) -> Optional[Dict[str, Any]]:
+        """
+        {'poolLength': pids scanned, 'pids': {staked token: pid}, 'rewardsToken': address or None} of a vault,
+        or None if never scanned.
+        """
+        return self.chains.get(blockchain, {}).get('vaults', {}).get(vault_address)
+
+    def get_vault_pid(self, blockchain: str, vault_address: str, staked_token: str) -> Optional[int]:
+        vault = self.get_vault(blockchain, vault_address)
+        return vault['pids'].get(staked_token) if vault else None
+
+    def set_vault(self, blockchain: str, vault_address: str, pool_length: int, pids: Dict[str, int], rewards_token: str = None) -> None:
+        """
+        Adds the pids scanned up to pool_length to the vault's index.
+        """
+        with self._lock:
+            vault = self._chain(blockchain)['vaults'].setdefault(vault_address, {'poolLength': 0, 'pids': {}})
+            vault['poolLength'] = max(vault['poolLength'], pool_length)
+            # None once read and unreadable, so it is not read again
+            if rewards_token or 'rewardsToken' not in vault:
+                vault['rewardsToken'] = rewards_token
+            for staked_token, pid in pids.items():
+                # a token staked under several pids keeps the first
+                vault['pids'].setdefault(staked_token, pid)
+
+
+_cache: Optional[MetadataCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_metadata_cache() -> MetadataCache:
+    """
+    Returns the process-wide metadata cache, loaded from METADATA_CACHE (default tokenInfo.lock.json) on first use.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = MetadataCache(os.getenv('METADATA_CACHE', default_lock_file()))
+        return _cache
+
+
+def warm_up(token_data_list: List[Dict[str, Any]], path: str) -> MetadataCache:
+    """
+    Fetches token0/token1 of every configured pool and the decimals of every token involved,
+    in two batched rounds per chain, indexes the pids of the vaults (see vault_index.py) and writes them to the lock file.
+    """
+    from chain_clients import get_chain_client
+    from abi_registry import get_contract
+    from web3 import Web3
+
+    cache = MetadataCache(path)
+    pools_by_chain: Dict[str, set] = dict()
+    tokens_by_chain: Dict[str, set] = dict()
+    for token_data in token_data_list:
+        blockchain = token_data.get('blockchain')
+        tokens_by_chain.setdefault(blockchain, set()).add(Web3.to_checksum_address(token_data.get('tokenAddress')))
+        for lp_dict in token_data.get('liquidityPool', []):
+            if lp_dict.get('liquidityPoolAddress'):
+                pools_by_chain.setdefault(blockchain, set()).add(Web3.to_checksum_address(lp_dict.get('liquidityPoolAddress')))
+
+    for blockchain in tokens_by_chain:
+        client = get_chain_client(blockchain)
+        pools = sorted(pools_by_chain.get(blockchain, []))
+
+        batch = client.make_batch()
+        pool_calls = []
+        for pool in pools:
+            contract = get_contract(client.web3, blockchain, pool, 'pair')
+            pool_calls.append((pool, batch.add(contract, 'token0'), batch.add(contract, 'token1')))
+        batch.execute()
+
+        tokens = set(tokens_by_chain[blockchain])
+        for pool, token_zero, token_one in pool_calls:
+            try:
+                cache.set_pool_tokens(blockchain, pool, token_zero.value, token_one.value)
+                tokens.update([token_zero.value, token_one.value])
+            except Exception as e:
+                print(f'Error fetching tokens of pool {pool} on {blockchain}: {e}')
+
+        batch = client.make_batch()
+        decimal_calls = [(token, batch.add(get_contract(client.web3, blockchain, token, 'ERC20'), 'decimals')) for token in sorted(tokens)]
+        batch.execute()
+        for token, decimals in decimal_calls:
+            try:
+                cache.set_decimals(blockchain, token, decimals.value)
+            except Exception as e:
+                print(f'Error fetching decimals of {token} on {blockchain}: {e}')
+
+        print(f'{blockchain}: {len(pool_calls)} pools, {len(decimal_calls)} tokens')
+
+    from vault_index import discover_vault_pids
+    discover_vault_pids(token_data_list, cache)
+
+    cache.config_hash = config_hash(token_data_list)
+    cache.save()
+    return cache
+
+
+def main():
+    """
+    Warm-up command: generates the metadata lock file beside the config.
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Generate the immutable metadata lock file for a token config.')
+    parser.add_argument('--config', default=DEFAULT_CONFIG_FILE, help='token config (default: tokenInfo.json)')
+    parser.add_argument('--output', default=None, help='lock file (default: <config>.lock.json)')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as file:
+        token_data = json.load(file)
+    output = args.output or default_lock_file(args.config)
+    warm_up(token_data, output)
+    print(f'wrote {output}')
+
+
+if __name__ == '__main__':
+    main()
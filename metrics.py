@@ -0,0 +1,227 @@
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import os
+import threading
+
+# upper bounds of the latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRIC_PREFIX = 'portfolio'
+
+
+class Series:
+    def __init__(self, buckets: Tuple[float, ...]):
+        """
+        Counters and latency histogram of one label set.
+        """
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.duplicates = 0
+        self.cached = 0
+
+    def observe(self, latency: float) -> None:
+        self.latency_sum += latency
+        for i, bound in enumerate(self.buckets):
+            if latency <= bound:
+                self.bucket_counts[i] += 1
+                return
+        self.bucket_counts[-1] += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimates a latency quantile from the histogram, interpolating inside the bucket.
+        """
+        observed = sum(self.bucket_counts)
+        if not observed:
+            return None
+        rank = q * observed
+        seen = 0
+        lower = 0.0
+        for count, upper in zip(self.bucket_counts, self.buckets + (float('inf'),)):
+            if seen + count >= rank and count:
+                if upper == float('inf'):
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return lower
+
+    def summary(self) -> Dict[str, Any]:
+        observed = sum(self.bucket_counts)
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'error_rate': self.errors / self.count if self.count else 0,
+            'duplicates': self.duplicates,
+            'cached': self.cached,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'latency_mean': self.latency_sum / observed if observed else None,
+            'latency_p50': self.quantile(0.5),
+            'latency_p95': self.quantile(0.95),
+            'latency_p99': self.quantile(0.99),
+        }
+
+
+class RpcMetrics:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        In-process RPC metrics at two levels:
+            - requests: every HTTP request to a node, by (chain, rpc method); a JSON-RPC batch is method 'batch'
+            - calls: every contract read, by (chain, contract, function, symbol of the TokenYield that queued it).
+              A call's latency is the one of the request that carried it (multicall chunk or batch).
+              Reads answered by another token's identical read count as duplicates, reads answered
+              from the block cache as cached; neither is sent.
+        """
+        self.buckets = tuple(buckets)
+        self.requests: Dict[Tuple[str, str], Series] = dict()
+        self.calls: Dict[Tuple[str, str, str, str], Series] = dict()
+        self._lock = threading.Lock()
+
+    def _series(self, table: Dict, key: tuple) -> Series:
+        series = table.get(key)
+        if series is None:
+            series = table[key] = Series(self.buckets)
+        return series
+
+    def record_request(self, blockchain: str, method: str, latency: float, bytes_sent: int, bytes_received: int, error: bool = False) -> None:
+        with self._lock:
+            series = self._series(self.requests, (blockchain or '', method))
+            series.count += 1
+            series.errors += int(bool(error))
+            series.bytes_sent += bytes_sent
+            series.bytes_received += bytes_received
+            series.observe(latency)
+
+    def record_calls(self, blockchain: str, calls: List[Any], latency: float) -> None:
+        """
+        Records the calls sent in one request, after their results are set.
+        """
+        with self._lock:
+            for call in calls:
+                series = self._series(self.calls, (blockchain or '', call.target, call.fn_name, call.tag or ''))
+                series.count += 1
+                series.errors += int(not call.success)
+                series.bytes_sent += len(call.call_data)
+                if call.raw_result is not None:
+                    series.bytes_received += len(call.raw_result[1] or b'')
+                series.observe(latency)
+
+    def record_duplicate(self, blockchain: str, call: Any) -> None:
+        with self._lock:
+            self._series(self.calls, (blockchain or '', call.target, call.fn_name, call.tag or '')).duplicates += 1
+
+    def record_cached(self, blockchain: str, calls: List[Any]) -> None:
+        with self._lock:
+            for call in calls:
+                self._series(self.calls, (blockchain or '', call.target, call.fn_name, call.tag or '')).cached += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests = dict()
+            self.calls = dict()
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Per-run JSON summary, slowest first.
+        """
+        with self._lock:
+            requests = [{'chain': k[0], 'method': k[1], **v.summary()} for k, v in self.requests.items()]
+            calls = [{'chain': k[0], 'contract': k[1], 'function': k[2], 'symbol': k[3], **v.summary()} for k, v in self.calls.items()]
+        requests.sort(key=lambda x: -(x['latency_mean'] or 0) * x['count'])
+        calls.sort(key=lambda x: (-x['duplicates'], -(x['latency_mean'] or 0) * x['count']))
+        totals = {
+            'requests': sum(x['count'] for x in requests),
+            'request_errors': sum(x['errors'] for x in requests),
+            'bytes_sent': sum(x['bytes_sent'] for x in requests),
+            'bytes_received': sum(x['bytes_received'] for x in requests),
+            'calls_sent': sum(x['count'] for x in calls),
+            'call_errors': sum(x['errors'] for x in calls),
+            'calls_duplicated': sum(x['duplicates'] for x in calls),
+            'calls_cached': sum(x['cached'] for x in calls),
+        }
+        return {'totals': totals, 'requests': requests, 'calls': calls}
+
+    def to_prometheus(self) -> str:
+        """
+        Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            self._family(lines, 'rpc_request', 'HTTP requests to RPC nodes', self.requests, ('chain', 'method'))
+            self._family(lines, 'contract_call', 'Contract reads', self.calls, ('chain', 'contract', 'function', 'symbol'), unsent=True)
+        return '\n'.join(lines) + '\n'
+
+    def _family(self, lines: List[str], name: str, help_text: str, table: Dict[tuple, Series], label_names: Tuple[str, ...], unsent: bool = False) -> None:
+        name = f'{METRIC_PREFIX}_{name}'
+        counters = [('total', 'count', help_text), ('errors_total', 'errors', f'{help_text} that failed'),
+                    ('bytes_sent_total', 'bytes_sent', f'{help_text}, payload bytes sent'),
+                    ('bytes_received_total', 'bytes_received', f'{help_text}, payload bytes received')]
+        if unsent:
+            counters += [('duplicates_total', 'duplicates', f'{help_text} answered by an identical read'),
+                         ('cached_total', 'cached', f'{help_text} answered by the block cache')]
+
+        for suffix, attribute, text in counters:
+            lines.append(f'# HELP {name}_{suffix} {text}')
+            lines.append(f'# TYPE {name}_{suffix} counter')
+            for key, series in table.items():
+                lines.append(f'{name}_{suffix}{{{format_labels(label_names, key)}}} {getattr(series, attribute)}')
+
+        lines.append(f'# HELP {name}_duration_seconds {help_text}, latency of the carrying request')
+        lines.append(f'# TYPE {name}_duration_seconds histogram')
+        for key, series in table.items():
+            labels = format_labels(label_names, key)
+            cumulative = 0
+            for bound, count in zip(series.buckets + (float('inf'),), series.bucket_counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{name}_duration_seconds_sum{{{labels}}} {series.latency_sum}')
+            lines.append(f'{name}_duration_seconds_count{{{labels}}} {cumulative}')
+
+
+def format_labels(names: Tuple[str, ...], values: tuple) -> str:
+    def escape(value: Any) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+
+_metrics: Optional[RpcMetrics] = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> RpcMetrics:
+    """
+    Returns the process-wide metrics, shared by every provider and batch.
+    """
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = RpcMetrics()
+        return _metrics
+
+
+def write_metrics(json_file: str = None, prometheus_file: str = None) -> None:
+    """
+    Writes the JSON summary (RPC_METRICS_JSON) and the Prometheus text file (RPC_METRICS_PROMETHEUS, e.g. for
+    the node_exporter textfile collector), when configured.
+    """
+    json_file = json_file or os.getenv('RPC_METRICS_JSON')
+    prometheus_file = prometheus_file or os.getenv('RPC_METRICS_PROMETHEUS')
+    if json_file:
+        from response_cache import get_response_cache
+
+        summary = get_metrics().summary()
+        if get_response_cache() is not None:
+            summary['response_cache'] = get_response_cache().summary()
+        with open(json_file, 'w') as file:
+            json.dump(summary, file, indent=4)
+    if prometheus_file:
+        # write aside and rename, so a scraper never reads a partial file
+        with open(f'{prometheus_file}.tmp', 'w') as file:
+            file.write(get_metrics().to_prometheus())
+        os.replace(f'{prometheus_file}.tmp', prometheus_file)
@@ -0,0 +1,227 @@
+from typing import Any, Dict, List, Optional, Tuple
+import concurrent.futures
+from batching import CallBatch, DEFAULT_CHUNK_SIZE
+from chain_clients import get_chain_client
+from abi_registry import get_contract
+from metadata_cache import get_metadata_cache
+from scheduler import PRIORITY_PRICING
+from snapshot import Snapshot
+
+QUOTE_SYMBOL = 'USDT'
+# pools used for pricing, in order of preference
+PRICING_PAIRS = ['USDT', 'ETH', 'BNB']
+
+
+class PriceGraph:
+    def __init__(self, tokens: List[Any], chunk_size: int = DEFAULT_CHUNK_SIZE, snapshot: Snapshot = None):
+        """
+        Graph of the configured pricing pools, keyed by (blockchain, symbol), so SDAO on Ethereum and
+        SDAO on Binance are priced from their own pools.
+
+        Args:
+        tokens (List[TokenYield]): The tokens of the portfolio. The first token of each (blockchain, symbol) is used.
+        chunk_size (int): Maximum number of calls per batched request.
+        snapshot (Snapshot): Blocks to read the reserves at. Reads at 'latest' if None.
+        """
+        self.chunk_size = chunk_size
+        self.snapshot = snapshot
+        self.metadata = get_metadata_cache()
+        self.nodes: Dict[Tuple[str, str], Any] = dict()
+        self.edges: Dict[Tuple[str, str], Tuple[str, str]] = dict()
+        # the reads of fetch_reserves that failed
+        self.errors: List[str] = []
+
+        for token_yield in tokens:
+            key = (token_yield.blockchain, token_yield.symbol)
+            if key in self.nodes:
+                continue
+            self.nodes[key] = token_yield
+
+            pools = {x.get('pairedTokenSymbol'): x.get('liquidityPoolAddress') for x in token_yield.liquidity_pool_info_list
+                     if x.get('pairedTokenSymbol') in PRICING_PAIRS and x.get('liquidityPoolAddress')}
+            for paired_symbol in PRICING_PAIRS:
+                if paired_symbol in pools:
+                    self.edges[key] = (paired_symbol, token_yield.checksum_address(pools[paired_symbol]))
+                    break
+
+    def report(self, message: str) -> None:
+        print(message)
+        self.errors.append(message)
+
+    def get_pools_by_chain(self) -> Dict[str, List[str]]:
+        pools_by_chain: Dict[str, set] = dict()
+        for (blockchain, _), (_, pool) in self.edges.items():
+            pools_by_chain.setdefault(blockchain, set()).add(pool)
+        return {blockchain: sorted(pools) for blockchain, pools in pools_by_chain.items()}
+
+    def fetch_reserves(self) -> Dict[Tuple[str, str], Any]:
+        """
+        Reads getReserves of every pricing pool, one batch per chain with the chains in parallel,
+        and makes sure token0/token1/decimals of the pools are in the metadata cache.
+
+        Returns:
+        Dict[Tuple[str, str], Any]: Reserves by (blockchain, pool address).
+        """
+        reserves = dict()
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            futures = {executor.submit(self._fetch_chain, blockchain, pools): blockchain for blockchain, pools in self.get_pools_by_chain().items()}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    reserves.update(future.result())
+                except Exception as exc:
+                    self.report(f'Error fetching prices for {futures[future]} error: {exc}')
+        return reserves
+
+    def _fetch_chain(self, blockchain: str, pools: List[str]) -> Dict[Tuple[str, str], Any]:
+        client = get_chain_client(blockchain)
+        block = self.snapshot.block(blockchain) if self.snapshot else None
+
+        batch = client.make_batch(self.chunk_size)
+        with batch.tagged('pricing', PRIORITY_PRICING):
+            reserve_calls, token_calls = self.queue_reserves(blockchain, pools, batch)
+        batch.execute(block)
+        self.apply_pool_tokens(blockchain, token_calls)
+
+        batch = client.make_batch(self.chunk_size)
+        with batch.tagged('pricing', PRIORITY_PRICING):
+            decimal_calls = self.queue_decimals(blockchain, pools, batch)
+        batch.execute(block)
+        self.apply_decimals(blockchain, decimal_calls)
+
+        return self.collect_reserves(blockchain, reserve_calls)
+
+    def queue_reserves(self, blockchain: str, pools: List[str], batch: CallBatch) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Queues the reserves of the pools, plus token0/token1 of pools missing from the metadata cache.
+        """
+        web3 = get_chain_client(blockchain).web3
+        reserve_calls = dict()
+        token_calls = dict()
+        for pool in pools:
+            contract = get_contract(web3, blockchain, pool, 'pair')
+            reserve_calls[pool] = batch.add(contract, 'getReserves')
+            if self.metadata.get_pool_tokens(blockchain, pool) is None:
+                token_calls[pool] = (batch.add(contract, 'token0'), batch.add(contract, 'token1'))
+        return reserve_calls, token_calls
+
+    def apply_pool_tokens(self, blockchain: str, token_calls: Dict[str, Any]) -> None:
+        for pool, (token_zero, token_one) in token_calls.items():
+            try:
+                self.metadata.set_pool_tokens(blockchain, pool, token_zero.value, token_one.value)
+            except Exception as e:
+                self.report(f'Error fetching tokens of pool {pool}: {e}')
+
+    def queue_decimals(self, blockchain: str, pools: List[str], batch: CallBatch) -> Dict[str, Any]:
+        """
+        Queues the decimals of pool tokens missing from the metadata cache. Needs token0/token1 to be known.
+        """
+        web3 = get_chain_client(blockchain).web3
+        decimal_calls = dict()
+        for pool in pools:
+            for token in self.metadata.get_pool_tokens(blockchain, pool) or []:
+                if token not in decimal_calls and self.metadata.get_decimals(blockchain, token) is None:
+                    decimal_calls[token] = batch.add(get_contract(web3, blockchain, token, 'ERC20'), 'decimals')
+        return decimal_calls
+
+    def apply_decimals(self, blockchain: str, decimal_calls: Dict[str, Any]) -> None:
+        for token, decimals in decimal_calls.items():
+            try:
+                self.metadata.set_decimals(blockchain, token, decimals.value)
+            except Exception as e:
+                self.report(f'Error fetching decimals of {token}: {e}')
+
+    def collect_reserves(self, blockchain: str, reserve_calls: Dict[str, Any]) -> Dict[Tuple[str, str], Any]:
+        reserves = dict()
+        for pool, call in reserve_calls.items():
+            try:
+                reserves[(blockchain, pool)] = call.value
+            except Exception as e:
+                self.report(f'Error fetching reserves of pool {pool}: {e}')
+        return reserves
+
+    def get_prices(self, reserves: Dict[Tuple[str, str], Any] = None) -> Dict[Tuple[str, str], float]:
+        """
+        Resolves the USD (USDT) price of every node in a single topological pass.
+
+        Args:
+        reserves (Dict[Tuple[str, str], Any]): Reserves by (blockchain, pool). Fetched if not given.
+
+        Returns:
+        Dict[Tuple[str, str], float]: Price by (blockchain, symbol). Nodes without a path to USDT are left out.
+        """
+        if reserves is None:
+            reserves = self.fetch_reserves()
+
+        prices = dict()
+        visiting = set()
+
+        def resolve(key: Tuple[str, str]) -> Optional[float]:
+            if key[1] == QUOTE_SYMBOL:
+                return 1
+            if key in prices:
+                return prices[key]
+            if key in visiting or key not in self.edges:
+                return None
+
+            visiting.add(key)
+            paired_symbol, pool = self.edges[key]
+            paired_price = resolve(self._node_for(key[0], paired_symbol))
+            visiting.discard(key)
+
+            rate = self._rate(key, pool, reserves)
+            if paired_price is None or rate is None:
+                return None
+            prices[key] = rate * paired_price
+            return prices[key]
+
+        for key in self.nodes:
+            resolve(key)
+        return prices
+
+    def _node_for(self, blockchain: str, symbol: str) -> Tuple[str, str]:
+        # prefer the paired token on the same chain, else the same symbol on any chain
+        if (blockchain, symbol) in self.nodes:
+            return blockchain, symbol
+        return next((key for key in self.nodes if key[1] == symbol), (blockchain, symbol))
+
+    def _rate(self, key: Tuple[str, str], pool: str, reserves: Dict[Tuple[str, str], Any]) -> Optional[float]:
+        """
+        Price of the node's token in units of the paired token.
+        """
+        blockchain = key[0]
+        pool_reserves = reserves.get((blockchain, pool))
+        pool_tokens = self.metadata.get_pool_tokens(blockchain, pool)
+        if pool_reserves is None or pool_tokens is None:
+            return None
+
+        token_zero, token_one = pool_tokens
+        decimals_zero = self.metadata.get_decimals(blockchain, token_zero)
+        decimals_one = self.metadata.get_decimals(blockchain, token_one)
+        if decimals_zero is None or decimals_one is None or not pool_reserves[0] or not pool_reserves[1]:
+            return None
+
+        rate = pool_reserves[0] * (10 ** decimals_one) / (10 ** decimals_zero) / pool_reserves[1]
+        if token_zero == self.nodes[key].token_address:
+            return 1 / rate
+        return rate
+
+    def get_price(self, prices: Dict[Tuple[str, str], float], blockchain: str, symbol: str) -> Optional[float]:
+        """
+        Price of a symbol held on blockchain: its own chain's price, else the first configured chain quoting it.
+        """
+        if symbol == QUOTE_SYMBOL:
+            return 1
+        if (blockchain, symbol) in prices:
+            return prices[(blockchain, symbol)]
+        return next((prices[key] for key in self.nodes if key[1] == symbol and key in prices), None)
+
+    def get_symbol_prices(self, prices: Dict[Tuple[str, str], float]) -> Dict[str, float]:
+        """
+        Collapses (blockchain, symbol) prices to one price per symbol, for display. The first configured token of a symbol wins;
+        holdings are valued with get_price instead.
+        """
+        symbol_prices = {QUOTE_SYMBOL: 1}
+        for key in self.nodes:
+            if key in prices and key[1] not in symbol_prices:
+                symbol_prices[key[1]] = prices[key]
+        return symbol_prices
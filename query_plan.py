@@ -0,0 +1,225 @@
+from typing import Any, Dict, List, Tuple
+import copy
+from contextlib import contextmanager
+from metrics import get_metrics
+from scheduler import PRIORITY_POSITIONS
+
+# address fields of a tokenInfo.json entry, checksummed once by normalize_config
+TOKEN_ADDRESS_FIELDS = ('tokenAddress',)
+STAKING_FIELDS = ('bondedStaking', 'unbondedStaking')
+POOL_ADDRESS_FIELDS = ('liquidityPoolAddress', 'liquidityTokenStakingAddress')
+
+
+class PlannedRead:
+    def __init__(self, blockchain: str, contract: Any, fn_name: str, args: tuple, allow_failure: bool, tag: str, priority: int):
+        """
+        One distinct (chain, contract, method, args) read of a query plan, and the token fields it fans out to.
+        """
+        self.blockchain = blockchain
+        self.contract = contract
+        self.fn_name = fn_name
+        self.args = args
+        self.allow_failure = allow_failure
+        self.tag = tag
+        self.priority = priority
+        self.fields: List[str] = []
+
+    @property
+    def key(self) -> tuple:
+        return self.contract.address, self.fn_name, self.args, self.allow_failure
+
+    def describe(self) -> str:
+        args = ', '.join(short(x) if isinstance(x, str) else str(x) for x in self.args)
+        return f'{self.fn_name}({args}) on {short(self.contract.address)}'
+
+
+class PlanRecorder:
+    def __init__(self, blockchain: str):
+        """
+        Stands in for a CallBatch while the plan is compiled: TokenYield.queue_token_data adds its reads here,
+        and identical reads get the same PlannedRead.
+        """
+        self.blockchain = blockchain
+        self.reads: Dict[tuple, PlannedRead] = dict()
+        self.added = 0
+        self.tag = None
+        self.priority = PRIORITY_POSITIONS
+
+    @contextmanager
+    def tagged(self, tag: str, priority: int = None):
+        previous = (self.tag, self.priority)
+        self.tag = tag
+        if priority is not None:
+            self.priority = priority
+        try:
+            yield self
+        finally:
+            self.tag, self.priority = previous
+
+    def add(self, contract, fn_name: str, *args, allow_failure: bool = True) -> PlannedRead:
+        read = PlannedRead(self.blockchain, contract, fn_name, args, allow_failure, self.tag, self.priority)
+        self.added += 1
+        existing = self.reads.setdefault(read.key, read)
+        existing.priority = min(existing.priority, read.priority)
+        return existing
+
+
+class QueryPlan:
+    def __init__(self, token_data_list: List[Dict[str, Any]], wallets: List[str], parts: tuple):
+        """
+        The per-wallet reads of a config, compiled once (see compile_config) and queued every cycle:
+            - reads: the distinct reads per chain; a contract repeated across entries or wallets is read once
+            - templates: per (entry, wallet), the TokenYield.calls structure with the reads in place of calls
+            - pricing_pools: the pools the price graph reads, per chain
+            - token_symbols: (symbol, decimals) of every configured token, per chain, e.g. to name vault rewards
+        The pool state (reserves, totalSupply, token0) still depends on the positions read, see TokenYield.queue_pool_state.
+
+        Args:
+        token_data_list (List[Dict[str, Any]]): Token entries, with checksummed addresses (see normalize_config).
+        wallets (List[str]): Checksummed wallets.
+        parts (tuple): Parts read, see mainV4.TOKEN_PARTS.
+        """
+        self.token_data_list = token_data_list
+        self.wallets = wallets
+        self.parts = parts
+        self.recorders: Dict[str, PlanRecorder] = dict()
+        self.templates: List[Tuple[int, str, Dict[str, Any]]] = []
+        self.pricing_pools: Dict[str, List[str]] = dict()
+        self.token_symbols: Dict[str, Dict[str, Tuple[str, int]]] = dict()
+        for token_data in token_data_list:
+            self.token_symbols.setdefault(token_data.get('blockchain'), {})[token_data.get('tokenAddress')] = \
+                (token_data.get('symbol'), int(token_data.get('decimals') or 18))
+
+    def reads(self, blockchain: str) -> List[PlannedRead]:
+        return list(self.recorders[blockchain].reads.values()) if blockchain in self.recorders else []
+
+    def queue(self, batches: Dict[str, Any], make_token) -> List[Any]:
+        """
+        Queues every distinct read once into the batch of its chain and returns a TokenYield per (entry, wallet),
+        made by make_token(token_data, wallet), with its calls bound to the queued reads.
+        """
+        calls = dict()
+        for blockchain, batch in batches.items():
+            for read in self.reads(blockchain):
+                with batch.tagged(read.tag, read.priority):
+                    calls[read.key] = batch.add(read.contract, read.fn_name, *read.args, allow_failure=read.allow_failure)
+                # the other fields served by the same read, counted like CallBatch.add counts duplicates
+                for _ in read.fields[1:]:
+                    get_metrics().record_duplicate(blockchain, calls[read.key])
+
+        tokens = []
+        for index, wallet, template in self.templates:
+            token_data = self.token_data_list[index]
+            if token_data.get('blockchain') not in batches:
+                continue
+            try:
+                token = make_token(copy.deepcopy(token_data), wallet)
+                token.bind_calls(bind(template, calls), self.token_symbols.get(token_data.get('blockchain')))
+                tokens.append(token)
+            except Exception as exc:
+                print(f'Error creating TokenYield instance error: {exc}')
+        return tokens
+
+    def explain(self) -> str:
+        """
+        Human readable plan: the distinct reads per chain, what they fan out to, and the pool reads that follow.
+        """
+        lines = [f'{len(self.token_data_list)} entries x {len(self.wallets)} wallets, parts: {", ".join(self.parts)}']
+        for blockchain, recorder in sorted(self.recorders.items()):
+            reads = self.reads(blockchain)
+            lines.append(f'\n{blockchain}: {recorder.added} reads in the config, {len(reads)} distinct')
+            for read in sorted(reads, key=lambda x: (x.priority, x.contract.address, x.fn_name, str(x.args))):
+                lines.append(f'  {read.describe()}  -> {", ".join(read.fields)}')
+
+            pools = set()
+            for index, _, template in self.templates:
+                if self.token_data_list[index].get('blockchain') == blockchain:
+                    pools.update(lp_dict.get('liquidityPoolAddress') for lp_dict, calls in
+                                 zip(self.token_data_list[index].get('liquidityPool', []), template.get('liquidityPool', [])) if calls)
+            pricing_pools = self.pricing_pools.get(blockchain, [])
+            lines.append(f'  then getReserves, totalSupply and token0 of the {len(pools)} LP pools a wallet has a position in, '
+                         f'and getReserves of {len(pricing_pools)} pricing pools ({len(set(pricing_pools) & pools)} also LP pools)')
+        return '\n'.join(lines)
+
+
+def compile_config(token_data_list: List[Dict[str, Any]], wallets: List[str], parts: tuple) -> QueryPlan:
+    """
+    Compiles the config into a QueryPlan, recording the reads TokenYield.queue_token_data queues for every
+    entry and wallet. The only network I/O is the vault scan of discover_vault_pids, when a staked token is
+    missing from the vault index.
+    """
+    # mainV4 imports this module
+    from mainV4 import TokenYield
+    from metadata_cache import get_metadata_cache
+    from pricing import PriceGraph
+    from vault_index import discover_vault_pids
+
+    plan = QueryPlan(normalize_config(token_data_list), wallets, parts)
+    # the pids recorded below come from the index
+    discover_vault_pids(plan.token_data_list, get_metadata_cache())
+    tokens = []
+    for index, token_data in enumerate(plan.token_data_list):
+        for wallet in wallets:
+            try:
+                token = TokenYield(copy.deepcopy(token_data), wallet=wallet, parts=parts)
+                recorder = plan.recorders.setdefault(token.blockchain, PlanRecorder(token.blockchain))
+                token.queue_token_data(recorder)
+            except Exception as exc:
+                print(f'Error creating TokenYield instance error: {exc}')
+                continue
+            for path, read in fields(token.calls):
+                read.fields.append(f'{token.symbol} {short(wallet)} {path}')
+            plan.templates.append((index, wallet, token.calls))
+            tokens.append(token)
+    plan.pricing_pools = PriceGraph(tokens).get_pools_by_chain()
+    return plan
+
+
+def normalize_config(token_data_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Copy of the config with every contract address checksummed, once.
+    """
+    from mainV4 import TokenYield
+
+    normalized = copy.deepcopy(token_data_list)
+    for token_data in normalized:
+        for field in TOKEN_ADDRESS_FIELDS:
+            token_data[field] = TokenYield.checksum_address(token_data.get(field))
+        for staking in STAKING_FIELDS:
+            if isinstance(token_data.get(staking), dict):
+                token_data[staking]['contractAddress'] = TokenYield.checksum_address(token_data[staking].get('contractAddress'))
+        for lp_dict in token_data.get('liquidityPool', []):
+            for field in POOL_ADDRESS_FIELDS:
+                if lp_dict.get(field):
+                    lp_dict[field] = TokenYield.checksum_address(lp_dict[field])
+    return normalized
+
+
+def bind(template: Any, calls: Dict[tuple, Any]) -> Any:
+    """
+    The template with each PlannedRead replaced by the queued call of its key.
+    """
+    if isinstance(template, PlannedRead):
+        return calls[template.key]
+    if isinstance(template, dict):
+        return {k: bind(v, calls) for k, v in template.items()}
+    if isinstance(template, list):
+        return [bind(x, calls) for x in template]
+    return template
+
+
+def fields(template: Any, path: str = '') -> List[Tuple[str, PlannedRead]]:
+    """
+    (path, read) of every read in a template, e.g. ('liquidityPool[0].yieldLp', read).
+    """
+    if isinstance(template, PlannedRead):
+        return [(path, template)]
+    if isinstance(template, dict):
+        return [x for k, v in template.items() for x in fields(v, f'{path}.{k}' if path else k)]
+    if isinstance(template, list):
+        return [x for i, v in enumerate(template) for x in fields(v, f'{path}[{i}]')]
+    return []
+
+
+def short(address: str) -> str:
+    return f'{address[:6]}…{address[-4:]}' if isinstance(address, str) and len(address) == 42 else str(address)
@@ -0,0 +1,210 @@
+from typing import Any, Dict, List, Optional, Tuple
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# seconds an eth_call result at 'latest' stays valid, by contract function; None never expires.
+# Metadata never changes, so it is also served to reads pinned at any block.
+DEFAULT_TTL_POLICIES = {
+    'getReserves': 3,
+    'balanceOf': 3,
+    'totalSupply': 30,
+    'userInfo': 12,
+    'balances': 12,
+    'pendingRewards': 12,
+    'poolInfo': 60,
+    'poolLength': 300,
+    'token0': None,
+    'token1': None,
+    'decimals': None,
+    'symbol': None,
+    'name': None,
+    'lpToken': None,
+}
+DEFAULT_TTL = 3
+DEFAULT_MAX_MB = 64
+ENTRY_OVERHEAD = 200  # rough bytes of a cache entry besides its call data and result
+SINGLE_FLIGHT_TIMEOUT = 60.0
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_MB * 2 ** 20, ttl_policies: Dict[str, Optional[float]] = None,
+                 default_ttl: float = DEFAULT_TTL):
+        """
+        In-process cache of eth_call results shared by every batch of the process, with:
+            - a TTL per contract function for reads at 'latest' (see DEFAULT_TTL_POLICIES)
+            - LRU eviction once the entries take more than max_bytes
+            - single-flight: a read already in flight in another batch is waited for instead of sent again
+
+        Reads pinned at a block are keyed by block, except metadata which is the same at every block. They mostly hit
+        snapshot.BlockCache first; here they share in-flight reads and metadata across blocks.
+
+        Args:
+        max_bytes (int): Memory cap of the entries.
+        ttl_policies (Dict[str, Optional[float]]): TTL in seconds by function name, None to never expire.
+        default_ttl (float): TTL of functions without a policy.
+        """
+        self.max_bytes = max_bytes
+        self.ttl_policies = dict(DEFAULT_TTL_POLICIES if ttl_policies is None else ttl_policies)
+        self.default_ttl = default_ttl
+        self.entries: 'OrderedDict[tuple, Tuple[Optional[float], Tuple[bool, bytes]]]' = OrderedDict()
+        self.size = 0
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'coalesced': 0}
+        self.method_stats: Dict[str, Dict[str, int]] = dict()
+        self._in_flight: Dict[tuple, threading.Event] = dict()
+        self._lock = threading.Lock()
+
+    def ttl(self, fn_name: str) -> Optional[float]:
+        return self.ttl_policies.get(fn_name, self.default_ttl)
+
+    def key(self, blockchain: str, block_identifier: Any, call: Any) -> Optional[tuple]:
+        """
+        Cache key of a call; None if the call can't be cached (e.g. at 'pending').
+        """
+        if isinstance(block_identifier, int):
+            # metadata is the same at every block
+            block = None if self.ttl(call.fn_name) is None else block_identifier
+        elif block_identifier in (None, 'latest'):
+            block = None
+        else:
+            return None
+        return blockchain, block, call.target, call.call_data
+
+    def claim(self, blockchain: str, block_identifier: Any, calls: List[Any]) -> Tuple[List[Any], List[Tuple[Any, threading.Event]]]:
+        """
+        Resolves the cached calls and registers the others as in flight.
+
+        Returns:
+        Tuple: (calls the caller has to send and then pass to `complete`, (call, event) pairs sent by another batch, see `wait`)
+        """
+        to_send, waiting = [], []
+        now = time.monotonic()
+        with self._lock:
+            for call in calls:
+                key = self.key(blockchain, block_identifier, call)
+                if key is None:
+                    to_send.append(call)
+                    continue
+                result = self._get(key, call.fn_name, now)
+                if result is not None:
+                    call.set_result(*result)
+                elif key in self._in_flight:
+                    self.stats['coalesced'] += 1
+                    waiting.append((call, self._in_flight[key]))
+                else:
+                    self._in_flight[key] = threading.Event()
+                    to_send.append(call)
+        return to_send, waiting
+
+    def _get(self, key: tuple, fn_name: str, now: float) -> Optional[Tuple[bool, bytes]]:
+        counts = self.method_stats.setdefault(fn_name, {'hits': 0, 'misses': 0})
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] is not None and entry[0] <= now:
+            self._remove(key)
+            self.stats['expired'] += 1
+            entry = None
+        if entry is None:
+            self.stats['misses'] += 1
+            counts['misses'] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats['hits'] += 1
+        counts['hits'] += 1
+        return entry[1]
+
+    def complete(self, blockchain: str, block_identifier: Any, calls: List[Any]) -> None:
+        """
+        Stores the answers of the sent calls and wakes the batches waiting on them. Must be called
+        even if sending failed, calls without an answer are released without being stored.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for call in calls:
+                key = self.key(blockchain, block_identifier, call)
+                if key is None:
+                    continue
+                # transport errors are not cached, only what the chain answered
+                if call.raw_result is not None:
+                    ttl = self.ttl(call.fn_name)
+                    self._set(key, (None if ttl is None else now + ttl, call.raw_result))
+                event = self._in_flight.pop(key, None)
+                if event is not None:
+                    event.set()
+
+    def wait(self, blockchain: str, block_identifier: Any, waiting: List[Tuple[Any, threading.Event]]) -> List[Any]:
+        """
+        Waits for the reads sent by other batches and resolves them from their answers.
+
+        Returns:
+        List: The calls still unresolved because the other batch failed, to send again.
+        """
+        unresolved = []
+        for call, event in waiting:
+            event.wait(SINGLE_FLIGHT_TIMEOUT)
+            with self._lock:
+                entry = self.entries.get(self.key(blockchain, block_identifier, call))
+            if entry is None:
+                unresolved.append(call)
+            else:
+                call.set_result(*entry[1])
+        return unresolved
+
+    def _set(self, key: tuple, entry: Tuple[Optional[float], Tuple[bool, bytes]]) -> None:
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = entry
+        self.size += entry_size(key, entry)
+        while self.size > self.max_bytes and self.entries:
+            self._remove(next(iter(self.entries)))
+            self.stats['evicted'] += 1
+
+    def _remove(self, key: tuple) -> None:
+        entry = self.entries.pop(key)
+        self.size -= entry_size(key, entry)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {**self.stats, 'hit_rate': self.stats['hits'] / lookups if lookups else 0, 'entries': len(self.entries),
+                    'bytes': self.size, 'methods': {k: dict(v) for k, v in self.method_stats.items()}}
+
+
+def entry_size(key: tuple, entry: Tuple[Optional[float], Tuple[bool, bytes]]) -> int:
+    return ENTRY_OVERHEAD + len(key[3]) + len(entry[1][1] or b'')
+
+
+def parse_ttl_policies(value: str) -> Dict[str, Optional[float]]:
+    """
+    Parses RESPONSE_CACHE_TTL overrides like 'getReserves=1,totalSupply=60,decimals=forever'.
+    """
+    policies = dict()
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        name, ttl = (x.strip() for x in item.split('=', 1))
+        policies[name] = None if ttl.lower() in ('forever', 'none', '') else float(ttl)
+    return policies
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Returns the process-wide response cache, or None if disabled with RESPONSE_CACHE=0.
+    """
+    global _cache
+    if os.getenv('RESPONSE_CACHE', '1') == '0':
+        return None
+    with _cache_lock:
+        if _cache is None:
+            policies = {**DEFAULT_TTL_POLICIES, **parse_ttl_policies(os.getenv('RESPONSE_CACHE_TTL'))}
+            _cache = ResponseCache(int(float(os.getenv('RESPONSE_CACHE_MB', DEFAULT_MAX_MB)) * 2 ** 20), policies)
+        return _cache
@@ -0,0 +1,290 @@
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+import asyncio
+import concurrent.futures
+import threading
+import time
+from collections import deque
+import aiohttp
+import requests
+from scheduler import EndpointScheduler, current_priority, DEFAULT_MAX_CONCURRENCY
+
+LATENCY_WINDOW = 200  # latencies kept per endpoint for the hedge percentile
+MIN_SAMPLES = 20  # below this many latencies, INITIAL_HEDGE_DELAY is used
+INITIAL_HEDGE_DELAY = 1.0
+DEFAULT_HEDGE_PERCENTILE = 0.95
+DEFAULT_MIN_HEDGE_DELAY = 0.05
+DEFAULT_EVICTION_FAILURES = 3
+DEFAULT_EVICTION_TIME = 30.0
+EWMA_WEIGHT = 0.2
+FAILURE_PENALTY = 5.0
+# http statuses that say something about the node rather than the request
+UNHEALTHY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class Endpoint:
+    def __init__(self, url: str, rate_limit: float = 0, max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        """
+        Health of one RPC url: latency average and window, error rate, and eviction. Its own scheduler paces
+        the requests to the url (rate limit and concurrency window, see scheduler.EndpointScheduler).
+        """
+        self.url = url
+        self.scheduler = EndpointScheduler(url, rate_limit, max_concurrency)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.latency = None  # exponentially weighted average, seconds
+        self.error_rate = 0.0  # exponentially weighted
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.evicted_until = 0.0
+        self.in_flight = 0
+
+    def score(self) -> float:
+        """
+        Expected latency of the next request, penalized by load and errors; lower is better.
+        Endpoints that never answered are assumed as slow as INITIAL_HEDGE_DELAY, so a dead url does not rank first.
+        """
+        latency = INITIAL_HEDGE_DELAY if self.latency is None else self.latency
+        return latency * (1 + self.in_flight) * (1 + FAILURE_PENALTY * self.error_rate)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self.latencies) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self) -> Dict[str, Any]:
+        return {'url': self.url, 'requests': self.requests, 'errors': self.errors, 'latency': self.latency,
+                'p50': self.percentile(0.5), 'p95': self.percentile(0.95), 'evicted': self.evicted_until > time.monotonic(),
+                'rate': self.scheduler.bucket.rate, 'concurrency': self.scheduler.limit, **self.scheduler.stats}
+
+
+class EndpointRouter:
+    def __init__(self, urls: Iterable[str], hedge_percentile: float = DEFAULT_HEDGE_PERCENTILE,
+                 min_hedge_delay: float = DEFAULT_MIN_HEDGE_DELAY, eviction_failures: int = DEFAULT_EVICTION_FAILURES,
+                 eviction_time: float = DEFAULT_EVICTION_TIME, max_workers: int = 16, rate_limit: float = 0,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        """
+        Routes the requests of one chain over several RPC urls.
+            - each request goes to the endpoint with the lowest score (see Endpoint.score), and waits for
+              that endpoint's rate limit and concurrency window, hedged copies included
+            - an endpoint failing eviction_failures times in a row is skipped for eviction_time seconds,
+              then gets requests again; a connection error fails over to the next endpoint at once
+            - hedged requests (read-only calls) are sent again to a second endpoint when the first has not
+              answered after its hedge_percentile latency; the first answer wins
+
+        Args:
+        urls (Iterable[str]): The RPC urls of the chain.
+        hedge_percentile (float): Latency percentile of the endpoint after which a request is hedged. 0 disables hedging.
+        min_hedge_delay (float): Shortest wait, in seconds, before hedging.
+        eviction_failures (int): Consecutive failures before an endpoint is evicted.
+        eviction_time (float): Seconds an evicted endpoint is skipped.
+        max_workers (int): Threads sending hedged requests.
+        rate_limit (float): Requests per second each endpoint allows, 0 to learn it from 429 answers.
+        max_concurrency (int): Most requests in flight to each endpoint.
+        """
+        self.endpoints = [Endpoint(url, rate_limit, max_concurrency) for url in dict.fromkeys(x.strip() for x in urls if x and x.strip())]
+        if not self.endpoints:
+            raise Exception('Error in EndpointRouter: no rpc url')
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.eviction_failures = eviction_failures
+        self.eviction_time = eviction_time
+        self.max_workers = max_workers
+        self.stats = {'hedged': 0, 'hedge_wins': 0, 'failovers': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def urls(self) -> List[str]:
+        return [x.url for x in self.endpoints]
+
+    def pick(self, exclude: Iterable[Endpoint] = ()) -> Optional[Endpoint]:
+        """
+        Returns the best endpoint not in exclude; evicted endpoints only if nothing else is left.
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [x for x in self.endpoints if x not in exclude]
+            if not candidates:
+                return None
+            healthy = [x for x in candidates if x.evicted_until <= now]
+            if healthy:
+                return min(healthy, key=lambda x: x.score())
+            return min(candidates, key=lambda x: x.evicted_until)
+
+    def record(self, endpoint: Endpoint, latency: float, error: Exception = None) -> None:
+        unhealthy = error is not None and is_unhealthy(error)
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.error_rate = (1 - EWMA_WEIGHT) * endpoint.error_rate + EWMA_WEIGHT * unhealthy
+            if error is None:
+                endpoint.latencies.append(latency)
+                endpoint.latency = latency if endpoint.latency is None else (1 - EWMA_WEIGHT) * endpoint.latency + EWMA_WEIGHT * latency
+                endpoint.consecutive_failures = 0
+                return
+            endpoint.errors += 1
+            if not unhealthy:
+                return
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.eviction_failures and len(self.endpoints) > 1:
+                endpoint.evicted_until = time.monotonic() + self.eviction_time
+                endpoint.consecutive_failures = 0
+                self.stats['evictions'] += 1
+
+    def hedge_delay(self, endpoint: Endpoint) -> float:
+        percentile = endpoint.percentile(self.hedge_percentile)
+        return max(self.min_hedge_delay, INITIAL_HEDGE_DELAY if percentile is None else percentile)
+
+    def send(self, post: Callable[[str], Any], hedge: bool = False) -> Any:
+        """
+        Sends a request to the best endpoint.
+
+        Args:
+        post (Callable[[str], Any]): Sends the request to the given url and returns the response.
+        hedge (bool): The request is read-only and may be sent to two endpoints.
+        """
+        endpoint = self.pick()
+        priority = current_priority()
+        if not hedge or not self.hedge_percentile or len(self.endpoints) < 2:
+            return self._send_with_failover(endpoint, post, priority)
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(self.max_workers, thread_name_prefix='rpc-hedge')
+        tried = [endpoint]
+        pending = {self._executor.submit(self._send_one, endpoint, post, priority)}
+        hedge = None
+        delay = self.hedge_delay(endpoint)
+        error = None
+        # the slower request keeps running in the background and still updates its endpoint's health
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=delay, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.stats['hedge_wins'] += 1
+                    return future.result()
+                error = future.exception()
+            if done and (pending or not is_unhealthy(error)):
+                continue
+
+            # a dead or failing endpoint fails over to the next at once, a slow answer is hedged once
+            endpoint = self.pick(exclude=tried)
+            if endpoint is None:
+                delay = None
+                continue
+            tried.append(endpoint)
+            future = self._executor.submit(self._send_one, endpoint, post, priority)
+            pending.add(future)
+            with self._lock:
+                if done:
+                    self.stats['failovers'] += 1
+                    delay = None if delay is None else self.hedge_delay(endpoint)
+                else:
+                    self.stats['hedged'] += 1
+                    hedge = future
+                    delay = None
+        raise error
+
+    def _send_with_failover(self, endpoint: Endpoint, post: Callable[[str], Any], priority: int) -> Any:
+        tried = []
+        while True:
+            try:
+                return self._send_one(endpoint, post, priority)
+            except Exception as e:
+                # a bad request fails the same everywhere
+                if not is_unhealthy(e):
+                    raise
+                tried.append(endpoint)
+                endpoint = self.pick(exclude=tried)
+                if endpoint is None:
+                    raise
+                with self._lock:
+                    self.stats['failovers'] += 1
+
+    async def send_async(self, post: Callable[[str], Awaitable[Any]]) -> Any:
+        """
+        Sends a request from asyncio code to the best endpoint, failing over like `send`. Not hedged, and paced by
+        the caller (e.g. a semaphore) instead of the endpoint schedulers, which block their thread.
+
+        Args:
+        post (Callable[[str], Awaitable[Any]]): Sends the request to the given url and returns the response.
+        """
+        endpoint = self.pick()
+        tried = []
+        while True:
+            try:
+                return await self._send_one_async(endpoint, post)
+            except Exception as e:
+                # a bad request fails the same everywhere
+                if not is_unhealthy(e):
+                    raise
+                tried.append(endpoint)
+                endpoint = self.pick(exclude=tried)
+                if endpoint is None:
+                    raise
+                with self._lock:
+                    self.stats['failovers'] += 1
+
+    async def _send_one_async(self, endpoint: Endpoint, post: Callable[[str], Awaitable[Any]]) -> Any:
+        with self._lock:
+            endpoint.in_flight += 1
+        started = time.monotonic()
+        try:
+            response = await post(endpoint.url)
+        except Exception as e:
+            self.record(endpoint, time.monotonic() - started, e)
+            raise
+        finally:
+            with self._lock:
+                endpoint.in_flight -= 1
+        self.record(endpoint, time.monotonic() - started)
+        return response
+
+    def _send_one(self, endpoint: Endpoint, post: Callable[[str], Any], priority: int) -> Any:
+        # requests waiting for the endpoint's scheduler count as load too
+        with self._lock:
+            endpoint.in_flight += 1
+        try:
+            with endpoint.scheduler.priority(priority):
+                return endpoint.scheduler.request(lambda: self._post(endpoint, post))
+        finally:
+            with self._lock:
+                endpoint.in_flight -= 1
+
+    def _post(self, endpoint: Endpoint, post: Callable[[str], Any]) -> Any:
+        started = time.monotonic()
+        try:
+            response = post(endpoint.url)
+        except Exception as e:
+            self.record(endpoint, time.monotonic() - started, e)
+            raise
+        self.record(endpoint, time.monotonic() - started)
+        return response
+
+    def summary(self) -> Dict[str, Any]:
+        return {**self.stats, 'endpoints': [x.summary() for x in self.endpoints]}
+
+
+def is_unhealthy(error: Exception) -> bool:
+    """
+    True if the error says the node is down, overloaded or stalled, rather than the request being bad.
+    """
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError):
+        return getattr(getattr(error, 'response', None), 'status_code', None) in UNHEALTHY_STATUSES
+    # the same from aiohttp, for send_async
+    if isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in UNHEALTHY_STATUSES
+    return False
+
+
+def split_urls(value: str) -> List[str]:
+    """
+    Urls of a comma-separated env value like ETH_RPC.
+    """
+    return [x.strip() for x in (value or '').split(',') if x.strip()]
@@ -0,0 +1,190 @@
+from typing import Any, Dict, List, Tuple
+import json
+import threading
+import time
+import requests
+from web3 import Web3
+from web3._utils.request import make_post_request, DEFAULT_TIMEOUT
+from metrics import get_metrics
+
+DEFAULT_BATCH_SIZE = 100
+# read-only methods that may be sent to a second endpoint when the first is slow (see routing.EndpointRouter)
+HEDGED_METHODS = ('eth_call',)
+
+# error messages providers use when a batch has too many requests; rate limit errors ("too many requests",
+# "limit exceeded") are not about the batch size and must not shrink it
+BATCH_LIMIT_MESSAGES = ('batch size', 'batch too large', 'batch is too large', 'batch limit', 'batch request limit',
+                        'max batch', 'maximum batch', 'too many requests in batch', 'too many requests in a batch')
+# error messages providers answer eth_getLogs with when a range spans too many blocks or results (see lp_indexer)
+LOG_RANGE_MESSAGES = ('block range', 'query returned more than', 'response size', 'log response size exceeded')
+# full batches in a row after which batch_size grows again by BATCH_GROWTH of itself, up to its initial value
+BATCH_GROW_AFTER = 10
+BATCH_GROWTH = 0.125
+
+
+class BatchTooLarge(Exception):
+    pass
+
+
+def is_limit_error(message: str, phrases: Tuple[str, ...]) -> bool:
+    """
+    Whether an error message is one of the size limits in phrases, and not a rate limit.
+    """
+    message = str(message).lower()
+    return 'rate limit' not in message and any(x in message for x in phrases)
+
+
+class BatchHTTPProvider(Web3.HTTPProvider):
+    def __init__(self, endpoint_uri: str = None, batch_size: int = DEFAULT_BATCH_SIZE, session: Any = None,
+                 blockchain: str = None, scheduler: Any = None, router: Any = None, **kwargs):
+        """
+        HTTPProvider that can also pack many requests into one JSON-RPC batch array.
+
+        Args:
+        endpoint_uri (str): The RPC url. Ignored when a router is given.
+        batch_size (int): Largest batch sent in one request. Halves when the endpoint rejects a batch for its size
+            (HTTP 413/414 or a batch limit error), and grows back slowly after BATCH_GROW_AFTER full batches answered
+            in a row. Timeouts and 5xx are left to the scheduler and router to retry or fail over.
+        session: Optional session shared by every thread using this provider (see chain_clients). Without it,
+            web3's per-thread session cache is used.
+        blockchain (str): Name of the chain, the label of its RPC metrics.
+        scheduler (scheduler.EndpointScheduler): Paces every request to endpoint_uri and retries the throttled ones.
+            Unused with a router, whose endpoints each have their own.
+        router (routing.EndpointRouter): Spreads the requests over several urls of the chain and hedges the read-only ones.
+        """
+        super().__init__(router.urls[0] if router is not None else endpoint_uri, **kwargs)
+        self.batch_size = self.max_batch_size = max(1, int(batch_size))
+        self.batch_successes = 0
+        # guards batch_size and batch_successes, the provider is shared by the threads of the chain
+        self._batch_lock = threading.Lock()
+        self.session = session
+        self.blockchain = blockchain
+        self.scheduler = scheduler
+        self.router = router
+
+    def make_request(self, method: str, params: Any) -> Dict[str, Any]:
+        request_data = self.encode_rpc_request(method, params)
+        started = time.perf_counter()
+        try:
+            raw_response = self.post(request_data, hedge=method in HEDGED_METHODS)
+        except Exception:
+            get_metrics().record_request(self.blockchain, method, time.perf_counter() - started, len(request_data), 0, error=True)
+            raise
+        response = self.decode_rpc_response(raw_response)
+        get_metrics().record_request(self.blockchain, method, time.perf_counter() - started, len(request_data), len(raw_response),
+                                     error='error' in response)
+        return response
+
+    def post(self, data: bytes, hedge: bool = False) -> bytes:
+        """
+        Posts an encoded JSON-RPC payload and returns the raw response body.
+
+        Args:
+        data (bytes): The encoded request.
+        hedge (bool): The request is read-only, so the router may also send it to a second endpoint.
+        """
+        if self.router is not None:
+            # paced by the scheduler of the url it is sent to, hedged copies included
+            return self.router.send(lambda url: self._post(data, url), hedge)
+        send = lambda: self._post(data, self.endpoint_uri)
+        if self.scheduler is not None:
+            return self.scheduler.request(send)
+        return send()
+
+    def _post(self, data: bytes, endpoint_uri: str) -> bytes:
+        if self.session is None:
+            return make_post_request(endpoint_uri, data, **self.get_request_kwargs())
+
+        kwargs = self.get_request_kwargs()
+        kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+        response = self.session.post(endpoint_uri, data=data, **kwargs)
+        response.raise_for_status()
+        return response.content
+
+    def make_batch_request(self, requests_list: List[Tuple[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Sends (method, params) requests as JSON-RPC batches, splitting them adaptively.
+
+        Args:
+        requests_list (List[Tuple[str, Any]]): The requests to send.
+
+        Returns:
+        List[Dict[str, Any]]: One JSON-RPC response per request, in the same order.
+        """
+        responses = []
+        i = 0
+        while i < len(requests_list):
+            with self._batch_lock:
+                batch_size = self.batch_size
+            chunk = requests_list[i:i + batch_size]
+            try:
+                responses.extend(self._send_batch(chunk))
+                i += len(chunk)
+            except BatchTooLarge as e:
+                if len(chunk) == 1:
+                    raise Exception(f'Error in make_batch_request: {e}')
+                # halve and remember the smaller size for the following batches, unless another thread went lower
+                with self._batch_lock:
+                    self.batch_size = min(self.batch_size, max(1, len(chunk) // 2))
+                    self.batch_successes = 0
+                continue
+            if len(chunk) == batch_size:
+                self.grow_batch_size()
+        return responses
+
+    def grow_batch_size(self) -> None:
+        # the limit may have been lowered only for a while: try larger batches again, slowly
+        with self._batch_lock:
+            self.batch_successes += 1
+            if self.batch_successes >= BATCH_GROW_AFTER and self.batch_size < self.max_batch_size:
+                self.batch_size = min(self.max_batch_size, self.batch_size + max(1, int(self.batch_size * BATCH_GROWTH)))
+                self.batch_successes = 0
+
+    def _send_batch(self, chunk: List[Tuple[str, Any]]) -> List[Dict[str, Any]]:
+        rpc_requests = [
+            {"jsonrpc": "2.0", "method": method, "params": params or [], "id": next(self.request_counter)}
+            for method, params in chunk
+        ]
+        request_data = self.encode_batch(rpc_requests)
+        started = time.perf_counter()
+        try:
+            raw_response = self.post(request_data, hedge=all(method in HEDGED_METHODS for method, _ in chunk))
+        except Exception as e:
+            get_metrics().record_request(self.blockchain, 'batch', time.perf_counter() - started, len(request_data), 0, error=True)
+            if not isinstance(e, requests.exceptions.HTTPError) or len(chunk) == 1:
+                raise
+            # 5xx and timeouts are about the node, not the batch: retried or failed over by the scheduler and router
+            status = e.response.status_code if e.response is not None else None
+            body = e.response.text if e.response is not None else ''
+            if status in (413, 414) or is_limit_error(body, BATCH_LIMIT_MESSAGES):
+                raise BatchTooLarge(f'http status {status}')
+            raise
+
+        decoded = json.loads(raw_response)
+        get_metrics().record_request(self.blockchain, 'batch', time.perf_counter() - started, len(request_data), len(raw_response),
+                                     error=isinstance(decoded, dict))
+        if isinstance(decoded, dict):
+            # some providers answer an oversized batch with a single error object, and a rate limited one too
+            error = decoded.get('error') or {'code': -32603, 'message': str(decoded)}
+            if len(chunk) > 1 and self.is_batch_limit_error({'error': error}):
+                raise BatchTooLarge(error.get('message'))
+            return [{"jsonrpc": "2.0", "id": request['id'], "error": error} for request in rpc_requests]
+
+        by_id = {response.get('id'): response for response in decoded}
+        responses = []
+        for request in rpc_requests:
+            responses.append(by_id.get(request['id'], {"id": request['id'], "error": {"code": -32603, "message": "no response in batch"}}))
+
+        if len(chunk) > 1 and all(self.is_batch_limit_error(r) for r in responses):
+            raise BatchTooLarge(responses[0]['error'].get('message'))
+        return responses
+
+    def encode_batch(self, rpc_requests: List[Dict[str, Any]]) -> bytes:
+        return Web3.to_bytes(text=Web3.to_json(rpc_requests))
+
+    @staticmethod
+    def is_batch_limit_error(response: Dict[str, Any]) -> bool:
+        error = response.get('error')
+        if not error:
+            return False
+        return is_limit_error(error.get('message', ''), BATCH_LIMIT_MESSAGES)
@@ -0,0 +1,272 @@
+from typing import Any, Callable, Iterable, List, Optional
+import concurrent.futures
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import requests
+
+# lower runs first; pricing pools gate every valuation, so their reads jump the queue
+PRIORITY_PRICING = 0
+PRIORITY_POSITIONS = 1
+PRIORITY_BACKGROUND = 2
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_TARGET_LATENCY = 2.0  # seconds; slower answers shrink the concurrency
+DEFAULT_MAX_RETRIES = 6
+MIN_RATE = 1.0  # requests per second the bucket never goes below
+BASE_BACKOFF = 0.25
+MAX_BACKOFF = 30.0
+DECREASE_FACTOR = 0.5
+LATENCY_DECREASE_FACTOR = 0.8
+DECREASE_COOLDOWN = 1.0  # seconds; one burst of 429s only counts as one signal
+# priority of the requests made by the current thread, shared by every scheduler (see EndpointScheduler.priority)
+_local = threading.local()
+
+
+class TokenBucket:
+    def __init__(self, rate: float = 0, burst: float = None):
+        """
+        Requests per second allowed to an endpoint. A rate of 0 is unlimited.
+
+        Args:
+        rate (float): Tokens added per second.
+        burst (float): Tokens that can pile up while idle. Defaults to one second worth of rate.
+        """
+        self.rate = float(rate or 0)
+        self.burst = burst
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self) -> float:
+        return float(self.burst or max(1.0, self.rate))
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            self._refill()
+            self.rate = float(rate or 0)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> None:
+        """
+        Blocks until a request may be sent.
+        """
+        while True:
+            with self._lock:
+                if not self.rate:
+                    return
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class EndpointScheduler:
+    def __init__(self, name: str, rate: float = 0, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, min_concurrency: int = 1,
+                 target_latency: float = DEFAULT_TARGET_LATENCY, max_retries: int = DEFAULT_MAX_RETRIES):
+        """
+        Paces the requests to one RPC endpoint:
+            - a token bucket caps the request rate. Unlimited until the endpoint first answers 429,
+              then it starts at half the observed rate and grows additively with every success.
+            - an AIMD limit caps the requests in flight: +1 per window of successes, halved on 429s
+              and timeouts, and cut by 20% when answers get slower than target_latency.
+            - requests wait for a slot in priority order (PRIORITY_PRICING first).
+            - throttled requests are retried after Retry-After or an exponential backoff, pausing the
+              whole endpoint, instead of failing the reads they carry.
+
+        Args:
+        name (str): Name of the endpoint, e.g. the blockchain.
+        rate (float): Known request rate limit of the endpoint, requests per second. 0 to learn it.
+        max_concurrency (int): Upper bound of the requests in flight, and the threads of map.
+        min_concurrency (int): Lower bound of the requests in flight.
+        target_latency (float): Latency, in seconds, above which the concurrency shrinks.
+        max_retries (int): Retries of a throttled request before its error is raised.
+        """
+        self.name = name
+        self.bucket = TokenBucket(rate)
+        self.max_rate = float(rate) if rate else None
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.min_concurrency = max(1, min(int(min_concurrency), self.max_concurrency))
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.stats = {'requests': 0, 'throttled': 0, 'retries': 0, 'timeouts': 0, 'slow': 0}
+        self._waiting: List[tuple] = []
+        self._sequence = itertools.count()
+        self._last_decrease = 0.0
+        self._started = deque(maxlen=1024)
+        self._condition = threading.Condition()
+        self._local = threading.local()
+        self._executor = None
+
+    @contextmanager
+    def priority(self, priority: int):
+        """
+        Sends the requests made by this thread inside the block with the given priority, through any scheduler.
+        """
+        previous = current_priority()
+        _local.priority = priority
+        try:
+            yield
+        finally:
+            _local.priority = previous
+
+    def request(self, send: Callable[[], Any]) -> Any:
+        """
+        Sends one request through the scheduler, in the calling thread.
+
+        Args:
+        send (Callable): Sends the request and returns the response. Raises requests' HTTPError on HTTP errors.
+        """
+        priority = current_priority()
+        attempt = 0
+        while True:
+            self._acquire(priority)
+            try:
+                self.bucket.acquire()
+                started = time.monotonic()
+                self._started.append(started)
+                response = send()
+            except Exception as e:
+                retry_after = throttled_for(e)
+                if retry_after is None:
+                    if isinstance(e, requests.exceptions.Timeout):
+                        self.on_timeout()
+                    raise
+                self.on_throttle(retry_after, attempt)
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.stats['retries'] += 1
+                continue
+            finally:
+                self._release()
+            self.on_success(time.monotonic() - started)
+            return response
+
+    def _acquire(self, priority: int) -> None:
+        entry = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if self._waiting[0] == entry and pause <= 0 and self.in_flight < max(self.min_concurrency, int(self.limit)):
+                    heapq.heappop(self._waiting)
+                    self.in_flight += 1
+                    self.stats['requests'] += 1
+                    return
+                self._condition.wait(pause if pause > 0 else None)
+
+    def _release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency: float) -> None:
+        with self._condition:
+            now = time.monotonic()
+            if latency > self.target_latency:
+                self.stats['slow'] += 1
+                if now - self._last_decrease > DECREASE_COOLDOWN:
+                    self._last_decrease = now
+                    self.limit = max(self.min_concurrency, self.limit * LATENCY_DECREASE_FACTOR)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            if self.bucket.rate:
+                rate = self.bucket.rate + 1 / self.bucket.rate
+                self.bucket.set_rate(min(rate, self.max_rate) if self.max_rate else rate)
+            self._condition.notify_all()
+
+    def on_timeout(self) -> None:
+        with self._condition:
+            self.stats['timeouts'] += 1
+            self._decrease(time.monotonic())
+
+    def on_throttle(self, retry_after: float, attempt: int) -> None:
+        """
+        Backs off after a 429: halves the concurrency and the rate, and pauses the endpoint.
+        """
+        with self._condition:
+            now = time.monotonic()
+            self.stats['throttled'] += 1
+            if self._decrease(now):
+                recent = sum(1 for x in self._started if x > now - 1)
+                self.bucket.set_rate(max(MIN_RATE, (self.bucket.rate or recent) * DECREASE_FACTOR))
+            backoff = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt) * (0.5 + random.random())
+            self.paused_until = max(self.paused_until, now + max(retry_after, backoff))
+
+    def _decrease(self, now: float) -> bool:
+        if now - self._last_decrease <= DECREASE_COOLDOWN:
+            return False
+        self._last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit * DECREASE_FACTOR)
+        return True
+
+    def map(self, function: Callable[[Any], Any], items: Iterable[Any], priorities: Iterable[int] = None) -> List[Any]:
+        """
+        Runs function on every item on the scheduler's threads and returns the results in order. The requests
+        they make still go through `request`, so at most `limit` of them are in flight.
+
+        Args:
+        function (Callable): Called with one item.
+        items (Iterable): The work items, e.g. chunks of a batch.
+        priorities (Iterable[int]): Priority of each item. Defaults to the caller's priority.
+        """
+        items = list(items)
+        default = current_priority()
+        priorities = list(priorities) if priorities is not None else [default] * len(items)
+        # nested maps run inline, a worker waiting on its own pool could starve it
+        if len(items) <= 1 or getattr(self._local, 'worker', False):
+            return [self._run(function, item, priority) for item, priority in zip(items, priorities)]
+
+        with self._condition:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(self.max_concurrency, thread_name_prefix=f'rpc-{self.name}')
+        order = sorted(range(len(items)), key=lambda i: priorities[i])
+        futures = {i: self._executor.submit(self._run_worker, function, items[i], priorities[i]) for i in order}
+        return [futures[i].result() for i in range(len(items))]
+
+    def _run(self, function: Callable[[Any], Any], item: Any, priority: int) -> Any:
+        with self.priority(priority):
+            return function(item)
+
+    def _run_worker(self, function: Callable[[Any], Any], item: Any, priority: int) -> Any:
+        self._local.worker = True
+        return self._run(function, item, priority)
+
+
+def current_priority() -> int:
+    """
+    Priority of the requests made by the current thread, PRIORITY_POSITIONS by default.
+    """
+    return getattr(_local, 'priority', PRIORITY_POSITIONS)
+
+
+def throttled_for(error: Exception) -> Optional[float]:
+    """
+    Seconds to wait if the error is a rate limit answer (HTTP 429), from its Retry-After header. None otherwise.
+    """
+    response = getattr(error, 'response', None)
+    if not isinstance(error, requests.exceptions.HTTPError) or getattr(response, 'status_code', None) != 429:
+        return None
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return max(0.0, float(headers.get('Retry-After', 0)))
+    except (TypeError, ValueError):
+        # an HTTP date instead of seconds
+        return 0.0
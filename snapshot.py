@@ -0,0 +1,143 @@
+from typing import Any, Dict, Iterable, Optional, Tuple
+import concurrent.futures
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_BLOCKS = 16
+
+
+class BlockCache:
+    def __init__(self, max_blocks: int = DEFAULT_MAX_BLOCKS):
+        """
+        Results of eth_calls made at a pinned block, keyed by (blockchain, block number, target, call data).
+        Results at a fixed block never change unless the block is reorged out, which is detected by block hash.
+
+        Args:
+        max_blocks (int): Number of most recent blocks kept per chain, with their hashes.
+        """
+        self.max_blocks = max_blocks
+        self.block_hashes: Dict[str, Dict[int, str]] = dict()
+        self.results: Dict[str, 'OrderedDict[int, Dict[Tuple[str, bytes], Tuple[bool, bytes]]]'] = dict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def pin(self, blockchain: str, number: int, block_hash: str, parent_hash: str = None) -> None:
+        """
+        Registers the hash of a block about to be read. Cached results of a block whose hash changed,
+        and of every block after it, are dropped.
+        """
+        with self._lock:
+            hashes = self.block_hashes.setdefault(blockchain, dict())
+            if hashes.get(number) not in (None, block_hash):
+                self._invalidate_from(blockchain, number)
+            elif parent_hash and hashes.get(number - 1) not in (None, parent_hash):
+                self._invalidate_from(blockchain, number - 1)
+            hashes[number] = block_hash
+            if parent_hash:
+                hashes.setdefault(number - 1, parent_hash)
+            self._evict(blockchain)
+
+    def _invalidate_from(self, blockchain: str, number: int) -> None:
+        print(f'Reorg detected on {blockchain} at block {number}, dropping cached results')
+        hashes = self.block_hashes.get(blockchain, {})
+        results = self.results.get(blockchain, {})
+        for block in [x for x in hashes if x >= number]:
+            del hashes[block]
+        for block in [x for x in results if x >= number]:
+            del results[block]
+
+    def get(self, blockchain: str, number: int, target: str, call_data: bytes) -> Optional[Tuple[bool, bytes]]:
+        with self._lock:
+            result = self.results.get(blockchain, {}).get(number, {}).get((target, call_data))
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return result
+
+    def set(self, blockchain: str, number: int, target: str, call_data: bytes, result: Tuple[bool, bytes]) -> None:
+        with self._lock:
+            blocks = self.results.setdefault(blockchain, OrderedDict())
+            if number not in blocks:
+                blocks[number] = dict()
+                self._evict(blockchain)
+            if number in blocks:
+                blocks[number][(target, call_data)] = result
+
+    def _evict(self, blockchain: str) -> None:
+        # only keep the most recent blocks; a block's results go with its hash, which a reorg is detected by.
+        # Every pin also registers the parent's hash, hence twice as many hashes.
+        hashes = self.block_hashes.get(blockchain, {})
+        results = self.results.get(blockchain, {})
+        for block in sorted(hashes)[:max(0, len(hashes) - 2 * self.max_blocks)]:
+            del hashes[block]
+            results.pop(block, None)
+        while len(results) > self.max_blocks:
+            block = min(results)
+            del results[block]
+            hashes.pop(block, None)
+
+
+class Snapshot:
+    def __init__(self, blocks: Dict[str, Tuple[int, str]]):
+        """
+        One pinned block per chain, so every read of a valuation sees the same state.
+
+        Args:
+        blocks (Dict[str, Tuple[int, str]]): (block number, block hash) by blockchain.
+        """
+        self.blocks = blocks
+
+    def block(self, blockchain: str) -> Optional[int]:
+        """
+        Returns the pinned block number of a chain, or None to read at 'latest'.
+        """
+        block = self.blocks.get(blockchain)
+        return block[0] if block else None
+
+    def __repr__(self) -> str:
+        return f'Snapshot({ {k: v[0] for k, v in self.blocks.items()} })'
+
+
+_cache: Optional[BlockCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_block_cache() -> BlockCache:
+    """
+    Returns the process-wide block cache, shared by every batch and consumer.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = BlockCache(int(os.getenv('BLOCK_CACHE_BLOCKS', DEFAULT_MAX_BLOCKS)))
+        return _cache
+
+
+def take_snapshot(blockchains: Iterable[str], block_identifier: Any = 'latest') -> Snapshot:
+    """
+    Resolves one block per chain, in parallel, and pins it in the block cache.
+
+    Args:
+    blockchains (Iterable[str]): The chains to pin.
+    block_identifier: Block to resolve on every chain, 'latest' by default.
+    """
+    from chain_clients import get_chain_client
+
+    def resolve(blockchain: str) -> Tuple[int, str]:
+        block = get_chain_client(blockchain).web3.eth.get_block(block_identifier)
+        block_hash, parent_hash = block['hash'].hex(), block['parentHash'].hex()
+        get_block_cache().pin(blockchain, block['number'], block_hash, parent_hash)
+        return block['number'], block_hash
+
+    blocks = dict()
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        futures = {executor.submit(resolve, blockchain): blockchain for blockchain in set(blockchains)}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                blocks[futures[future]] = future.result()
+            except Exception as exc:
+                print(f'Error resolving block for {futures[future]}, reading at latest. error: {exc}')
+    return Snapshot(blocks)
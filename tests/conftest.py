@@ -0,0 +1,44 @@
+import json
+import os
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WALLETS = 3
+
+
+@pytest.fixture(scope='session')
+def chains():
+    """
+    Serves tokenInfo.json on every chain with fake_rpc, and points the process-wide clients at it.
+    Returns the ChainState of each chain.
+    """
+    from fake_rpc import ChainState, FakeRpc, synthetic_wallets
+
+    with open(os.path.join(ROOT, 'tokenInfo.json')) as f:
+        token_data = json.load(f)
+    workdir = tempfile.mkdtemp()
+    os.environ.update({'WALLET_ADDRESS': ','.join(synthetic_wallets(WALLETS)),
+                       'METADATA_CACHE': os.path.join(workdir, 'tokenInfo.lock.json'),
+                       'HISTORY_STORE': ''})
+    states = dict()
+    servers = []
+    for blockchain, env_var in (('Ethereum', 'ETH_RPC'), ('Binance', 'BNB_RPC')):
+        states[blockchain] = ChainState(token_data, blockchain)
+        servers.append(FakeRpc(states[blockchain]).serve())
+        os.environ[env_var] = f'http://127.0.0.1:{servers[-1].server_address[1]}'
+    yield states
+    for server in servers:
+        server.shutdown()
+
+
+@pytest.fixture(scope='session')
+def portfolio(chains):
+    from mainV4 import TokenPortfolio, load_token_data
+
+    portfolio = TokenPortfolio(load_token_data(os.path.join(ROOT, 'tokenInfo.json')))
+    portfolio.get_net_value(verbose=False)
+    return portfolio
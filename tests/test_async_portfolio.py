@@ -0,0 +1,52 @@
+import asyncio
+import os
+import threading
+import pytest
+
+
+@pytest.mark.parametrize('pin_blocks', [True, False])
+def test_refresh_keeps_blocking_reads_off_the_loop(chains, portfolio, monkeypatch, pin_blocks):
+    import async_portfolio
+    import mainV4
+
+    threads = []
+    compile_config = async_portfolio.compile_config
+
+    def recording_compile_config(*args):
+        threads.append(threading.current_thread())
+        return compile_config(*args)
+
+    collect_rewards = mainV4.TokenPortfolio.collect_rewards
+
+    def awaited_blocks(self, tokens, blocks=None):
+        # without blocks, collect_rewards reads the head with the blocking client
+        assert blocks is not None and set(blocks) == set(chains)
+        return collect_rewards(self, tokens, blocks)
+
+    monkeypatch.setattr(async_portfolio, 'compile_config', recording_compile_config)
+    monkeypatch.setattr(async_portfolio.AsyncTokenPortfolio, 'collect_rewards', awaited_blocks)
+    token_data = mainV4.load_token_data(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tokenInfo.json'))
+    async_value = async_portfolio.AsyncTokenPortfolio(token_data, pin_blocks=pin_blocks)
+    assert threads == []
+
+    net_value = asyncio.run(async_value.refresh())
+    assert len(threads) == 1 and threads[0] is not threading.main_thread()
+    assert async_value.errors == []
+    assert net_value == pytest.approx(portfolio.get_net_value(verbose=False), rel=1e-9)
+
+
+def test_async_reads_fail_over_from_dead_url(chains):
+    from web3 import AsyncWeb3
+    from async_portfolio import RoutedAsyncHTTPProvider
+    from fake_rpc import FIRST_BLOCK
+    from routing import EndpointRouter
+
+    router = EndpointRouter(['http://127.0.0.1:1', os.environ['ETH_RPC']])
+    web3 = AsyncWeb3(RoutedAsyncHTTPProvider(router))
+
+    async def read():
+        return [await web3.eth.block_number for _ in range(3)]
+
+    assert asyncio.run(read()) == [FIRST_BLOCK] * 3
+    assert router.stats['failovers'] == 1
+    assert router.pick().url == os.environ['ETH_RPC']
@@ -0,0 +1,27 @@
+import os
+
+
+def test_partial_sample_stays_pending(chains, tmp_path, monkeypatch):
+    from backfill import Backfill
+    from fake_rpc import BLOCK_INTERVAL, FIRST_BLOCK, GENESIS_TIMESTAMP
+    from mainV4 import WALLET_ADDRESSES, TokenYield, load_token_data
+
+    timestamp = GENESIS_TIMESTAMP + FIRST_BLOCK * BLOCK_INTERVAL
+    output = str(tmp_path / 'backfill.jsonl')
+    backfill = Backfill(load_token_data(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tokenInfo.json')), output, workers=1)
+
+    fetch_token_data = TokenYield.fetch_token_data
+
+    def failing_fetch(self, *args, **kwargs):
+        # the other wallets still price every token, only this position is missing
+        if self.symbol == 'AGIX' and self.wallet == WALLET_ADDRESSES[-1]:
+            raise Exception('Error in fetch_token_data: call reverted')
+        return fetch_token_data(self, *args, **kwargs)
+
+    monkeypatch.setattr(TokenYield, 'fetch_token_data', failing_fetch)
+    assert backfill.run([timestamp]) == 1
+    assert backfill.completed() == set()
+
+    monkeypatch.setattr(TokenYield, 'fetch_token_data', fetch_token_data)
+    assert backfill.run([timestamp]) == 0
+    assert backfill.completed() == {timestamp}
@@ -0,0 +1,30 @@
+import copy
+import json
+import os
+from cli import cache_key
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WALLETS = ['0x1111111111111111111111111111111111111111', '0x2222222222222222222222222222222222222222']
+PARTS = ['wallet', 'lp']
+
+
+def load_config():
+    with open(os.path.join(ROOT, 'tokenInfo.json')) as f:
+        return json.load(f)
+
+
+def test_cache_key_covers_the_whole_config():
+    config = load_config()
+    key = cache_key(config, WALLETS, PARTS)
+    assert cache_key(load_config(), [x.upper().replace('0X', '0x') for x in reversed(WALLETS)], list(reversed(PARTS))) == key
+
+    changed = copy.deepcopy(config)
+    entry = next(x for x in changed if x.get('liquidityPool'))
+    entry['liquidityPool'][0]['liquidityTokenStakingNumber'] = 42
+    assert cache_key(changed, WALLETS, PARTS) != key
+
+    changed = copy.deepcopy(config)
+    changed[0]['decimals'] = int(changed[0].get('decimals', 18)) + 1
+    assert cache_key(changed, WALLETS, PARTS) != key
+
+    assert cache_key(config, WALLETS[:1], PARTS) != key
@@ -0,0 +1,27 @@
+import os
+import pytest
+
+pytest.importorskip('pyarrow')
+
+DAY = 1704067200  # 2024-01-01
+
+
+def holdings(timestamp):
+    return {'holdings': [{'timestamp': timestamp, 'wallet': wallet, 'symbol': 'SDAO', 'amount': 1.0, 'price': 2.0, 'usd_value': 2.0}
+                         for wallet in ('0xb', '0xa')]}
+
+
+def test_parquet_runs_are_compacted(tmp_path):
+    from history_store import ParquetStore
+
+    store = ParquetStore(str(tmp_path), compact_files=4)
+    for run in range(30):
+        store.append(holdings(DAY + 60 * run))
+    store.append(holdings(DAY + 86400))
+
+    day = tmp_path / 'holdings' / 'date=2024-01-01'
+    assert 1 <= len(os.listdir(day)) <= 4
+    rows = store.scan('holdings', start=DAY, end=DAY + 86399)
+    assert [x['timestamp'] for x in rows] == sorted(DAY + 60 * run for run in range(30) for _ in range(2))
+    assert len(store.scan('holdings', wallet='0xa')) == 31
+    assert len(os.listdir(tmp_path / 'holdings' / 'date=2024-01-02')) == 1
@@ -0,0 +1,139 @@
+import json
+import os
+import pytest
+from eth_abi import encode
+from hexbytes import HexBytes
+from web3 import Web3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OTHER = '0x9999999999999999999999999999999999999999'
+
+
+def make_indexer(tmp_path):
+    from fake_rpc import FIRST_BLOCK, LOG_HISTORY
+    from lp_indexer import LpIndexer
+
+    with open(os.path.join(ROOT, 'tokenInfo.json')) as f:
+        token_data = json.load(f)
+    return LpIndexer(token_data, str(tmp_path / 'lp.sqlite'), {'Ethereum': FIRST_BLOCK - LOG_HISTORY})
+
+
+def balances(indexer):
+    rows = indexer.connection.execute("SELECT contract, pid, wallet, amount FROM balances WHERE blockchain = 'Ethereum'").fetchall()
+    return {(contract, pid, wallet): int(amount) for contract, pid, wallet, amount in rows if int(amount)}
+
+
+def expected_balances(state, contracts):
+    """
+    Balances of the chain state: the sum of every log the fake serves.
+    """
+    from fake_rpc import FIRST_BLOCK, LOG_HISTORY, TOPICS
+    from lp_indexer import NO_PID
+
+    totals = dict()
+    for block, address, topics, data in state.logs(FIRST_BLOCK - LOG_HISTORY, FIRST_BLOCK, sorted(contracts), None):
+        pid = NO_PID if topics[0] == TOPICS['Transfer'] else int(topics[2], 16)
+        key = (address, pid, Web3.to_checksum_address('0x' + topics[-1][-40:]))
+        totals[key] = totals.get(key, 0) + int.from_bytes(data, 'big')
+    return totals
+
+
+def test_deposit_credits_to_and_withdraw_debits_user(chains, tmp_path):
+    from lp_indexer import NO_PID
+    from watch import address_topic, event_topic
+
+    indexer = make_indexer(tmp_path)
+    vault = sorted(indexer.contracts['Ethereum'])[0]
+    wallet = Web3.to_checksum_address('0x' + '1' * 40)
+    pid = encode(['uint256'], [3])
+    data = HexBytes(encode(['uint256'], [5]))
+
+    def log(*topics):
+        return {'address': vault, 'topics': [HexBytes(x) for x in topics], 'data': data}
+
+    assert indexer.decode(log(event_topic('yieldVault', 'Deposit'), address_topic(OTHER), pid, address_topic(wallet))) == [(vault, 3, wallet, 5)]
+    for name in ('Withdraw', 'EmergencyWithdraw'):
+        withdraw = log(event_topic('yieldVault', name), address_topic(wallet), pid, address_topic(OTHER))
+        assert indexer.decode(withdraw) == [(vault, 3, wallet, -5)]
+    mint = log(event_topic('ERC20', 'Transfer'), address_topic('0x' + '0' * 40), address_topic(wallet))
+    assert indexer.decode(mint) == [(vault, NO_PID, wallet, 5)]
+
+
+def test_reorg_is_rolled_back(chains, tmp_path, monkeypatch):
+    from fake_rpc import FIRST_BLOCK, FakeRpc, TOPICS, address_word
+
+    state = chains['Ethereum']
+    indexer = make_indexer(tmp_path)
+    expected = expected_balances(state, indexer.contracts['Ethereum'])
+    pool = next(x for x in sorted(indexer.contracts['Ethereum']) if x in state.pools)
+
+    # a branch with one more mint in its last blocks, later replaced by the canonical chain
+    fork = FIRST_BLOCK - 10
+    block_hash = FakeRpc.block_hash
+    logs = state.logs
+    monkeypatch.setattr(FakeRpc, 'block_hash', lambda self, number: block_hash(self, number) if number <= fork else '0x' + 'ab' * 32)
+    orphan = (FIRST_BLOCK - 3, pool, [TOPICS['Transfer'], address_word('0x' + '0' * 40), address_word(OTHER)], encode(['uint256'], [10 ** 18]))
+    monkeypatch.setattr(state, 'logs', lambda from_block, to_block, *args: logs(from_block, to_block, *args) +
+                        ([orphan] if from_block <= orphan[0] <= to_block else []))
+    indexer.sync('Ethereum')
+    assert balances(indexer) == {**expected, (pool, -1, Web3.to_checksum_address(OTHER)): 10 ** 18}
+
+    monkeypatch.undo()
+    indexer.sync('Ethereum')
+    assert balances(indexer) == expected
+    assert indexer.connection.execute('SELECT COUNT(*) FROM events WHERE block_hash = ?', ('0x' + 'ab' * 32,)).fetchone()[0] == 0
+
+
+def test_log_range_shrinks_and_grows_back(chains, tmp_path):
+    from fake_rpc import FIRST_BLOCK, LOG_HISTORY, FakeRpc
+
+    state = chains['Ethereum']
+    server = FakeRpc(state, max_logs=100).serve()
+    try:
+        web3 = Web3(Web3.HTTPProvider(f'http://127.0.0.1:{server.server_address[1]}'))
+        ranges = []
+        get_logs = web3.eth.get_logs
+
+        def recorded_get_logs(log_filter):
+            try:
+                result = get_logs(log_filter)
+            except Exception:
+                ranges.append((log_filter['toBlock'] - log_filter['fromBlock'] + 1, False))
+                raise
+            ranges.append((log_filter['toBlock'] - log_filter['fromBlock'] + 1, True))
+            return result
+
+        web3.eth.get_logs = recorded_get_logs
+        indexer = make_indexer(tmp_path)
+        contracts = sorted(indexer.contracts['Ethereum'])
+        indexer.sync_range('Ethereum', web3, contracts, FIRST_BLOCK - LOG_HISTORY, FIRST_BLOCK, FIRST_BLOCK)
+    finally:
+        server.shutdown()
+
+    refused = [i for i, (size, answered) in enumerate(ranges) if not answered]
+    assert refused and ranges[refused[0]][0] == 2000
+    # halved until answered, then doubled again
+    answered = [size for size, ok in ranges[refused[0]:] if ok]
+    assert min(answered) < 2000
+    assert any(later > earlier for earlier, later in zip(answered, answered[1:]))
+    assert balances(indexer) == expected_balances(state, contracts)
+
+
+def test_quota_errors_are_not_split(chains, tmp_path):
+    from lp_indexer import DEFAULT_LOG_RANGE
+
+    class Eth:
+        calls = 0
+
+        def get_logs(self, log_filter):
+            Eth.calls += 1
+            raise ValueError({'code': -32005, 'message': 'daily request limit exceeded'})
+
+    class FakeWeb3:
+        eth = Eth()
+
+    indexer = make_indexer(tmp_path)
+    with pytest.raises(Exception, match='daily request limit'):
+        indexer.sync_range('Ethereum', FakeWeb3(), sorted(indexer.contracts['Ethereum']), 1, 10 ** 5, 10 ** 5)
+    assert Eth.calls == 1
+    assert indexer.log_ranges.get('Ethereum', DEFAULT_LOG_RANGE) == DEFAULT_LOG_RANGE
@@ -0,0 +1,27 @@
+import pytest
+
+
+def test_symbol_is_priced_on_its_own_chain(portfolio):
+    prices = portfolio.prices
+    symbol = next(symbol for (blockchain, symbol) in prices
+                  if blockchain == 'Ethereum' and ('Binance', symbol) in prices and prices[('Binance', symbol)] != prices[(blockchain, symbol)])
+
+    for blockchain in ('Ethereum', 'Binance'):
+        assert portfolio.value_holdings(prices, {(blockchain, symbol): 2.0}, verbose=False) == pytest.approx(2 * prices[(blockchain, symbol)])
+    both = portfolio.value_holdings(prices, {('Ethereum', symbol): 1.0, ('Binance', symbol): 1.0}, verbose=False)
+    assert both == pytest.approx(prices[('Ethereum', symbol)] + prices[('Binance', symbol)])
+
+
+def test_price_falls_back_to_another_chain(portfolio):
+    prices = portfolio.prices
+    assert ('Binance', 'ETH') not in prices
+    assert portfolio.value_holdings(prices, {('Binance', 'ETH'): 1.0}, verbose=False) == pytest.approx(prices[('Ethereum', 'ETH')])
+
+
+def test_net_value_sums_chain_holdings(portfolio):
+    from watch import PortfolioWatcher
+
+    expected = sum(amount * portfolio.price_graph.get_price(portfolio.prices, blockchain, symbol)
+                   for (blockchain, symbol), amount in portfolio.holdings_by_chain.items())
+    assert PortfolioWatcher(portfolio).get_net_value() == pytest.approx(expected)
+    assert sum(portfolio.wallet_values.values()) == pytest.approx(expected)
@@ -0,0 +1,103 @@
+import threading
+import time
+from eth_abi import encode
+from web3 import Web3
+import response_cache
+from abi_registry import get_contract
+from batching import PendingCall
+from response_cache import ENTRY_OVERHEAD, ResponseCache
+
+TOKEN = '0x5B7533812759B45C2B44C19e320ba2cD2681b542'
+WALLETS = ['0x' + str(i) * 40 for i in range(1, 4)]
+
+
+def make_call(fn_name='balanceOf', wallet=WALLETS[0]):
+    contract = get_contract(Web3(), 'Ethereum', TOKEN, 'ERC20')
+    return PendingCall(contract, fn_name, (Web3.to_checksum_address(wallet),) if fn_name == 'balanceOf' else ())
+
+
+def answer(cache, call, value=7):
+    to_send, waiting = cache.claim('Ethereum', 'latest', [call])
+    assert to_send == [call] and not waiting
+    call.set_result(True, encode(['uint256'], [value]))
+    cache.complete('Ethereum', 'latest', [call])
+
+
+def test_concurrent_claims_are_sent_once():
+    cache = ResponseCache()
+    barrier = threading.Barrier(5)
+    calls = [make_call() for _ in range(5)]
+    senders = []
+
+    def read(call):
+        barrier.wait()
+        to_send, waiting = cache.claim('Ethereum', 'latest', [call])
+        if to_send:
+            senders.append(call)
+            # the others claim while this read is in flight
+            time.sleep(0.2)
+            call.set_result(True, encode(['uint256'], [42]))
+            cache.complete('Ethereum', 'latest', to_send)
+        assert cache.wait('Ethereum', 'latest', waiting) == []
+
+    threads = [threading.Thread(target=read, args=(call,)) for call in calls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(senders) == 1
+    assert [call.value for call in calls] == [42] * 5
+    assert cache.stats['coalesced'] == 4
+
+
+def test_failed_read_releases_waiters():
+    cache = ResponseCache()
+    sender, waiter = make_call(), make_call()
+    assert cache.claim('Ethereum', 'latest', [sender])[0] == [sender]
+    to_send, waiting = cache.claim('Ethereum', 'latest', [waiter])
+    assert not to_send and len(waiting) == 1
+
+    # no answer: released without being cached, the waiter has to send it again
+    cache.complete('Ethereum', 'latest', [sender])
+    assert cache.wait('Ethereum', 'latest', waiting) == [waiter]
+    assert cache.claim('Ethereum', 'latest', [make_call()])[0]
+
+
+def test_entries_expire_by_policy(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, 'monotonic', lambda: now[0])
+    cache = ResponseCache(ttl_policies={'balanceOf': 3, 'decimals': None}, default_ttl=1)
+    balance, decimals, total_supply = make_call(), make_call('decimals'), make_call('totalSupply')
+    for call in (balance, decimals, total_supply):
+        answer(cache, call)
+
+    def cached(fn_name, block='latest'):
+        call = make_call(fn_name)
+        return not cache.claim('Ethereum', block, [call])[0] and call.value == 7
+
+    now[0] += 2
+    assert cached('balanceOf') and cached('decimals')
+    assert not cached('totalSupply')  # default_ttl
+    now[0] += 2
+    assert not cached('balanceOf')
+    # metadata never expires and is served at any block
+    assert cached('decimals') and cached('decimals', 123)
+    assert cache.stats['expired'] == 2
+
+
+def test_least_recently_used_is_evicted():
+    calls = [make_call(wallet=x) for x in WALLETS]
+    size = ENTRY_OVERHEAD + len(calls[0].call_data) + 32
+    cache = ResponseCache(max_bytes=2 * size)
+    answer(cache, calls[0])
+    answer(cache, calls[1])
+    # reading the first makes the second the least recently used
+    assert not cache.claim('Ethereum', 'latest', [make_call(wallet=WALLETS[0])])[0]
+    answer(cache, calls[2])
+
+    assert cache.stats['evicted'] == 1
+    assert cache.size == 2 * size
+    assert not cache.claim('Ethereum', 'latest', [make_call(wallet=WALLETS[0])])[0]
+    assert not cache.claim('Ethereum', 'latest', [make_call(wallet=WALLETS[2])])[0]
+    assert cache.claim('Ethereum', 'latest', [make_call(wallet=WALLETS[1])])[0]
@@ -0,0 +1,57 @@
+import pytest
+
+
+def vault_positions(token):
+    """
+    (target dict, key, vault, staked token, configured pid) of every vault position of the token with rewards.
+    """
+    positions = []
+    unbonded = token.token_info.get('unbondedStaking') or {}
+    if 'rewardsSymbol' in unbonded:
+        positions.append((unbonded, 'pendingRewards', token.unbonded_staking_address, token.token_address,
+                          unbonded.get('userInfoNumber')))
+    for lp_dict in token.liquidity_pool_info_list:
+        if 'rewardsSymbol' in lp_dict:
+            positions.append((lp_dict, 'pendingRewardsFromYieldVault', token.checksum_address(lp_dict['liquidityTokenStakingAddress']),
+                              token.checksum_address(lp_dict['liquidityPoolAddress']), lp_dict.get('liquidityTokenStakingNumber')))
+    return positions
+
+
+def contract_rewards(chains, portfolio):
+    """
+    pendingRewards as answered by the vaults, by (wallet, symbol, key, vault, pid).
+    """
+    rewards = dict()
+    for token in portfolio.tokens:
+        block = portfolio.get_block(token.blockchain)
+        for target, key, vault, staked_token, configured in vault_positions(token):
+            pid = token.vault_pid(vault, staked_token, configured)
+            decimals = dict(portfolio.plan.token_symbols[token.blockchain].values())[target['rewardsSymbol']]
+            amount = chains[token.blockchain].call(vault, 'pendingRewards', [pid, token.wallet], block)
+            rewards[(token.wallet, token.symbol, key, vault, pid)] = (target[key], amount / 10 ** decimals)
+    return rewards
+
+
+def test_rewards_match_contract(chains, portfolio):
+    rewards = contract_rewards(chains, portfolio)
+    assert rewards
+    assert any(expected for _, expected in rewards.values())
+    for local, expected in rewards.values():
+        assert local == pytest.approx(expected, rel=1e-9)
+
+
+def test_watch_update_recomputes_rewards(chains, portfolio):
+    from watch import PortfolioWatcher
+
+    watcher = PortfolioWatcher(portfolio)
+    net_value = watcher.get_net_value()
+    before = {position: local for position, (local, _) in contract_rewards(chains, portfolio).items()}
+    for blockchain in chains:
+        tokens = {x for x in portfolio.tokens if x.blockchain == blockchain}
+        watcher.update(blockchain, portfolio.get_block(blockchain), tokens, set())
+
+    after = contract_rewards(chains, portfolio)
+    assert after.keys() == before.keys()
+    for position, (local, expected) in after.items():
+        assert local == pytest.approx(before[position]) and local == pytest.approx(expected, rel=1e-9)
+    assert watcher.get_net_value() == pytest.approx(net_value)
@@ -0,0 +1,95 @@
+import time
+import pytest
+import requests
+import routing
+from routing import EndpointRouter
+
+DEAD = 'http://127.0.0.1:1'
+LIVE = 'http://127.0.0.1:2'
+
+
+def post(url):
+    if url == DEAD:
+        raise requests.exceptions.ConnectionError(f'Connection refused: {url}')
+    return url
+
+
+def test_hedged_send_fails_over_from_dead_url():
+    router = EndpointRouter([DEAD, LIVE])
+    assert router.pick().url == DEAD
+    assert router.send(post, hedge=True) == LIVE
+    assert router.stats['failovers'] == 1
+    assert router.stats['hedged'] == 0
+
+
+def test_never_answering_url_ranks_last():
+    router = EndpointRouter([DEAD, LIVE])
+    router.send(post)
+    for _ in range(10):
+        assert router.pick().url == LIVE
+        assert router.send(post, hedge=True) == LIVE
+    assert router.stats['failovers'] == 1
+
+
+def test_hedged_send_raises_when_every_url_is_dead():
+    router = EndpointRouter([DEAD, DEAD + '0'])
+    with pytest.raises(requests.exceptions.ConnectionError):
+        router.send(lambda url: post(DEAD), hedge=True)
+    assert router.stats['failovers'] == 1
+
+
+def test_send_fails_over_from_failing_url():
+    def failing(url):
+        if url == DEAD:
+            response = requests.Response()
+            response.status_code = 503
+            raise requests.exceptions.HTTPError(f'503 error for url: {url}', response=response)
+        return url
+
+    for hedge in (False, True):
+        router = EndpointRouter([DEAD, LIVE])
+        assert router.send(failing, hedge) == LIVE
+        assert router.stats['failovers'] == 1
+
+
+def throttled(url):
+    response = requests.Response()
+    response.status_code = 429
+    response.headers['Retry-After'] = '0'
+    return requests.exceptions.HTTPError(f'429 error for url: {url}', response=response)
+
+
+def test_each_endpoint_has_its_own_window():
+    router = EndpointRouter([DEAD, LIVE], rate_limit=5)
+    answers = iter([throttled(DEAD)])
+
+    def post(url):
+        error = next(answers, None)
+        if error is not None:
+            raise error
+        return url
+
+    assert router.send(post) == DEAD
+    dead, live = router.endpoints
+    assert dead.scheduler.stats['throttled'] == 1
+    assert dead.scheduler.limit < dead.scheduler.max_concurrency
+    assert dead.scheduler.bucket.rate < 5
+    assert live.scheduler.stats['requests'] == 0
+    assert live.scheduler.limit == live.scheduler.max_concurrency
+    assert live.scheduler.bucket.rate == 5
+
+
+def test_hedged_send_is_charged_to_its_endpoint(monkeypatch):
+    monkeypatch.setattr(routing, 'INITIAL_HEDGE_DELAY', 0.05)
+    router = EndpointRouter([DEAD, LIVE], rate_limit=5)
+
+    def post(url):
+        if url == DEAD:
+            time.sleep(0.5)
+        return url
+
+    assert router.send(post, hedge=True) == LIVE
+    dead, live = router.endpoints
+    assert router.stats['hedged'] == 1
+    assert live.scheduler.stats['requests'] == 1
+    assert live.scheduler.bucket.tokens < live.scheduler.bucket.capacity - 0.5
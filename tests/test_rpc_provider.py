@@ -0,0 +1,83 @@
+import json
+import pytest
+import requests
+from rpc_provider import BatchHTTPProvider, BATCH_GROW_AFTER
+
+
+class LimitedProvider(BatchHTTPProvider):
+    def __init__(self, max_batch, error=None, **kwargs):
+        super().__init__('http://127.0.0.1:1', **kwargs)
+        self.max_batch = max_batch
+        self.error = error
+        self.sizes = []
+
+    def post(self, data, hedge=False):
+        payload = json.loads(data)
+        self.sizes.append(len(payload))
+        if self.error:
+            return json.dumps({'jsonrpc': '2.0', 'id': None, 'error': {'code': -32005, 'message': self.error}}).encode()
+        if len(payload) > self.max_batch:
+            return json.dumps({'jsonrpc': '2.0', 'id': None, 'error': {'code': -32600, 'message': 'Batch size is too large'}}).encode()
+        return json.dumps([{'jsonrpc': '2.0', 'id': x['id'], 'result': '0x1'} for x in payload]).encode()
+
+
+def test_batch_size_shrinks_and_grows_back():
+    provider = LimitedProvider(max_batch=60, batch_size=100)
+    responses = provider.make_batch_request([('eth_blockNumber', [])] * 120)
+    assert [x['result'] for x in responses] == ['0x1'] * 120
+    assert provider.batch_size == 50
+
+    provider.max_batch = 100
+    for _ in range(BATCH_GROW_AFTER * 8):
+        provider.make_batch_request([('eth_blockNumber', [])] * provider.batch_size)
+    assert provider.batch_size == 100
+
+
+def test_rate_limit_errors_keep_the_batch_size():
+    provider = LimitedProvider(max_batch=100, batch_size=100, error='Too many requests, rate limit exceeded')
+    responses = provider.make_batch_request([('eth_blockNumber', [])] * 100)
+    assert provider.sizes == [100]
+    assert provider.batch_size == 100
+    assert all(x['error']['code'] == -32005 for x in responses)
+    assert not provider.is_batch_limit_error({'error': {'message': 'daily request limit exceeded'}})
+    assert provider.is_batch_limit_error({'error': {'message': 'too many requests in batch'}})
+
+
+class FailingProvider(BatchHTTPProvider):
+    def __init__(self, error, **kwargs):
+        super().__init__('http://127.0.0.1:1', **kwargs)
+        self.error = error
+        self.sizes = []
+
+    def post(self, data, hedge=False):
+        payload = json.loads(data)
+        self.sizes.append(len(payload))
+        if len(payload) > 1:
+            raise self.error
+        return json.dumps([{'jsonrpc': '2.0', 'id': x['id'], 'result': '0x1'} for x in payload]).encode()
+
+
+def http_error(status, body=''):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body.encode()
+    return requests.exceptions.HTTPError(f'{status} error', response=response)
+
+
+@pytest.mark.parametrize('error', [http_error(500), http_error(502), http_error(503), http_error(504), http_error(400),
+                                   requests.exceptions.ReadTimeout('read timed out')])
+def test_node_errors_keep_the_batch_size(error):
+    provider = FailingProvider(error, batch_size=100)
+    with pytest.raises(type(error)):
+        provider.make_batch_request([('eth_blockNumber', [])] * 100)
+    assert provider.sizes == [100]
+    assert provider.batch_size == 100
+
+
+@pytest.mark.parametrize('error', [http_error(413), http_error(414), http_error(400, '{"error": "batch size too large"}')])
+def test_oversized_batch_statuses_shrink_the_batch(error):
+    provider = FailingProvider(error, batch_size=4)
+    responses = provider.make_batch_request([('eth_blockNumber', [])] * 4)
+    assert [x['result'] for x in responses] == ['0x1'] * 4
+    assert provider.sizes == [4, 2, 1, 1, 1, 1]
+    assert provider.batch_size == 1
@@ -0,0 +1,30 @@
+from snapshot import BlockCache
+
+
+def block_hash(number, fork=0):
+    return f'0x{fork:02x}{number:062x}'
+
+
+def test_hashes_are_evicted_with_results():
+    cache = BlockCache(max_blocks=4)
+    for number in range(100, 200):
+        cache.pin('Ethereum', number, block_hash(number), block_hash(number - 1))
+        cache.set('Ethereum', number, '0xpool', b'call', (True, b'result'))
+
+    assert len(cache.results['Ethereum']) == 4
+    assert len(cache.block_hashes['Ethereum']) <= 8
+    assert set(cache.results['Ethereum']) <= set(cache.block_hashes['Ethereum'])
+    assert cache.get('Ethereum', 199, '0xpool', b'call') == (True, b'result')
+    assert cache.get('Ethereum', 150, '0xpool', b'call') is None
+
+
+def test_reorg_of_a_kept_block_is_still_detected():
+    cache = BlockCache(max_blocks=4)
+    for number in range(100, 200):
+        cache.pin('Ethereum', number, block_hash(number), block_hash(number - 1))
+        cache.set('Ethereum', number, '0xpool', b'call', (True, b'result'))
+
+    cache.pin('Ethereum', 198, block_hash(198, fork=1), block_hash(197))
+    assert cache.get('Ethereum', 197, '0xpool', b'call') == (True, b'result')
+    assert cache.get('Ethereum', 198, '0xpool', b'call') is None
+    assert cache.get('Ethereum', 199, '0xpool', b'call') is None
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from valuation import lp_share_amounts, lp_share_amounts_loop
+
+POSITIONS = [
+    # reserves, LP balances and supplies past 2**53, where float64 rounds them
+    (2 ** 112 - 1, 3 ** 60, 2 ** 60 + 1, 2 ** 70 + 3, True, 18, 18),
+    (2 ** 100 + 7, 10 ** 30 + 1, 10 ** 22 + 9, 10 ** 24 + 13, False, 8, 18),
+    (10 ** 27 + 11, 2 ** 90 + 5, 2 ** 53 + 1, 2 ** 54 + 1, True, 6, 6),
+    (123456789, 987654321, 5, 10, False, 6, 18),
+    # pool without supply
+    (10 ** 20, 10 ** 20, 0, 0, True, 18, 18),
+    (10 ** 20, 10 ** 20, 10 ** 18, 0, False, 18, 6),
+]
+
+
+def test_exact_path_matches_loop():
+    expected = np.array(lp_share_amounts_loop(POSITIONS)).T
+    token, paired = lp_share_amounts(*zip(*POSITIONS), exact=True)
+    # bit for bit
+    assert token.tolist() == expected[0].tolist()
+    assert paired.tolist() == expected[1].tolist()
+    assert token[-2:].tolist() == paired[-2:].tolist() == [0.0, 0.0]
+
+
+def test_float_path_is_close_to_loop():
+    expected = np.array(lp_share_amounts_loop(POSITIONS)).T
+    token, paired = lp_share_amounts(*zip(*POSITIONS))
+    assert token.tolist() == pytest.approx(expected[0].tolist(), rel=1e-12)
+    assert paired.tolist() == pytest.approx(expected[1].tolist(), rel=1e-12)
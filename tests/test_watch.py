@@ -0,0 +1,21 @@
+from hexbytes import HexBytes
+
+OTHER = '0x9999999999999999999999999999999999999999'
+
+
+def test_deposit_to_a_wallet_is_watched(portfolio):
+    from watch import PortfolioWatcher, address_topic, event_topic
+
+    watcher = PortfolioWatcher(portfolio)
+    blockchain, vaults = next((blockchain, vaults) for blockchain, vaults in watcher.vaults.items() if vaults)
+    vault, tokens = next(iter(sorted(vaults.items())))
+    wallet = next(iter(tokens)).wallet
+
+    filters = [x for x in watcher.log_filters(blockchain, 1, 2) if x['address'] == sorted(vaults)]
+    assert [x['topics'][1:] for x in filters] == [[watcher.wallet_topics], [None, None, watcher.wallet_topics]]
+
+    deposit = {'address': vault.lower(), 'topics': [HexBytes(event_topic('yieldVault', 'Deposit')), HexBytes(address_topic(OTHER)),
+                                                    HexBytes((7).to_bytes(32, 'big')), HexBytes(address_topic(wallet))]}
+    affected, pools = watcher.affected_by(blockchain, [deposit])
+    assert affected == {x for x in tokens if x.wallet == wallet}
+    assert pools == set()
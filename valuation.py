@@ -0,0 +1,179 @@
+from typing import Any, Dict, List, Sequence, Tuple
+import argparse
+import random
+import time
+import numpy as np
+
+# accRewardsPerShare of the MasterChef style vaults is scaled by 1e12 (ACC_PRECISION of MiniChefV2)
+ACC_REWARDS_PRECISION = 10 ** 12
+
+
+def lp_share_amounts(reserve0: Sequence[int], reserve1: Sequence[int], my_lp: Sequence[int], total_lp: Sequence[int],
+                     is_token0: Sequence[bool], decimals: Sequence[int], paired_decimals: Sequence[int],
+                     exact: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Token amounts owned through LP positions, one position per element:
+        amount = reserve * my_lp / total_lp / 10**decimals
+    with the reserves swapped for positions whose token is token1 of the pool. A pool without LP supply owns nothing.
+
+    Args:
+    reserve0, reserve1 (Sequence[int]): Pool reserves in base units.
+    my_lp, total_lp (Sequence[int]): LP tokens of the position (wallet + vault) and LP supply of the pool.
+    is_token0 (Sequence[bool]): True if the position's token is token0 of the pool.
+    decimals, paired_decimals (Sequence[int]): Decimals of the token and of the paired token.
+    exact (bool): Multiply reserves and LP balances as integers before dividing. The float path rounds
+        both to 53 bits first (about 1e-16 relative error); the exact path matches Python int math to the
+        last bit but runs on object arrays.
+
+    Returns:
+    Tuple[np.ndarray, np.ndarray]: Amounts of the token and of the paired token, as float64.
+    """
+    flags = np.asarray(is_token0, dtype=bool)
+    token_scale = 10.0 ** np.asarray(decimals, dtype=np.float64)
+    paired_scale = 10.0 ** np.asarray(paired_decimals, dtype=np.float64)
+    dtype = object if exact else np.float64
+    reserve0 = np.asarray(reserve0, dtype=dtype)
+    reserve1 = np.asarray(reserve1, dtype=dtype)
+    my_lp = np.asarray(my_lp, dtype=dtype)
+    total_lp = np.asarray(total_lp, dtype=dtype)
+    empty = total_lp == 0
+    if empty.any():
+        my_lp = np.where(empty, 0, my_lp)
+        total_lp = np.where(empty, 1, total_lp)
+
+    reserve_token = np.where(flags, reserve0, reserve1)
+    reserve_paired = np.where(flags, reserve1, reserve0)
+    if exact:
+        # int * int stays exact, int / int is correctly rounded to float
+        token = (reserve_token * my_lp / total_lp).astype(np.float64) / token_scale
+        paired = (reserve_paired * my_lp / total_lp).astype(np.float64) / paired_scale
+    else:
+        share = my_lp / total_lp
+        token = reserve_token * share / token_scale
+        paired = reserve_paired * share / paired_scale
+    return token, paired
+
+
+def pending_rewards(amount: Sequence[int], reward_debt: Sequence[int], token_per_block: Sequence[int], lp_supply: Sequence[int],
+                    acc_rewards_per_share: Sequence[int], last_reward_block: Sequence[int], end_of_epoch_block: Sequence[int],
+                    block: Sequence[int], decimals: Sequence[int], exact: bool = False) -> np.ndarray:
+    """
+    Rewards owed to vault positions at a block, one position per element, as the vault's pendingRewards computes them:
+        acc = accRewardsPerShare + (min(block, endOfEpochBlock) - lastRewardBlock) * tokenPerBlock * 1e12 / lpSupply
+        pending = (amount * acc / 1e12 - rewardDebt) / 10**decimals
+    The pool columns come from poolInfo and amount, rewardDebt from userInfo, so one poolInfo read serves every wallet.
+
+    Args:
+    amount, reward_debt (Sequence[int]): userInfo of the position.
+    token_per_block, lp_supply, acc_rewards_per_share, last_reward_block, end_of_epoch_block (Sequence[int]): poolInfo of its pid.
+    block (Sequence[int]): Block the rewards are computed at.
+    decimals (Sequence[int]): Decimals of the rewards token.
+    exact (bool): Integer math, like the contract, on object arrays. See lp_share_amounts.
+
+    Returns:
+    np.ndarray: Pending rewards in rewards tokens, as float64. Never negative.
+    """
+    elapsed = np.minimum(np.asarray(block, dtype=np.int64), np.asarray(end_of_epoch_block, dtype=np.int64)) - \
+        np.asarray(last_reward_block, dtype=np.int64)
+    elapsed = np.maximum(elapsed, 0)
+    scale = 10.0 ** np.asarray(decimals, dtype=np.float64)
+    dtype = object if exact else np.float64
+    amount = np.asarray(amount, dtype=dtype)
+    reward_debt = np.asarray(reward_debt, dtype=dtype)
+    token_per_block = np.asarray(token_per_block, dtype=dtype)
+    lp_supply = np.asarray(lp_supply, dtype=dtype)
+    acc = np.asarray(acc_rewards_per_share, dtype=dtype)
+    elapsed = elapsed.astype(dtype)
+
+    # nothing accrues to an empty pool
+    has_supply = lp_supply > 0
+    supply = np.where(has_supply, lp_supply, 1)
+    if exact:
+        acc = acc + np.where(has_supply, elapsed * token_per_block * ACC_REWARDS_PRECISION // supply, 0)
+        pending = amount * acc // ACC_REWARDS_PRECISION - reward_debt
+    else:
+        acc = acc + np.where(has_supply, elapsed * token_per_block * ACC_REWARDS_PRECISION / supply, 0)
+        pending = amount * acc / ACC_REWARDS_PRECISION - reward_debt
+    return np.maximum(pending, 0).astype(np.float64) / scale
+
+
+def sum_by_key(keys: Sequence[Any], amounts: Sequence[float]) -> Dict[Any, float]:
+    """
+    Sums amounts sharing a key (e.g. symbol, or (wallet, symbol)) in one pass.
+    """
+    if not len(keys):
+        return dict()
+    unique, index = np.unique(np.asarray(keys, dtype=object), return_inverse=True)
+    totals = np.bincount(index, weights=np.asarray(amounts, dtype=np.float64), minlength=len(unique))
+    return {key: float(total) for key, total in zip(unique.tolist(), totals)}
+
+
+def value_amounts(symbols: Sequence[str], amounts: Sequence[float], symbol_prices: Dict[str, float]) -> np.ndarray:
+    """
+    USD value of every amount; NaN where the symbol has no price.
+    """
+    prices = np.array([symbol_prices.get(x, np.nan) for x in symbols], dtype=np.float64)
+    return prices * np.asarray(amounts, dtype=np.float64)
+
+
+def lp_share_amounts_loop(positions: List[Tuple[int, int, int, int, bool, int, int]]) -> List[Tuple[float, float]]:
+    """
+    Reference implementation, one position at a time, as TokenYield.get_yield computed it.
+    """
+    results = []
+    for reserve0, reserve1, my_lp, total_lp, is_token0, decimals, paired_decimals in positions:
+        if not total_lp:
+            results.append((0.0, 0.0))
+        elif is_token0:
+            results.append((reserve0 * my_lp / total_lp / (10 ** decimals), reserve1 * my_lp / total_lp / (10 ** paired_decimals)))
+        else:
+            results.append((reserve1 * my_lp / total_lp / (10 ** decimals), reserve0 * my_lp / total_lp / (10 ** paired_decimals)))
+    return results
+
+
+def benchmark(count: int, seed: int = 0) -> None:
+    """
+    Times the loop against both kernel paths on random positions and reports the largest relative difference.
+    """
+    rng = random.Random(seed)
+    positions = []
+    for _ in range(count):
+        total_lp = rng.randrange(10 ** 18, 10 ** 24)
+        positions.append((rng.randrange(1, 2 ** 112), rng.randrange(1, 2 ** 112), rng.randrange(0, total_lp), total_lp,
+                          rng.random() < 0.5, rng.choice([6, 8, 18]), rng.choice([6, 18])))
+    columns = list(zip(*positions))
+
+    started = time.perf_counter()
+    expected = lp_share_amounts_loop(positions)
+    loop_time = time.perf_counter() - started
+    expected = np.array(expected, dtype=np.float64).T
+
+    print(f'{count} positions')
+    print(f'  loop:   {loop_time * 1000:9.2f} ms')
+    for exact in (False, True):
+        started = time.perf_counter()
+        token, paired = lp_share_amounts(*columns, exact=exact)
+        elapsed = time.perf_counter() - started
+        with np.errstate(divide='ignore', invalid='ignore'):
+            error = np.nanmax(np.abs(np.stack([token, paired]) - expected) / np.abs(expected))
+        name = 'exact' if exact else 'float'
+        print(f'  {name}:  {elapsed * 1000:9.2f} ms  ({loop_time / elapsed:5.1f}x, max relative difference {error:.1e})')
+
+    # most of the float path is converting python ints; columns kept as arrays (e.g. read from history) skip it
+    arrays = [np.asarray(x, dtype=np.float64) for x in columns[:4]] + [np.asarray(x) for x in columns[4:]]
+    started = time.perf_counter()
+    lp_share_amounts(*arrays)
+    elapsed = time.perf_counter() - started
+    print(f'  arrays: {elapsed * 1000:9.2f} ms  ({loop_time / elapsed:5.1f}x, float path on float64 columns)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the LP valuation kernel against the per-position loop.')
+    parser.add_argument('--positions', type=int, nargs='+', default=[1000, 100000, 1000000])
+    args = parser.parse_args()
+    for count in args.positions:
+        benchmark(count)
+
+
+if __name__ == '__main__':
+    main()
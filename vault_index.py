@@ -0,0 +1,93 @@
+from typing import Any, Dict, List, Set
+from metadata_cache import MetadataCache, get_metadata_cache
+
+# Index of MasterChef style vaults (yield vaults and unbonded staking): which pid stakes which token, and the token rewards are paid in.
+# Pids are only ever appended to a vault, so the index is kept in the metadata lock file and a vault is
+# scanned again only when its poolLength grew, and only for the new pids.
+
+
+def vault_stakes(token_data_list: List[Dict[str, Any]]) -> Dict[str, Dict[str, Set[str]]]:
+    """
+    Tokens whose pid is needed, by vault, by chain: the token itself for unbonded staking and the pair for LP vaults.
+    """
+    from web3 import Web3
+
+    stakes: Dict[str, Dict[str, Set[str]]] = dict()
+    for token_data in token_data_list:
+        blockchain = token_data.get('blockchain')
+        unbonded = token_data.get('unbondedStaking') or {}
+        if unbonded.get('contractAddress') and token_data.get('tokenAddress'):
+            vault = Web3.to_checksum_address(unbonded['contractAddress'])
+            stakes.setdefault(blockchain, {}).setdefault(vault, set()).add(Web3.to_checksum_address(token_data['tokenAddress']))
+        for lp_dict in token_data.get('liquidityPool', []):
+            if lp_dict.get('liquidityTokenStakingAddress') and lp_dict.get('liquidityPoolAddress'):
+                vault = Web3.to_checksum_address(lp_dict['liquidityTokenStakingAddress'])
+                stakes.setdefault(blockchain, {}).setdefault(vault, set()).add(Web3.to_checksum_address(lp_dict['liquidityPoolAddress']))
+    return stakes
+
+
+def discover_vault_pids(token_data_list: List[Dict[str, Any]], cache: MetadataCache = None) -> Dict[str, List[str]]:
+    """
+    Makes sure the index has the pid of every staked token of the config. Vaults missing a token get one
+    batched round of poolLength and rewardsToken per chain, then one round of lpToken for the pids added since the last scan.
+    Nothing is read when every token is indexed. The lock file is saved if the index changed.
+
+    Args:
+    token_data_list (List[Dict[str, Any]]): Token entries of tokenInfo.json.
+    cache (MetadataCache): Index to complete. Defaults to the process-wide metadata cache.
+
+    Returns:
+    Dict[str, List[str]]: The vaults scanned again, by chain.
+    """
+    from web3 import Web3
+    from abi_registry import get_contract
+    from chain_clients import RPC_ENV_VARS, get_chain_client
+
+    cache = cache or get_metadata_cache()
+    scanned = dict()
+    for blockchain, stakes in vault_stakes(token_data_list).items():
+        missing = sorted(vault for vault, tokens in stakes.items()
+                         if 'rewardsToken' not in (cache.get_vault(blockchain, vault) or {})
+                         or any(cache.get_vault_pid(blockchain, vault, token) is None for token in tokens))
+        if not missing or blockchain not in RPC_ENV_VARS:
+            continue
+        try:
+            client = get_chain_client(blockchain)
+            batch = client.make_batch()
+            # unbonded staking has the same poolLength/lpToken/userInfo interface as the yield vaults
+            with batch.tagged('vaults'):
+                length_calls = {vault: batch.add(get_contract(client.web3, blockchain, vault, 'yieldVault'), 'poolLength') for vault in missing}
+                rewards_calls = {vault: batch.add(get_contract(client.web3, blockchain, vault, 'yieldVault'), 'rewardsToken') for vault in missing}
+            batch.execute()
+
+            batch = client.make_batch()
+            token_calls = dict()
+            with batch.tagged('vaults'):
+                for vault, call in length_calls.items():
+                    if not call.success:
+                        print(f'Error reading poolLength of vault {vault} on {blockchain}: {call.error}')
+                        continue
+                    known = (cache.get_vault(blockchain, vault) or {}).get('poolLength', 0)
+                    contract = get_contract(client.web3, blockchain, vault, 'yieldVault')
+                    token_calls[vault] = (call.value, [(pid, batch.add(contract, 'lpToken', pid)) for pid in range(known, call.value)])
+            batch.execute()
+        except Exception as e:
+            print(f'Error scanning vaults on {blockchain}: {e}')
+            continue
+
+        for vault, (pool_length, calls) in token_calls.items():
+            # pids from the first that did not answer on are scanned again by the next sweep
+            answered = [(pid, call) for pid, call in calls if call.success]
+            if len(answered) < len(calls):
+                print(f'Error reading {len(calls) - len(answered)} pids of vault {vault} on {blockchain}')
+                pool_length = next(pid for pid, call in calls if not call.success)
+            rewards_token = Web3.to_checksum_address(rewards_calls[vault].value) if rewards_calls[vault].success else None
+            cache.set_vault(blockchain, vault, pool_length, {Web3.to_checksum_address(call.value): pid for pid, call in answered}, rewards_token)
+            scanned.setdefault(blockchain, []).append(vault)
+
+    if scanned and cache.path:
+        try:
+            cache.save()
+        except Exception as e:
+            print(f'Error saving the vault index to {cache.path}: {e}')
+    return scanned
@@ -0,0 +1,271 @@
+from typing import Any, Dict, List, Optional, Set, Tuple
+import argparse
+import time
+from datetime import datetime
+from eth_utils import event_abi_to_log_topic
+from web3 import Web3
+from abi_registry import get_abi, get_contract
+from chain_clients import get_chain_client
+from mainV4 import TokenPortfolio, TokenYield, MULTICALL_CHUNK_SIZE, load_token_data
+from metrics import write_metrics
+from scheduler import PRIORITY_PRICING
+from snapshot import take_snapshot
+
+DEFAULT_POLL_INTERVAL = 12
+# widest block range requested with one eth_getLogs; a longer gap is handled with a full refresh
+DEFAULT_MAX_RANGE = 2000
+
+
+def event_topic(abi_name: str, event_name: str) -> str:
+    """
+    Returns topic0 of an event in ABI/<abi_name>.json.
+    """
+    matches = [x for x in get_abi(abi_name) if x.get('type') == 'event' and x.get('name') == event_name]
+    if not matches:
+        raise Exception(f'Error in event_topic: no event {event_name} in {abi_name}')
+    return '0x' + event_abi_to_log_topic(matches[0]).hex()
+
+
+def address_topic(address: str) -> str:
+    """
+    An address as an indexed event argument.
+    """
+    return '0x' + address[2:].lower().rjust(64, '0')
+
+
+class PortfolioWatcher:
+    def __init__(self, portfolio: TokenPortfolio, max_range: int = DEFAULT_MAX_RANGE):
+        """
+        Follows new blocks and keeps a valued portfolio up to date from event logs. Each poll asks every chain
+        only for the logs that can change a position or a price:
+            - Sync of every liquidity pool read by a token or used for pricing (reserves and LP supply)
+            - Transfer of the tokens and LP tokens from or to one of the wallets
+            - Deposit/Withdraw/EmergencyWithdraw/Harvest of the yield vaults and unbonded staking by one of the wallets,
+              and Deposit/Withdraw/EmergencyWithdraw to one of them
+            - SubmitStake/WithdrawStake/ClaimStake of the bonded staking by one of the wallets
+        Only the tokens and pricing pools touched by a log are read again; blocks without such logs cost
+        one eth_getBlockByNumber and a few eth_getLogs per chain.
+
+        Args:
+        portfolio (TokenPortfolio): A portfolio on which get_net_value has been called.
+        max_range (int): Widest block range fetched with eth_getLogs before falling back to a full refresh.
+        """
+        self.portfolio = portfolio
+        self.max_range = max_range
+        self.wallet_topics = [address_topic(x) for x in portfolio.wallets]
+        self.last_blocks: Dict[str, int] = dict()
+        if portfolio.snapshot:
+            self.last_blocks = {blockchain: block[0] for blockchain, block in portfolio.snapshot.blocks.items()}
+
+        self.topics = {
+            'sync': event_topic('pair', 'Sync'),
+            'transfer': event_topic('ERC20', 'Transfer'),
+            'vault': [event_topic('yieldVault', x) for x in ('Deposit', 'Withdraw', 'EmergencyWithdraw', 'Harvest')],
+            'bonded': [event_topic('singularityTokenStake', x) for x in ('SubmitStake', 'WithdrawStake', 'ClaimStake')],
+        }
+        self.build_interest()
+
+    def build_interest(self) -> None:
+        """
+        Maps every watched contract to the tokens reading it, per chain.
+        """
+        self.pools: Dict[str, Dict[str, Set[TokenYield]]] = dict()
+        self.transfers: Dict[str, Dict[str, Set[TokenYield]]] = dict()
+        self.vaults: Dict[str, Dict[str, Set[TokenYield]]] = dict()
+        self.bonded: Dict[str, Dict[str, Set[TokenYield]]] = dict()
+
+        for token in self.portfolio.tokens:
+            chain = token.blockchain
+            self.transfers.setdefault(chain, dict()).setdefault(token.token_address, set()).add(token)
+            if token.unbonded_staking_address:
+                self.vaults.setdefault(chain, dict()).setdefault(token.unbonded_staking_address, set()).add(token)
+            if token.bonded_staking_address and 'bondedStaking' in token.calls:
+                self.bonded.setdefault(chain, dict()).setdefault(token.bonded_staking_address, set()).add(token)
+            for lp_dict, calls in zip(token.liquidity_pool_info_list, token.calls.get('liquidityPool', [])):
+                if not calls:
+                    continue
+                pool = token.checksum_address(lp_dict.get('liquidityPoolAddress'))
+                self.pools.setdefault(chain, dict()).setdefault(pool, set()).add(token)
+                self.transfers.setdefault(chain, dict()).setdefault(pool, set()).add(token)
+                vault = token.checksum_address(lp_dict.get('liquidityTokenStakingAddress'))
+                if vault:
+                    self.vaults.setdefault(chain, dict()).setdefault(vault, set()).add(token)
+
+        # pricing pools are watched even if no position is in them
+        for blockchain, pools in self.portfolio.price_graph.get_pools_by_chain().items():
+            for pool in pools:
+                self.pools.setdefault(blockchain, dict()).setdefault(pool, set())
+
+    def log_filters(self, blockchain: str, from_block: int, to_block: int) -> List[Dict[str, Any]]:
+        """
+        The eth_getLogs filters of one chain for a block range.
+        """
+        block_range = {'fromBlock': from_block, 'toBlock': to_block}
+        filters = []
+        if self.pools.get(blockchain):
+            filters.append({**block_range, 'address': sorted(self.pools[blockchain]), 'topics': [self.topics['sync']]})
+        if self.transfers.get(blockchain):
+            addresses = sorted(self.transfers[blockchain])
+            filters.append({**block_range, 'address': addresses, 'topics': [self.topics['transfer'], self.wallet_topics]})
+            filters.append({**block_range, 'address': addresses, 'topics': [self.topics['transfer'], None, self.wallet_topics]})
+        if self.vaults.get(blockchain):
+            addresses = sorted(self.vaults[blockchain])
+            filters.append({**block_range, 'address': addresses, 'topics': [self.topics['vault'], self.wallet_topics]})
+            # (user, pid, amount, to): a deposit can be credited to a wallet that did not send it
+            filters.append({**block_range, 'address': addresses, 'topics': [self.topics['vault'], None, None, self.wallet_topics]})
+        if self.bonded.get(blockchain):
+            filters.append({**block_range, 'address': sorted(self.bonded[blockchain]), 'topics': [self.topics['bonded'], None, self.wallet_topics]})
+        return filters
+
+    def affected_by(self, blockchain: str, logs: List[Dict[str, Any]]) -> Tuple[Set[TokenYield], Set[str]]:
+        """
+        Returns the tokens to read again and the pools whose reserves changed.
+        """
+        tokens = set()
+        pools = set()
+        for log in logs:
+            address = Web3.to_checksum_address(log['address'])
+            topic = Web3.to_hex(log['topics'][0])
+            if topic == self.topics['sync']:
+                pools.add(address)
+                tokens.update(self.pools.get(blockchain, {}).get(address, set()))
+                continue
+
+            # a wallet argument limits the update to that wallet's tokens; the vault events have the wallet as topic 1 or 3
+            wallets = {Web3.to_checksum_address('0x' + Web3.to_hex(x)[-40:]) for x in log['topics'][1:]}
+            for contracts in (self.transfers, self.vaults, self.bonded):
+                tokens.update(x for x in contracts.get(blockchain, {}).get(address, set()) if x.wallet in wallets)
+        return tokens, pools
+
+    def poll(self) -> bool:
+        """
+        Applies every block mined since the last poll.
+
+        Returns:
+        bool: True if a position or a price changed.
+        """
+        snapshot = take_snapshot(self.last_blocks or {x.blockchain for x in self.portfolio.tokens})
+        changed = False
+        for blockchain in snapshot.blocks:
+            head = snapshot.block(blockchain)
+            last = self.last_blocks.get(blockchain)
+            if last is not None and head <= last:
+                continue
+            try:
+                if last is None or head - last > self.max_range:
+                    tokens = {x for x in self.portfolio.tokens if x.blockchain == blockchain}
+                    pools = set(self.pools.get(blockchain, {}))
+                else:
+                    logs = []
+                    for log_filter in self.log_filters(blockchain, last + 1, head):
+                        logs.extend(get_chain_client(blockchain).web3.eth.get_logs(log_filter))
+                    tokens, pools = self.affected_by(blockchain, logs)
+                self.update(blockchain, head, tokens, pools)
+                self.last_blocks[blockchain] = head
+                changed = changed or bool(tokens or pools)
+            except Exception as exc:
+                print(f'Error watching {blockchain} at block {head} error: {exc}')
+
+        self.portfolio.snapshot = snapshot
+        return changed
+
+    def update(self, blockchain: str, block: int, tokens: Set[TokenYield], pools: Set[str]) -> None:
+        """
+        Reads the affected tokens and pricing pools again at block, in one batch sent in two rounds (balances,
+        then the state of pools with a position), computes their pending rewards again, and applies the differences
+        to all_tokens, wallet_holdings and the prices.
+        """
+        if not tokens and not pools:
+            return
+
+        batch = get_chain_client(blockchain).make_batch(MULTICALL_CHUNK_SIZE)
+        for token in tokens:
+            token.queue_token_data(batch)
+        pricing_pools = [x for x in pools if (blockchain, x) in self.portfolio.reserves]
+        web3 = get_chain_client(blockchain).web3
+        with batch.tagged('pricing', PRIORITY_PRICING):
+            reserve_calls = {pool: batch.add(get_contract(web3, blockchain, pool, 'pair'), 'getReserves') for pool in pricing_pools}
+        batch.execute(block)
+        # then the pools the wallets have a position in
+        for token in tokens:
+            token.queue_pool_state(batch)
+        batch.execute(block)
+
+        refreshed = []
+        for token in tokens:
+            before = dict(token.get_all_assets() or {})
+            try:
+                token.fetch_token_data()
+            except Exception as exc:
+                # keep the last known position
+                print(f'Error refreshing {token.symbol} for {token.wallet} error: {exc}')
+                continue
+            refreshed.append((token, before))
+        # the LP refresh keeps the last rewards, compute them again from the new userInfo and poolInfo
+        self.portfolio.collect_rewards([token for token, _ in refreshed], {blockchain: block})
+        for token, before in refreshed:
+            token.calculate_totals()
+            self.apply_delta(token.wallet, token.blockchain, before, token.get_all_assets())
+
+        for pool, call in reserve_calls.items():
+            try:
+                self.portfolio.reserves[(blockchain, pool)] = call.value
+            except Exception as e:
+                print(f'Error fetching reserves of pool {pool}: {e}')
+
+    def apply_delta(self, wallet: str, blockchain: str, before: Dict[str, float], after: Dict[str, float]) -> None:
+        portfolio = self.portfolio
+        holdings = portfolio.wallet_holdings.setdefault(wallet, dict())
+        chain_holdings = portfolio.wallet_holdings_by_chain.setdefault(wallet, dict())
+        for symbol in set(before) | set(after):
+            delta = after.get(symbol, 0) - before.get(symbol, 0)
+            key = (blockchain, symbol)
+            portfolio.all_tokens[symbol] = portfolio.all_tokens.get(symbol, 0) + delta
+            holdings[symbol] = holdings.get(symbol, 0) + delta
+            portfolio.holdings_by_chain[key] = portfolio.holdings_by_chain.get(key, 0) + delta
+            chain_holdings[key] = chain_holdings.get(key, 0) + delta
+
+    def get_net_value(self) -> float:
+        """
+        Net value from the current holdings and reserves, without any network I/O.
+        """
+        portfolio = self.portfolio
+        portfolio.prices = portfolio.price_graph.get_prices(portfolio.reserves)
+        portfolio.symbol_prices = portfolio.price_graph.get_symbol_prices(portfolio.prices)
+        portfolio.wallet_values = {wallet: portfolio.value_holdings(portfolio.prices, holdings, verbose=False)
+                                   for wallet, holdings in portfolio.wallet_holdings_by_chain.items()}
+        return portfolio.value_holdings(portfolio.prices, verbose=False)
+
+    def run(self, poll_interval: float = DEFAULT_POLL_INTERVAL, iterations: Optional[int] = None) -> None:
+        """
+        Polls forever (or `iterations` times) and prints the net value whenever it changes.
+        """
+        count = 0
+        while iterations is None or count < iterations:
+            started = time.time()
+            if self.poll():
+                blocks = ', '.join(f'{k} {v}' for k, v in sorted(self.last_blocks.items()))
+                print(f'{datetime.now().isoformat()} [{blocks}] net value: {self.get_net_value()}')
+            write_metrics()
+            count += 1
+            if iterations is None or count < iterations:
+                time.sleep(max(0, poll_interval - (time.time() - started)))
+
+
+def main():
+    """
+    Watch mode: values the portfolio once, then follows new blocks.
+    """
+    parser = argparse.ArgumentParser(description='Keep the portfolio value up to date from new blocks.')
+    parser.add_argument('--config', default='tokenInfo.json', help='token config (default: tokenInfo.json)')
+    parser.add_argument('--interval', type=float, default=DEFAULT_POLL_INTERVAL, help='seconds between polls')
+    parser.add_argument('--max-range', type=int, default=DEFAULT_MAX_RANGE, help='widest eth_getLogs block range')
+    args = parser.parse_args()
+
+    portfolio = TokenPortfolio(load_token_data(args.config))
+    print(f'net value: {portfolio.get_net_value()}')
+    PortfolioWatcher(portfolio, args.max_range).run(args.interval)
+
+
+if __name__ == '__main__':
+    main()